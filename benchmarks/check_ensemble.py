@@ -0,0 +1,75 @@
+'''
+    Check of mhwEnsemble.detectEnsemble against marineHeatWaves.detect and
+    marineHeatWaves.blockAverage applied to each member and cell in turn, on
+    a synthetic ensemble whose record starts and ends within a year (as the
+    SST_extremes record, from 1 September 1981), for heat waves and cold
+    spells, with the default and a fixed climatology period and padding,
+    and of its padding of all series at once against marineHeatWaves.pad
+
+    Usage: python benchmarks/check_ensemble.py [nMembers]
+'''
+
+
+import os
+import sys
+import time
+import warnings
+import numpy as np
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import marineHeatWaves as mhw
+import mhwEnsemble
+
+
+if __name__ == '__main__':
+
+    M = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    warnings.simplefilter('ignore', RuntimeWarning)
+
+    t = np.arange(date(1982, 3, 15).toordinal(), date(1993, 8, 20).toordinal()+1)
+    # Seasonal cycle plus a persistent (AR(1)) anomaly, with a gap in one cell
+    noise = np.random.RandomState(4).randn(M, len(t), 2, 2)
+    for i in range(1, len(t)):
+        noise[:, i] += 0.8*noise[:, i-1]
+    temp = 20 + 3*np.cos(2*np.pi*t/365.25)[None, :, None, None] + 0.3*noise
+    temp[M-1, 200:204, 0, 1] = np.nan
+
+    # Padding of random gappy series, all at once and one by one
+    rng = np.random.RandomState(3)
+    for i in range(200):
+        series = 10*rng.randn(rng.randint(5, 80), rng.randint(1, 6))
+        series[rng.rand(*series.shape) < 0.8*rng.rand()] = np.nan
+        for maxPadLength in [1, 2, 7, 100]:
+            padded = mhwEnsemble._padColumns(series, maxPadLength)
+            for c in range(series.shape[1]):
+                expected = mhw.pad(series[:, c], maxPadLength=maxPadLength) if (~np.isnan(series[:, c])).any() else series[:, c]
+                assert np.array_equal(padded[:, c], expected, equal_nan=True), (i, maxPadLength, c)
+    print('padding of all series at once: same as marineHeatWaves.pad')
+
+    for coldSpells in [False, True]:
+        for options in [{}, {'climatologyPeriod': [1984, 1991], 'maxPadLength': 5, 'blockLength': 3}]:
+            start = time.time()
+            mhws, clim, mhwBlock, spread = mhwEnsemble.detectEnsemble(t, temp, coldSpells=coldSpells, **options)
+            elapsed = time.time() - start
+            blockLength = options.get('blockLength', 1)
+            detectOptions = dict((key, options[key]) for key in options if key != 'blockLength')
+            for m in range(M):
+                for cell in range(4):
+                    series = temp[m, :, cell // 2, cell % 2]
+                    mhwsCell, climCell = mhw.detect(t, series, coldSpells=coldSpells, **detectOptions)
+                    sel = (mhws['member'] == m) & (mhws['cell'] == cell)
+                    assert sel.sum() == mhwsCell['n_events'], (m, cell, sel.sum(), mhwsCell['n_events'])
+                    for key in mhwsCell.keys():
+                        if (key == 'n_events') + key.startswith('date_'):
+                            continue
+                        expected = np.asarray(mhwsCell[key])
+                        if expected.dtype.kind in 'iU':
+                            assert np.array_equal(mhws[key][sel], expected), key
+                        else:
+                            assert np.allclose(mhws[key][sel], expected, rtol=1e-9, atol=1e-9), key
+                    blockCell = mhw.blockAverage(t, mhwsCell, climCell, blockLength=blockLength, temp=series)
+                    for key in blockCell.keys():
+                        value = mhwBlock[key] if key.startswith('years_') else mhwBlock[key][:, m, cell // 2, cell % 2]
+                        assert np.allclose(value, blockCell[key], equal_nan=True, atol=1e-9), key
+            print('coldSpells=%-5s %-60s %4d events, %.2f s: same as detect' % (coldSpells, options, len(mhws['member']), elapsed))
@@ -0,0 +1,172 @@
+'''
+    Equivalence checks of the batched and reduced-precision paths against
+    marineHeatWaves.detect (and blockAverage) applied to each cell in turn, on
+    a synthetic grid whose record starts and ends within a year (as the
+    SST_extremes record, from 1 September 1981), with gaps:
+      marineHeatWaves.climatology  thresholds and seasonal cycle identical to the
+                                   original per day-of-year np.percentile loop
+      detect in float32            same events, float properties to 1e-4 deg. C
+      mhwGrid.detectGrid           same events, also in compact form
+      mhwGrid.blockAverageGrid     same block averages
+      mhwClim.ClimatologyAccumulator, fed in shuffled chunks and merged
+                                   identical thresholds, seas to rounding
+      mhwClim.ClimatologySketch    thresholds within its error bound
+      mhwKernel.detectEvents       same events, float properties to rounding,
+                                   for each available backend
+    Each check raises an AssertionError on failure.
+
+    Usage: python benchmarks/check_equivalence.py [nCells] [nYears]
+'''
+
+
+import os
+import sys
+import warnings
+import numpy as np
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import marineHeatWaves as mhw
+import mhwClim
+import mhwGrid
+import mhwKernel
+
+
+def baselineClimYear(doyClim, tempClim, pctile, windowHalfWidth=5):
+    # Threshold and seasonal cycle (unsmoothed, Feb 29 interpolated) as computed by
+    # the original marineHeatWaves.detect: np.percentile of each day-of-year window
+    TClim = len(tempClim)
+    thresh_climYear = np.nan*np.zeros(366)
+    seas_climYear = np.nan*np.zeros(366)
+    for d in range(1, 367):
+        if d == mhw.feb29:
+            continue
+        tt0 = np.where(doyClim == d)[0]
+        tt = np.array([])
+        for w in range(-windowHalfWidth, windowHalfWidth+1):
+            tt = np.append(tt, tt0 + w)
+        tt = tt[(tt >= 0) & (tt < TClim)].astype(int)
+        thresh_climYear[d-1] = np.percentile(mhw.nonans(tempClim[tt]), pctile)
+        seas_climYear[d-1] = np.mean(mhw.nonans(tempClim[tt]))
+    for climYear in [thresh_climYear, seas_climYear]:
+        climYear[mhw.feb29-1] = 0.5*climYear[mhw.feb29-2] + 0.5*climYear[mhw.feb29]
+    return thresh_climYear, seas_climYear
+
+
+def compareEvents(a, b, sel=slice(None), tolerance=1e-12):
+    # Largest difference of the float properties of event table b (restricted to
+    # sel) to the events of a single detect call a, after checking the events match
+    assert len(np.asarray(b['index_start'])[sel]) == a['n_events']
+    worst = 0.
+    for key in a.keys():
+        if (key == 'n_events') + key.startswith('date_'):
+            continue
+        expected = np.asarray(a[key])
+        value = np.asarray(b[key])[sel]
+        if key == 'category':
+            value = mhw.categories[value - 1] if value.dtype.kind == 'i' else value
+            assert np.array_equal(value, expected), key
+        elif expected.dtype.kind in 'iu':
+            assert np.array_equal(value, expected), key
+        elif len(expected) > 0:
+            difference = np.nanmax(np.abs(value - expected) / np.maximum(np.abs(expected), 1.))
+            assert difference <= tolerance, (key, difference)
+            worst = max(worst, difference)
+    return worst
+
+
+if __name__ == '__main__':
+
+    nCells = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    nYears = int(sys.argv[2]) if len(sys.argv) > 2 else 36
+    warnings.simplefilter('ignore', RuntimeWarning)
+
+    t = np.arange(date(1981, 9, 1).toordinal(), date(1981 + nYears, 6, 30).toordinal()+1)
+    T = len(t)
+    # Seasonal cycle plus a persistent (AR(1)) anomaly, with short and long gaps
+    rng = np.random.RandomState(0)
+    noise = rng.randn(T, nCells)
+    for i in range(1, T):
+        noise[i] += 0.9*noise[i-1]
+    temp = 24 + 3*np.cos(2*np.pi*(t[:, np.newaxis] - t[0])/365.25 + rng.rand(nCells)) + 0.3*noise
+    temp[400:403, 0] = np.nan
+    temp[2000:2040, nCells-1] = np.nan
+    padded = np.stack([mhw.pad(temp[:, c], maxPadLength=3) for c in range(nCells)], 1)
+    doy = mhw.calendar(t)[3]
+    report = '%-12s %-24s %s'
+    print('Synthetic grid: %d days (%s to %s) x %d cells' % (T, date.fromordinal(t[0]), date.fromordinal(t[-1]), nCells))
+
+    # Climatology against the original np.percentile loop, exactly, for scalar pctiles
+    for pctile in [90, 10, 99, 97.5]:
+        for c in range(nCells):
+            expected = baselineClimYear(doy, padded[:, c], pctile)
+            climYear = mhw.climatology(doy, padded[:, c], 0, T-1, pctile=pctile, smoothPercentile=False)
+            for name, value, baseline in zip(['thresh', 'seas'], climYear, expected):
+                assert np.array_equal(value, baseline, equal_nan=True), (name, pctile, c)
+    print(report % ('climatology', 'marineHeatWaves', 'identical to np.percentile (pctile 90, 10, 99, 97.5)'))
+
+    for coldSpells in [False, True]:
+        kind = 'cold spells' if coldSpells else 'heat waves'
+        cells = [mhw.detect(t, temp[:, c], coldSpells=coldSpells, maxPadLength=3) for c in range(nCells)]
+        thresh = np.stack([cell[1]['thresh'] for cell in cells], 1)
+        seas = np.stack([cell[1]['seas'] for cell in cells], 1)
+
+        # float32 detection
+        worst = 0.
+        for c in range(nCells):
+            mhws32 = mhw.detect(t, temp[:, c], coldSpells=coldSpells, maxPadLength=3, dtype=np.float32)[0]
+            worst = max(worst, compareEvents(cells[c][0], mhws32, tolerance=1e-4))
+        print(report % (kind, 'detect float32', 'same events, max difference %.1e' % worst))
+
+        # Gridded detection and block averages, full and compact
+        for compact in [False, True]:
+            mhwsGrid, climGrid = mhwGrid.detectGrid(t, temp, dtype=np.float64, compact=compact, coldSpells=coldSpells, maxPadLength=3)
+            worst = 0.
+            for c in range(nCells):
+                worst = max(worst, compareEvents(cells[c][0], mhwsGrid, mhwsGrid['cell'] == c))
+                for key in ['thresh', 'seas', 'missing']:
+                    assert np.array_equal(climGrid[key][:, c], cells[c][1][key], equal_nan=(key != 'missing')), key
+            mhwBlock = mhwGrid.blockAverageGrid(t, mhwsGrid, climGrid, blockLength=2, removeMissing=True, temp=temp)
+            for c in range(nCells):
+                blockCell = mhw.blockAverage(t, cells[c][0], cells[c][1], blockLength=2, removeMissing=True, temp=temp[:, c])
+                for key in blockCell.keys():
+                    value = mhwBlock[key] if key.startswith('years_') else mhwBlock[key][:, c]
+                    assert np.allclose(value, blockCell[key], equal_nan=True, rtol=1e-12, atol=1e-12), key
+            print(report % (kind, 'detectGrid' + (' (compact)' if compact else ''),
+                            'same events, max difference %.1e, same block averages' % worst))
+
+        # Climatology accumulated from shuffled chunks in two parts, then merged
+        series = -padded if coldSpells else padded
+        period = [1981, 1981 + nYears]
+        parts = []
+        bounds = np.concatenate(([0], np.sort(rng.randint(0, T, 7)), [T]))
+        order = rng.permutation(len(bounds) - 1)
+        for part in range(2):
+            acc = mhwClim.ClimatologyAccumulator(period, shape=(nCells,), record=[t[0], t[-1]])
+            for i in order[part::2]:
+                acc.add(t[bounds[i]:bounds[i+1]], series[bounds[i]:bounds[i+1]])
+            parts.append(acc)
+        clim = parts[0].merge(parts[1]).climatology()
+        sign = -1. if coldSpells else 1.
+        for c in range(nCells):
+            assert np.array_equal(sign*clim['thresh'][doy-1, c], cells[c][1]['thresh']), c
+            assert np.allclose(sign*clim['seas'][doy-1, c], cells[c][1]['seas'], rtol=0, atol=1e-12), c
+        print(report % (kind, 'ClimatologyAccumulator', 'identical thresholds'))
+
+        sketch = mhwClim.ClimatologySketch(period, shape=(nCells,), lo=-40., hi=40., record=[t[0], t[-1]])
+        sketch.add(t, series)
+        approx = sketch.climatology()
+        worst = np.max(np.abs(sign*approx['thresh'][doy-1] - thresh))
+        assert (sketch.outOfRange == 0).all() and (worst <= sketch.errorBound + 1e-12), worst
+        print(report % (kind, 'ClimatologySketch', 'max threshold error %.3f (bound %.3f)' % (worst, sketch.errorBound)))
+
+        # Event kernel against the detect climatology
+        backends = ['numpy'] + ([] if mhwKernel.numba is None else ['numba'])
+        for backend in backends:
+            mhwsKernel = mhwKernel.detectEvents(t, padded, thresh, seas, coldSpells=coldSpells, backend=backend)
+            worst = 0.
+            for c in range(nCells):
+                worst = max(worst, compareEvents(cells[c][0], mhwsKernel, mhwsKernel['cell'] == c))
+            print(report % (kind, 'mhwKernel (' + backend + ')', 'same events, max difference %.1e' % worst))
+        if mhwKernel.numba is None:
+            print(report % (kind, 'mhwKernel (numba)', 'not checked, numba is not installed'))
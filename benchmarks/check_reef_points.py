@@ -0,0 +1,47 @@
+'''
+    Check of reef_region.reef_points and reef_region.region_mean on the
+    SST_extremes files: every file (each holds a datetime time_bnds
+    variable) is averaged, the float variables match a plain mean over the
+    nearest cells of the points, and the other variables are passed through.
+    Every sample point must lie inside the reef region mask
+
+    Usage: python benchmarks/check_reef_points.py [data_dir]
+'''
+
+
+import os
+import sys
+import glob
+import numpy as np
+import xarray as xr
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+import reef_region
+
+
+if __name__ == '__main__':
+
+    dataDir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(root, 'SST_extremes')
+    files = sorted(glob.glob(os.path.join(dataDir, '*.nc')))
+    assert len(files) > 0, 'no NetCDF files in ' + dataDir
+
+    for fname in files:
+        data = xr.open_dataset(fname)
+        points = reef_region.reef_points(data)
+        reef_region.region_mean(data)
+        ilat, ilon = reef_region.nearest_indices(data['lat'].values, data['lon'].values)
+        mask = reef_region.polygon_mask(data['lat'].values, data['lon'].values)
+        outside = np.flatnonzero(~mask[ilat, ilon])
+        assert len(outside) == 0, 'sample points outside the reef region: %s' % outside
+        for name in data.data_vars:
+            if 'lat' not in data[name].dims:
+                assert points[name].equals(data[name]), name
+                continue
+            # Equal weights, NaN (e.g. land) left out of the mean
+            values = data[name].values[..., ilat, ilon]
+            with np.errstate(invalid='ignore'):
+                expected = np.nansum(values, axis=-1) / (~np.isnan(values)).sum(axis=-1)
+            assert np.allclose(points[name].values, expected, equal_nan=True), name
+        data.close()
+        print('%-24s OK' % os.path.basename(fname))
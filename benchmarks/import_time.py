@@ -0,0 +1,85 @@
+'''
+    Import time of each module, each in a fresh interpreter, with the heavy
+    dependencies (scipy.stats, xarray, matplotlib, cartopy) that importing
+    it loads, and the start-up time of a pool of detection workers (which
+    import only mhwClim and numpy) for each start method: fork (the default
+    on Linux, as used by mhwClim.accumulate), forkserver with mhwClim
+    preloaded (first pool, which starts the server, then a second pool),
+    and spawn (the default on macOS and Windows), whose workers each start
+    an interpreter and import numpy
+
+    Usage: python benchmarks/import_time.py [repeats] [processes]
+'''
+
+
+import os
+import sys
+import time
+import importlib
+import subprocess
+import multiprocessing
+
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+modules = ['marineHeatWaves', 'mhwGrid', 'mhwClim', 'mhwQuery', 'timeAxis', 'mhwTrack',
+           'mhwXarray', 'mhwSweep', 'reef_region', 'mhwstats', 'plot_SST_xtremes']
+heavy = ['scipy.stats', 'scipy.ndimage', 'xarray', 'matplotlib.pyplot', 'cartopy']
+
+probe = '''
+import sys, time
+start = time.perf_counter()
+import %s
+elapsed = time.perf_counter() - start
+print(elapsed, ' '.join(m for m in %r if m in sys.modules))
+'''
+
+
+def importTime(module, repeats):
+    # Best of repeats, each in a fresh interpreter so that nothing is cached
+    best, loaded = None, ''
+    for i in range(repeats):
+        out = subprocess.run([sys.executable, '-c', probe % (module, heavy)], cwd=root,
+                             capture_output=True, text=True)
+        if out.returncode != 0:
+            return None, out.stderr.strip().splitlines()[-1]
+        elapsed, _, loaded = out.stdout.strip().partition(' ')
+        best = float(elapsed) if best is None else min(best, float(elapsed))
+    return best, loaded
+
+
+def worker(module):
+    # Detection worker, as used by mhwClim.accumulate
+    return importlib.import_module(module).__name__
+
+
+def poolStart(method, processes):
+    # Time to start a pool of workers and run one (trivial) task in each
+    start = time.perf_counter()
+    with multiprocessing.get_context(method).Pool(processes) as pool:
+        pool.map(worker, ['mhwClim']*processes)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    print('%-18s %10s   %s' % ('module', 'import', 'heavy dependencies loaded'))
+    for module in modules:
+        elapsed, loaded = importTime(module, repeats)
+        if elapsed is None:
+            print('%-18s %10s   %s' % (module, 'failed', loaded))
+        else:
+            print('%-18s %7.0f ms   %s' % (module, 1e3*elapsed, loaded or '-'))
+
+    # As in mhwClim.accumulate, the calling process has imported mhwClim
+    import mhwClim
+    multiprocessing.get_context('forkserver').set_forkserver_preload([mhwClim.__name__])
+    print('\nStarting %d detection workers' % processes)
+    for method, label in [('fork', 'fork'), ('forkserver', 'forkserver (first)'),
+                          ('forkserver', 'forkserver'), ('spawn', 'spawn')]:
+        if method in multiprocessing.get_all_start_methods():
+            print('%-18s %7.0f ms' % (label, 1e3*poolStart(method, processes)))
@@ -0,0 +1,98 @@
+'''
+    Timing and check of the two backends of mhwKernel.detectEvents on a
+    synthetic grid with a fixed day-of-year climatology: the numba kernel
+    (parallel over the cells, timed after compilation) against the NumPy
+    stages of marineHeatWaves.detect, cell by cell, then on random short
+    gappy series (events at either end of the record, all-missing cells,
+    with and without gap joining, heat waves and cold spells)
+
+    Usage: python benchmarks/kernel_backends.py [nCells] [nYears]
+'''
+
+
+import os
+import sys
+import time
+import numpy as np
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import marineHeatWaves as mhw
+import mhwKernel
+from sketch_memory import synthetic
+
+
+def compare(a, b):
+    # Largest difference of the float properties, after checking the events match
+    assert a['n_events'] == b['n_events']
+    worst = 0.
+    for key in a.keys():
+        if key == 'n_events':
+            continue
+        if a[key].dtype.kind in 'iuU':
+            assert np.array_equal(a[key], b[key]), key
+        else:
+            scale = np.maximum(np.abs(a[key]), 1.)
+            worst = max(worst, np.nanmax(np.abs(a[key] - b[key]) / scale, initial=0.))
+    return worst
+
+
+def edgeCases(trials, seed=0):
+    # Largest difference between the backends over random short gappy series
+    rng = np.random.RandomState(seed)
+    worst = 0.
+    for trial in range(trials):
+        T, nCells = rng.randint(1, 400), rng.randint(1, 6)
+        t = np.arange(T) + date(1990, 1, 1).toordinal()
+        temp = 0.3*rng.randn(T, nCells).cumsum(axis=0)
+        temp[rng.rand(T, nCells) < 0.3*rng.rand()] = np.nan
+        if rng.rand() < 0.2:
+            temp[:, 0] = np.nan
+        thresh = 0.5 + 0.1*rng.randn(T, nCells)
+        seas = np.zeros((T, nCells))
+        for coldSpells in [False, True]:
+            options = {'minDuration': rng.randint(1, 6), 'maxGap': rng.randint(0, 4),
+                       'joinAcrossGaps': rng.rand() < 0.8, 'coldSpells': coldSpells}
+            mhwsNumpy = mhwKernel.detectEvents(t, temp, thresh, seas, backend='numpy', **options)
+            mhwsNumba = mhwKernel.detectEvents(t, temp, thresh, seas, backend='numba', **options)
+            worst = max(worst, compare(mhwsNumpy, mhwsNumba))
+    return worst
+
+
+if __name__ == '__main__':
+
+    nCells = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    nYears = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+    t = np.arange(date(1990, 1, 1).toordinal(), date(1990 + nYears - 1, 12, 31).toordinal()+1)
+    # Synthetic SST plus a persistent (AR(1), 0.9 lag-one correlation) anomaly
+    temp = synthetic(t, nCells, 0)
+    noise = np.random.RandomState(1).randn(len(t), nCells)
+    for i in range(1, len(t)):
+        noise[i] += 0.9*noise[i-1]
+    temp += 0.4*noise
+    doy = mhw.calendar(t)[3]
+    thresh = np.zeros((366, nCells))
+    seas = np.zeros((366, nCells))
+    for c in range(nCells):
+        thresh[:, c], seas[:, c] = mhw.climatology(doy, temp[:, c], 0, len(t)-1)
+
+    print('Synthetic grid: ' + str(nYears) + ' years x ' + str(nCells) + ' cells')
+    start = time.time()
+    mhwsNumpy = mhwKernel.detectEvents(t, temp, thresh, seas, backend='numpy')
+    timeNumpy = time.time() - start
+    print('numpy: %6.2f s, %d events' % (timeNumpy, mhwsNumpy['n_events']))
+
+    if mhwKernel.numba is None:
+        print('numba: not installed')
+    else:
+        start = time.time()
+        # Compile on a single (contiguous, as the full grid) cell
+        mhwKernel.detectEvents(t, temp[:, :1].copy(), thresh[:, :1].copy(), seas[:, :1].copy(), backend='numba')
+        print('numba: %6.2f s compilation' % (time.time() - start))
+        start = time.time()
+        mhwsNumba = mhwKernel.detectEvents(t, temp, thresh, seas, backend='numba')
+        timeNumba = time.time() - start
+        print('numba: %6.2f s, %d events (x%.1f)' % (timeNumba, mhwsNumba['n_events'], timeNumpy/timeNumba))
+        print('Same events, max relative difference of the float properties %.1e' % compare(mhwsNumpy, mhwsNumba))
+        print('Edge cases: same events, max relative difference %.1e' % edgeCases(300))
@@ -0,0 +1,64 @@
+'''
+    Check and timing of the climatology accumulated in parallel by
+    mhwClim.accumulate, with the synthetic record of sketch_memory split
+    into decades, each read by a separate worker process, against the
+    climatology of marineHeatWaves.detect over the whole record
+
+    Usage: python benchmarks/parallel_climatology.py [nCells] [processes]
+'''
+
+
+import os
+import sys
+import time
+import numpy as np
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import marineHeatWaves as mhw
+import mhwClim
+from sketch_memory import synthetic, years
+
+
+def loadDecade(args):
+    '''
+    Time vector and synthetic data of one decade, as read by a worker
+    '''
+
+    i, nCells = args
+    y = years[0] + 10*i
+    t = np.arange(date(y, 1, 1).toordinal(), date(min(y+9, years[1]), 12, 31).toordinal()+1)
+
+    return t, synthetic(t, nCells, i)
+
+
+if __name__ == '__main__':
+
+    nCells = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    decades = [(i, nCells) for i in range((years[1] - years[0]) // 10 + 1)]
+    period = [years[0] + 10, years[1] - 10]
+
+    start = time.time()
+    parts = [loadDecade(decade) for decade in decades]
+    t = np.concatenate([part[0] for part in parts])
+    temp = np.concatenate([part[1] for part in parts])
+    year, month, day, doy = mhw.calendar(t)
+    clim_start = np.where(year == period[0])[0][0]
+    clim_end = np.where(year == period[1])[0][-1]
+    thresh = np.zeros((366, nCells))
+    seas = np.zeros((366, nCells))
+    for c in range(nCells):
+        thresh[:, c], seas[:, c] = mhw.climatology(doy, temp[:, c], clim_start, clim_end)
+    timeSerial = time.time() - start
+
+    start = time.time()
+    acc = mhwClim.accumulate(loadDecade, decades, period, processes=processes, shape=(nCells,))
+    clim = acc.climatology()
+    timeParallel = time.time() - start
+
+    print('Synthetic grid: ' + str(len(decades)) + ' decades x ' + str(nCells) + ' cells, climatology ' + str(period))
+    print('Whole record, serial:         %6.1f s' % timeSerial)
+    print('By decade, %2d processes:      %6.1f s' % (processes, timeParallel))
+    print('Max difference: thresh %.2e, seas %.2e deg. C'
+          % (np.max(np.abs(clim['thresh'] - thresh)), np.max(np.abs(clim['seas'] - seas))))
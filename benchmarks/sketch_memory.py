@@ -0,0 +1,104 @@
+'''
+    Benchmark of the approximate (histogram sketch) climatology of
+    mhwClim.ClimatologySketch against the exact climatology of
+    marineHeatWaves.detect, on a synthetic 100-year grid: peak memory,
+    run time and threshold error
+
+    Usage: python benchmarks/sketch_memory.py [nCells]
+'''
+
+
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import marineHeatWaves as mhw
+import mhwClim
+
+
+# Synthetic record: 100 years of daily data, read in chunks of 2 years
+years = [1920, 2019]
+chunkYears = 2
+resolution = 0.1
+
+
+def synthetic(t, nCells, seed):
+    '''
+    Synthetic SST [deg. C] of size T x nCells: seasonal cycle, warming trend of
+    2 deg. C per century and daily noise, different for each cell
+    '''
+
+    rng = np.random.RandomState(seed)
+    cell = np.arange(nCells)
+    mean = 20. + 8.*cell/max(nCells-1, 1)
+    amplitude = 2. + 2.*cell/max(nCells-1, 1)
+    phase = 2.*np.pi*(t[:, np.newaxis] - date(years[0], 1, 1).toordinal())/365.25
+    trend = 0.02*(t[:, np.newaxis] - date(years[0], 1, 1).toordinal())/365.25
+
+    return mean + amplitude*np.cos(phase) + trend + 0.8*rng.randn(len(t), nCells)
+
+
+def chunks(nCells):
+    # Time vector and data of each chunk of the record
+    for i, y in enumerate(range(years[0], years[1]+1, chunkYears)):
+        t = np.arange(date(y, 1, 1).toordinal(), date(min(y+chunkYears-1, years[1]), 12, 31).toordinal()+1)
+        yield t, synthetic(t, nCells, i)
+
+
+def exact(nCells):
+    # Whole record in memory, climatology cell by cell as in marineHeatWaves.detect
+    parts = list(chunks(nCells))
+    t = np.concatenate([part[0] for part in parts])
+    temp = np.concatenate([part[1] for part in parts])
+    del parts
+    year, month, day, doy = mhw.calendar(t)
+    thresh = np.zeros((366, nCells))
+    for c in range(nCells):
+        thresh[:, c], seas = mhw.climatology(doy, temp[:, c], 0, len(t)-1)
+    return thresh, temp.nbytes
+
+
+def sketch(nCells):
+    # Record streamed in chunks through a sketch, with a range per cell
+    # set from the synthetic means and amplitudes with a margin for the
+    # noise and the trend
+    cell = np.arange(nCells)
+    mean = 20. + 8.*cell/max(nCells-1, 1)
+    amplitude = 2. + 2.*cell/max(nCells-1, 1)
+    sk = mhwClim.ClimatologySketch(years, shape=(nCells,), lo=mean-amplitude-5., hi=mean+amplitude+7., resolution=resolution)
+    for t, temp in chunks(nCells):
+        sk.add(t, temp)
+    return sk.climatology()['thresh'], sk
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    start = time.time()
+    result = function(*args)
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == '__main__':
+
+    nCells = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    MB = 1024.**2
+
+    (threshExact, recordBytes), timeExact, peakExact = measure(exact, nCells)
+    (threshSketch, sk), timeSketch, peakSketch = measure(sketch, nCells)
+    windowBytes = (2*sk.windowHalfWidth + 1) * recordBytes
+
+    print('Synthetic grid: ' + str(years[1]-years[0]+1) + ' years x ' + str(nCells) + ' cells')
+    print('  record (float64)                  %9.1f MB' % (recordBytes/MB))
+    print('  all window samples (float64)      %9.1f MB' % (windowBytes/MB))
+    print('  sketch (%d bins, %s)          %9.1f MB' % (sk.nBins, sk.counts.dtype, sk.nbytes/MB))
+    print('Exact:  peak memory %9.1f MB, %6.1f s' % (peakExact/MB, timeExact))
+    print('Sketch: peak memory %9.1f MB, %6.1f s' % (peakSketch/MB, timeSketch))
+    print('Max threshold error %.4f deg. C (bound %.4f deg. C, %d samples out of range)'
+          % (np.nanmax(np.abs(threshSketch - threshExact)), sk.errorBound, sk.outOfRange.sum()))
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Incremental build of the derived products: each step (CDO percentiles,
+maps, MHW statistics) is keyed on the content hashes of its inputs (data
+and code) and on its parameters, and is only rerun when that key changes
+or one of its outputs is missing. A step whose rerun leaves its outputs
+unchanged does not make the steps downstream stale
+
+Usage: python build.py [--dry-run] [--force] [--processes N]
+
+"""
+
+__title__ = "Incremental build of the derived products"
+
+
+#==============================================================================
+
+# general modules
+import os # check for files and so on
+import json # build state
+import hashlib # content hashes
+import argparse # command line options
+import functools # bind the options that do not change the products
+import subprocess # external commands
+
+
+#==============================================================================
+
+# percentile files written by extreme_SST_values.sh
+PERCENTILE_FILES = ['SST_%s_%s.nc' % (p, period) for p in ['10', '90'] for
+					period in ['yrs_20rp', 'yrs_20rm', 'yrs', 'seasons', 'yr']] \
+					+ ['SST_mean_seasons.nc']
+
+# code of each kind of step
+MAPS_CODE = ['plot_SST_xtremes.py', 'render_maps.py', 'reef_region.py']
+STATS_CODE = ['mhwstats.py', 'marineHeatWaves.py', 'mhwQuery.py',
+			  'mhwXarray.py', 'timeAxis.py', 'reef_region.py',
+			  'plot_SST_xtremes.py']
+
+
+#==============================================================================
+
+class Graph(object):
+
+	"""
+	Steps of the build, in the order they are added (each step after the
+	steps producing its inputs), with the key of the last run of each step
+	kept in a JSON state file
+
+	Arguments:
+	----------
+	state_file: string
+		path of the state file
+
+	"""
+
+	def __init__(self, state_file):
+
+		self.state_file = state_file
+		self.steps = []
+
+		if os.path.isfile(state_file):
+			with open(state_file) as f:
+				self.state = json.load(f)
+
+		else:
+			self.state = {'files': {}, 'steps': {}}
+
+	def add(self, name, action, inputs, outputs, params = None):
+
+		"""
+		Adds a step
+
+		Arguments:
+		----------
+		name: string
+			unique name of the step
+
+		action: callable
+			called as action(**params) to produce the outputs
+
+		inputs: list
+			input files, data and code
+
+		outputs: list or callable
+			output files, or a function returning them once the inputs
+			exist (e.g. one map per time index of an input file)
+
+		params: dict
+			parameters of the step, JSON serialisable
+
+		"""
+
+		self.steps.append({'name': name, 'action': action, 'inputs': inputs,
+						   'outputs': outputs, 'params': params or {}})
+
+		return
+
+	def file_hash(self, path):
+
+		"""
+		SHA-1 of the content of a file, only recomputed when its size or
+		modification time have changed since it was last hashed
+
+		"""
+
+		stat = os.stat(path)
+		cached = self.state['files'].get(path)
+
+		if cached is not None and cached[:2] == [stat.st_size,
+												 stat.st_mtime_ns]:
+			return cached[2]
+
+		sha = hashlib.sha1()
+
+		with open(path, 'rb') as f:
+			for block in iter(lambda: f.read(1 << 20), b''):
+				sha.update(block)
+
+		self.state['files'][path] = [stat.st_size, stat.st_mtime_ns,
+									 sha.hexdigest()]
+
+		return sha.hexdigest()
+
+	def key(self, step, outputs):
+
+		"""
+		Key of a step: hash of its name, input hashes, parameters and
+		outputs (None if an input is missing)
+
+		"""
+
+		if not all(os.path.isfile(path) for path in step['inputs']):
+			return None
+
+		record = {'name': step['name'], 'params': step['params'],
+				  'inputs': [[path, self.file_hash(path)] for path in
+							 step['inputs']], 'outputs': sorted(outputs)}
+
+		return hashlib.sha1(json.dumps(record, sort_keys = True)
+							.encode()).hexdigest()
+
+	def run(self, force = False, dry_run = False):
+
+		"""
+		Runs the stale steps, in order, and saves the state after each one
+
+		Arguments:
+		----------
+		force: bool
+			run every step
+
+		dry_run: bool
+			only list the stale steps: those whose key has changed, and
+			those downstream of them
+
+		Returns:
+		--------
+		ran: list
+			names of the steps run (or stale, for a dry run)
+
+		"""
+
+		ran = []
+		pending = set() # outputs of the stale steps, for a dry run
+
+		for step in self.steps:
+
+			if dry_run and pending.intersection(step['inputs']):
+				ran.append(step['name'])
+				print(step['name'])
+				pending.update(step['outputs'] if not callable(step['outputs'])
+							   else [])
+				continue
+
+			outputs = step['outputs']
+
+			if callable(outputs):
+				outputs = outputs() if all(os.path.isfile(path) for path in
+										   step['inputs']) else []
+
+			key = self.key(step, outputs)
+
+			if key is None:
+				missing = [path for path in step['inputs'] if not
+						   os.path.isfile(path)]
+				raise FileNotFoundError('%s: missing inputs %s' %
+										(step['name'], ', '.join(missing)))
+
+			fresh = (self.state['steps'].get(step['name']) == key and
+					 all(os.path.isfile(path) for path in outputs))
+
+			if fresh and not force:
+				continue
+
+			ran.append(step['name'])
+			print(step['name'])
+
+			if dry_run:
+				pending.update(outputs)
+				continue
+
+			step['action'](**step['params'])
+			self.state['steps'][step['name']] = key
+			self.save()
+
+		return ran
+
+	def save(self):
+
+		"""
+		Writes the state file, replacing it only once fully written
+
+		"""
+
+		with open(self.state_file + '.tmp', 'w') as f:
+			json.dump(self.state, f, indent = 1, sort_keys = True)
+
+		os.replace(self.state_file + '.tmp', self.state_file)
+
+		return
+
+
+#==============================================================================
+
+def pipeline(root, processes = None):
+
+	"""
+	Build graph of the derived products of this repository:
+	SST_ANOM_ALL.nc -> percentile files (CDO) -> maps, one step per file, and
+	SST_ANOM_ALL.nc -> heatwave and coldspell statistics
+
+	Arguments:
+	----------
+	root: string
+		repository directory
+
+	processes: int
+		number of processes used to render the maps of a file
+
+	Returns:
+	--------
+	graph: Graph
+		build graph, with its state in root/.build_state.json
+
+	"""
+
+	data_dir = os.path.join(root, 'SST_extremes')
+	anom = os.path.join(data_dir, 'SST_ANOM_ALL.nc')
+	script = os.path.join(root, 'extreme_SST_values.sh')
+	graph = Graph(os.path.join(root, '.build_state.json'))
+
+	graph.add('percentiles', run_cdo, [anom, script],
+			  [os.path.join(data_dir, f) for f in PERCENTILE_FILES],
+			  {'script': script, 'data_dir': data_dir})
+
+	for f in PERCENTILE_FILES:
+		fname = os.path.join(data_dir, f)
+		graph.add('maps ' + f, functools.partial(render_file,
+												 processes = processes),
+				  [fname] + [os.path.join(root, c) for c in MAPS_CODE],
+				  file_maps(fname), {'fname': fname})
+
+	for coldSpells, kind, name in [(False, 'heatwaves', 'MHW'),
+								   (True, 'coldspells', 'MCS')]:
+		outputs = ['%s_%s' % (name, product) for product in
+				   ['list_byNumber.png', 'list_byDate.png',
+					'topTen_iMax.txt', 'topTen_iMax.png', 'topTen_iMean.txt',
+					'topTen_iMean.png', 'topTen_iCum.txt', 'topTen_iCum.png',
+					'topTen_Dur.txt', 'topTen_Dur.png',
+					'annualAverages_meanTrend.png']]
+		graph.add('mhw_stats ' + kind, run_stats, [anom] +
+				  [os.path.join(root, c) for c in STATS_CODE],
+				  [os.path.join(root, 'mhw_stats', f) for f in outputs],
+				  {'fname': anom, 'root': root, 'coldSpells': coldSpells})
+
+	return graph
+
+
+def run_cdo(script, data_dir):
+
+	"""
+	Computes the percentile files with the CDO script, in the data
+	directory
+
+	"""
+
+	subprocess.check_call(['bash', script], cwd = data_dir)
+
+	return
+
+
+def file_maps(fname):
+
+	"""
+	Outputs of the maps step of a file, listed once the file exists
+
+	"""
+
+	def outputs():
+
+		import render_maps
+
+		return [panel['namefig'] for panel in render_maps.file_panels(fname)]
+
+	return outputs
+
+
+def render_file(fname, processes = None):
+
+	"""
+	Renders every map of a percentile file
+
+	"""
+
+	import render_maps
+
+	render_maps.render_panels(render_maps.file_panels(fname), processes)
+
+	return
+
+
+def run_stats(fname, root, coldSpells):
+
+	"""
+	MHW statistics of the reef average of SST_ANOM_ALL.nc, written by
+	mhw_stats to root/mhw_stats
+
+	"""
+
+	import plot_SST_xtremes as psx
+	from mhwstats import mhw_stats
+
+	data = psx.read_data(fname)
+	reef_cell = psx.reef_points(data)
+	time, sst = psx.reindexDaily(*psx.toNumpy(reef_cell['sst']))
+	cwd = os.getcwd()
+	os.chdir(root) # mhw_stats writes to mhw_stats/ in the current directory
+
+	try:
+		mhw_stats(time, sst, coldSpells = coldSpells)
+
+	finally:
+		os.chdir(cwd)
+
+	return
+
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description = __title__)
+	parser.add_argument('--dry-run', action = 'store_true',
+						help = 'list the stale steps without running them')
+	parser.add_argument('--force', action = 'store_true',
+						help = 'run every step')
+	parser.add_argument('--processes', type = int, default = None,
+						help = 'number of processes rendering the maps')
+	args = parser.parse_args()
+
+	root = os.path.dirname(os.path.abspath(__file__))
+	pipeline(root, args.processes).run(force = args.force,
+									   dry_run = args.dry_run)
@@ -0,0 +1,388 @@
+'''
+    Loading of the daily climate indices bundled with this repository
+    (Nino regions, CPC AO/AAO/NAO/PNA and the daily SOI) onto a common
+    daily time axis, and composite analysis of these indices against
+    marine heat waves (MHWs) detected using marineHeatWaves.detect
+'''
+
+
+import os
+import hashlib
+import warnings
+import numpy as np
+from datetime import date
+
+import timeAxis
+
+
+# Daily index files, as (file name, variable name) pairs
+indexFiles = {
+    'nino12': ('inino12_daily.nc', 'Nino12'),
+    'nino3': ('inino3_daily.nc', 'Nino3'),
+    'nino34': ('inino34_daily.nc', 'Nino34'),
+    'nino4': ('inino4_daily.nc', 'Nino4'),
+    'ao': ('icpc_ao_daily.nc', 'ao'),
+    'aao': ('icpc_aao_daily.nc', 'aao'),
+    'nao': ('icpc_nao_daily.nc', 'nao'),
+    'pna': ('icpc_pna_daily.nc', 'pna'),
+    'soi_1887_1989': ('DailySOI1887-1989Base.csv', 'SOI'),
+    'soi_1933_1992': ('DailySOI1933-1992Base.csv', 'SOI'),
+}
+
+# Parsed indices, keyed on the directory, index names and file modification times
+_cache = {}
+
+# Directory of the binary copies of the parsed SOI tables, outside the source tree
+cacheDir = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 'marineHeatWaves')
+
+
+def loadIndices(path=None, names=None):
+    '''
+    Reads the daily climate index files and places them on a single, aligned,
+    daily time axis. The result is cached, so that only the first call in a
+    session parses the files.
+    Options:
+      path     Directory containing the index files (DEFAULT = directory of
+               this module)
+      names    List of indices to load, as keys of climateIndices.indexFiles
+               (DEFAULT = None, all indices)
+    Outputs:
+      indices  Dictionary with keys:
+        't'                    Time vector, in datetime format (e.g.,
+                               date(1982,1,1).toordinal()), continuous and daily
+                               over the union of all index records [1D numpy array of length T]
+        'names'                List of index names, in column order
+        'data'                 Index values [2D float32 numpy array of size T x nIndices],
+                               NaN outside of each record or where data are missing
+    Notes:
+      The returned dictionary is shared between calls; copy 'data' before
+      modifying it in place.
+    '''
+
+    if path is None:
+        path = os.path.dirname(os.path.abspath(__file__))
+    if names is None:
+        names = list(indexFiles.keys())
+    fnames = [os.path.join(path, indexFiles[name][0]) for name in names]
+    key = (os.path.abspath(path), tuple(names), tuple(os.path.getmtime(f) for f in fnames))
+    if key in _cache:
+        return _cache[key]
+
+    # Read each record on its own time axis
+    records = []
+    for name, fname in zip(names, fnames):
+        if fname.endswith('.csv'):
+            records.append(readSOI(fname))
+        else:
+            records.append(readIndex(fname, indexFiles[name][1]))
+
+    # Place all records on a common daily axis
+    t0 = min([tt[0] for tt, _ in records])
+    t1 = max([tt[-1] for tt, _ in records])
+    indices = {}
+    indices['t'] = np.arange(t0, t1+1)
+    indices['names'] = list(names)
+    indices['data'] = np.full((len(indices['t']), len(names)), np.nan, dtype=np.float32)
+    for i, (tt, values) in enumerate(records):
+        indices['data'][tt - t0, i] = values
+
+    _cache[key] = indices
+
+    return indices
+
+
+def readIndex(fname, varname):
+    '''
+    Reads a daily index from a NetCDF file.
+    Inputs:
+      fname    File name (with path)
+      varname  Name of the index variable in the file
+    Outputs:
+      t        Time vector, in datetime format [1D numpy array of length T]
+      values   Index values [1D float32 numpy array of length T]
+    '''
+
+    import xarray as xr
+
+    with xr.open_dataset(fname) as ds:
+        t = timeAxis.toOrdinal(ds['time'].values)
+        values = ds[varname].values.astype(np.float32)
+
+    return t, values
+
+
+def readSOI(fname, cache=True):
+    '''
+    Reads a daily Southern Oscillation Index (SOI) record from one of the
+    DailySOI*.csv files, which have Year, Day (day-of-year), Tahiti, Darwin and
+    SOI columns.
+    Inputs:
+      fname    File name (with path)
+    Options:
+      cache    Keep a binary copy of the parsed table in climateIndices.cacheDir
+               (by default ~/.cache/marineHeatWaves, or under $XDG_CACHE_HOME) and
+               read that instead whenever it is newer than the CSV file
+               (DEFAULT = True)
+    Outputs:
+      t        Time vector, in datetime format [1D numpy array of length T], in
+               increasing order with each day at most once
+      values   SOI values [1D float32 numpy array of length T], NaN where either
+               station pressure is missing (-999.9) and on days listed more than
+               once in the file
+    Notes:
+      Days listed more than once (e.g. day 329 of 2012 in DailySOI1887-1989Base.csv,
+      where day 330 is absent) and days absent from the record are reported with a
+      warning. As the value of a duplicated day cannot be told apart from that of
+      the neighbouring absent day, both are missing (NaN) in loadIndices.
+    '''
+
+    fcache = os.path.join(cacheDir, os.path.splitext(os.path.basename(fname))[0] + '-'
+                          + hashlib.sha1(os.path.abspath(fname).encode()).hexdigest()[:12] + '.npy')
+    if cache and os.path.exists(fcache) and (os.path.getmtime(fcache) >= os.path.getmtime(fname)):
+        data = np.load(fcache)
+    else:
+        data = np.loadtxt(fname, delimiter=',', skiprows=1, ndmin=2)
+        if cache:
+            try:
+                os.makedirs(cacheDir, exist_ok=True)
+                np.save(fcache, data)
+            except OSError:
+                pass
+
+    year = data[:, 0].astype(int)
+    t = timeAxis.ordinalYearStart(year) + data[:, 1].astype(int) - 1
+    values = data[:, 4].astype(np.float32)
+    values[(data[:, 2] < -999) + (data[:, 3] < -999)] = np.nan
+
+    # One value per day: duplicated days are left missing, and reported with absent days
+    t, first, count = np.unique(t, return_index=True, return_counts=True)
+    values = values[first]
+    values[count > 1] = np.nan
+    absent = np.setdiff1d(np.arange(t[0], t[-1]+1), t) if len(t) else t
+    if (count > 1).any() or len(absent):
+        warnings.warn(os.path.basename(fname) + ': ' + ', '.join(
+            ['day ' + str(date.fromordinal(int(d))) + ' listed ' + str(n) + ' times' for d, n in zip(t[count > 1], count[count > 1])]
+            + ['day ' + str(date.fromordinal(int(d))) + ' absent' for d in absent]) + '; these days are missing (NaN)')
+
+    return t, values
+
+
+def align(indices, t):
+    '''
+    Extracts the index values on a given time vector.
+    Inputs:
+      indices  Climate indices loaded using climateIndices.loadIndices
+      t        Time vector, in datetime format [1D numpy array of length T]
+    Outputs:
+      values   Index values [2D float32 numpy array of size T x nIndices], NaN
+               for times outside of the index records
+    '''
+
+    tt = np.asarray(t).astype(int) - indices['t'][0]
+    inside = (tt >= 0) * (tt < len(indices['t']))
+    values = np.full((len(tt), len(indices['names'])), np.nan, dtype=np.float32)
+    values[inside, :] = indices['data'][tt[inside], :]
+
+    return values
+
+
+def eventMask(t, mhw, nCells=None):
+    '''
+    Flags all days falling within a detected MHW.
+    Inputs:
+      t        Time vector, in datetime format [1D numpy array of length T]
+      mhw      Marine heat waves (MHWs) detected using marineHeatWaves.detect, or an
+               event table with an additional 'cell' key giving the (integer) grid
+               cell of each event
+    Options:
+      nCells   Number of grid cells, required if mhw has a 'cell' key
+    Outputs:
+      mask     Boolean array of size T (or T x nCells), True on MHW days
+    '''
+
+    index_start = np.asarray(mhw['index_start'], dtype=int)
+    index_end = np.asarray(mhw['index_end'], dtype=int)
+    # Mark starts and (one past) ends, then integrate
+    edges = np.zeros((len(t)+1, 1 if nCells is None else nCells), dtype=np.int32)
+    cell = 0 if nCells is None else np.asarray(mhw['cell'], dtype=int)
+    np.add.at(edges, (index_start, cell), 1)
+    np.add.at(edges, (index_end+1, cell), -1)
+    mask = np.cumsum(edges[:-1], axis=0) > 0
+
+    return mask[:, 0] if nCells is None else mask
+
+
+def eventState(indices, t, mhw):
+    '''
+    Calculates the state of each climate index during each MHW event.
+    Inputs:
+      indices  Climate indices loaded using climateIndices.loadIndices
+      t        Time vector of the source SST series, in datetime format
+      mhw      Marine heat waves (MHWs) detected using marineHeatWaves.detect (or
+               an event table from many grid cells on the same time vector)
+    Outputs:
+      state    Dictionary of 2D numpy arrays of size N x nIndices, where N is the
+               number of MHWs, with keys:
+        'mean'                 Mean index value over the event (ignoring NaNs)
+        'start'                Index value on the start day of the event
+        'peak'                 Index value on the peak day of the event
+        'end'                  Index value on the end day of the event
+    Notes:
+      Event means are taken from cumulative sums of the index series, so the cost
+      is independent of event durations.
+    '''
+
+    values = align(indices, t).astype(np.float64)
+    valid = ~np.isnan(values)
+    values[~valid] = 0.
+    # Cumulative sums with a leading row of zeros
+    csum = np.zeros((len(t)+1, values.shape[1]))
+    ccount = np.zeros((len(t)+1, values.shape[1]))
+    np.cumsum(values, axis=0, out=csum[1:])
+    np.cumsum(valid, axis=0, out=ccount[1:])
+
+    index_start = np.asarray(mhw['index_start'], dtype=int)
+    index_end = np.asarray(mhw['index_end'], dtype=int)
+    index_peak = np.asarray(mhw['index_peak'], dtype=int)
+    state = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        state['mean'] = (csum[index_end+1] - csum[index_start]) / (ccount[index_end+1] - ccount[index_start])
+    values[~valid] = np.nan
+    state['start'] = values[index_start]
+    state['peak'] = values[index_peak]
+    state['end'] = values[index_end]
+
+    return state
+
+
+def blockIndices(indices, mhwBlock):
+    '''
+    Averages the climate indices over the blocks of marineHeatWaves.blockAverage,
+    so that they can be compared against block-averaged MHW properties.
+    Inputs:
+      indices    Climate indices loaded using climateIndices.loadIndices
+      mhwBlock   Block-averaged MHW properties from marineHeatWaves.blockAverage
+    Outputs:
+      values     Block-averaged index values [2D numpy array of size nBlocks x nIndices]
+    '''
+
+    t0 = np.array([date(int(yr), 1, 1).toordinal() for yr in mhwBlock['years_start']])
+    t1 = np.array([date(int(yr)+1, 1, 1).toordinal() for yr in mhwBlock['years_end']])
+    t0 = np.clip(t0 - indices['t'][0], 0, len(indices['t']))
+    t1 = np.clip(t1 - indices['t'][0], 0, len(indices['t']))
+    data = indices['data'].astype(np.float64)
+    valid = ~np.isnan(data)
+    data[~valid] = 0.
+    csum = np.concatenate((np.zeros((1, data.shape[1])), np.cumsum(data, axis=0)))
+    ccount = np.concatenate((np.zeros((1, data.shape[1])), np.cumsum(valid, axis=0)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values = (csum[t1] - csum[t0]) / (ccount[t1] - ccount[t0])
+
+    return values
+
+
+def laggedCorrelation(x, y, lags):
+    '''
+    Calculates lagged Pearson correlations between every column of x and every
+    column of y, for all requested lags at once.
+    Inputs:
+      x       Predictors, e.g. block-averaged climate indices [2D numpy array of size N x P]
+      y       Predictands, e.g. a block-averaged MHW property for many grid cells
+              [1D numpy array of length N or 2D numpy array of size N x Q]
+      lags    List of integer lags (in units of the rows of x and y). A positive lag
+              correlates x leading y, i.e. x[i-lag] with y[i].
+    Outputs:
+      corr    Correlation coefficients [3D numpy array of size nLags x P x Q]
+      n       Number of valid (non-NaN) pairs entering each coefficient [same size]
+    Notes:
+      NaNs are handled pairwise. For each lag, all P x Q correlations are obtained
+      from a handful of matrix products, rather than looping over index/cell pairs.
+    '''
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.ndim == 1:
+        x = x[:, np.newaxis]
+    if y.ndim == 1:
+        y = y[:, np.newaxis]
+    N = x.shape[0]
+
+    corr = np.nan*np.zeros((len(lags), x.shape[1], y.shape[1]))
+    n = np.zeros((len(lags), x.shape[1], y.shape[1]))
+    for i, lag in enumerate(lags):
+        if abs(lag) >= N:
+            continue
+        if lag >= 0:
+            xl = x[:N-lag]
+            yl = y[lag:]
+        else:
+            xl = x[-lag:]
+            yl = y[:N+lag]
+        vx = (~np.isnan(xl)).astype(np.float64)
+        vy = (~np.isnan(yl)).astype(np.float64)
+        x0 = np.where(vx > 0, xl, 0.)
+        y0 = np.where(vy > 0, yl, 0.)
+        nn = vx.T @ vy
+        Sx = x0.T @ vy
+        Sy = vx.T @ y0
+        Sxy = x0.T @ y0
+        Sxx = (x0**2).T @ vy
+        Syy = vx.T @ y0**2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr[i] = (nn*Sxy - Sx*Sy) / np.sqrt((nn*Sxx - Sx**2) * (nn*Syy - Sy**2))
+        n[i] = nn
+
+    return corr, n
+
+
+def conditionedPercentiles(indices, t, mask, pctiles=[10, 50, 90]):
+    '''
+    Calculates percentiles of each climate index over the days flagged by a mask,
+    e.g. over all MHW days (see climateIndices.eventMask).
+    Inputs:
+      indices  Climate indices loaded using climateIndices.loadIndices
+      t        Time vector of the source SST series, in datetime format
+      mask     Boolean array of size T or T x nCells flagging the days of interest
+    Options:
+      pctiles  List of percentiles (%) to calculate (DEFAULT = [10, 50, 90])
+    Outputs:
+      p        Percentiles [numpy array of size nPctiles x nIndices (x nCells)],
+               following the linear interpolation of np.percentile. NaN where no
+               valid days were flagged.
+    Notes:
+      Each index series is sorted once. The flagged samples of every cell are then
+      located in that sorted series by a single searchsorted over the cumulative
+      counts of all cells, so the cost does not grow with per-cell sorting.
+    '''
+
+    values = align(indices, t)
+    mask = np.asarray(mask, dtype=bool)
+    squeeze = mask.ndim == 1
+    if squeeze:
+        mask = mask[:, np.newaxis]
+    T, nCells = mask.shape
+    pctiles = np.atleast_1d(pctiles).astype(np.float64)
+
+    p = np.nan*np.zeros((len(pctiles), values.shape[1], nCells))
+    for j in range(values.shape[1]):
+        v = values[:, j]
+        valid = ~np.isnan(v)
+        order = np.argsort(v[valid], kind='stable')
+        vs = v[valid][order].astype(np.float64)
+        # Cumulative number of flagged samples, in sorted order, for each cell
+        csum = np.cumsum(mask[valid][order], axis=0)
+        count = csum[-1] if len(vs) else np.zeros(nCells, dtype=int)
+        # Offset each cell's counts so that a single searchsorted covers all cells
+        offset = (np.arange(nCells) * (T+1))
+        flat = (csum + offset).T.ravel()
+        for k, q in enumerate(pctiles):
+            pos = q/100. * (count - 1)
+            lo = np.floor(pos).astype(int)
+            hi = np.ceil(pos).astype(int)
+            ok = count > 0
+            ilo = np.searchsorted(flat, lo[ok] + 1 + offset[ok]) - np.arange(nCells)[ok]*len(vs)
+            ihi = np.searchsorted(flat, hi[ok] + 1 + offset[ok]) - np.arange(nCells)[ok]*len(vs)
+            frac = (pos - lo)[ok]
+            p[k, j, ok] = vs[ilo] + frac*(vs[ihi] - vs[ilo])
+
+    return p[:, :, 0] if squeeze else p
@@ -6,14 +6,10 @@
 
 
 import numpy as np
-import scipy as sp
-from scipy import linalg
-from scipy import stats
-import scipy.ndimage as ndimage
 from datetime import date
 
 
-def detect(t, temp, climatologyPeriod=[None,None], pctile=90, windowHalfWidth=5, smoothPercentile=True, smoothPercentileWidth=31, minDuration=5, joinAcrossGaps=True, maxGap=2, maxPadLength=False, coldSpells=False, alternateClimatology=False):
+def detect(t, temp, climatologyPeriod=[None,None], pctile=90, windowHalfWidth=5, smoothPercentile=True, smoothPercentileWidth=31, minDuration=5, joinAcrossGaps=True, maxGap=2, maxPadLength=False, coldSpells=False, alternateClimatology=False, dtype=np.float64):
     '''
     Applies the Hobday et al. (2016) marine heat wave definition to an input time
     series of temp ('temp') along with a time vector ('t'). Outputs properties of
@@ -57,9 +53,13 @@ def detect(t, temp, climatologyPeriod=[None,None], pctile=90, windowHalfWidth=5,
         categories for each event.
         'n_events'             A scalar integer (not a list) indicating the total
                                number of detected MHW events
+              If pctile is a list of P percentiles, mhw is a list of P such
+              dictionaries, one per threshold.
       clim    Climatology of SST. Each key (following list) is a seasonally-varying
               time series [1D numpy array of length T] of a particular measure:
-        'thresh'               Seasonally varying threshold (e.g., 90th percentile)
+        'thresh'               Seasonally varying threshold (e.g., 90th percentile).
+                               If pctile is a list of P percentiles, a 2D numpy array
+                               of size P x T with one threshold per row.
         'seas'                 Climatological seasonal cycle
         'missing'              A vector of TRUE/FALSE indicating which elements in 
                                temp were missing values for the MHWs detection
@@ -69,7 +69,9 @@ def detect(t, temp, climatologyPeriod=[None,None], pctile=90, windowHalfWidth=5,
                              over the full range of years in the supplied time series.
                              Alternate periods suppled as a list e.g. [1983,2012].
       pctile                 Threshold percentile (%) for detection of extreme values
-                             (DEFAULT = 90)
+                             (DEFAULT = 90). May be a list of percentiles, e.g. [90, 99]:
+                             all thresholds are then computed from the same windowed
+                             samples and MHWs are detected once per threshold.
       windowHalfWidth        Width of window (one sided) about day-of-year used for
                              the pooling of values and calculation of threshold percentile
                              (DEFAULT = 5 [days])
@@ -96,7 +98,19 @@ def detect(t, temp, climatologyPeriod=[None,None], pctile=90, windowHalfWidth=5,
                              in datetime format (e.g., date(1982,1,1).toordinal())
                              [1D numpy array of length TClim] and (2) the second element of
                              the list is a temperature vector [1D numpy array of length TClim].
+                             Alternatively, a precomputed climatology as a dictionary with
+                             keys 'thresh' and 'seas', each indexed by day-of-year minus one
+                             on a leap-year basis [1D numpy array of length 366, or of size
+                             P x 366 for 'thresh' with P thresholds], in the units of temp
+                             (also for cold spells), e.g. as output by
+                             mhwClim.ClimatologyAccumulator.climatology or as loaded from
+                             a saved baseline by mhwClim.loadBaseline. The climatologyPeriod,
+                             pctile, windowHalfWidth and smoothing options are then unused.
                              (DEFAULT = False)
+      dtype                  Floating point type used for all internal computations and for
+                             the clim outputs, e.g. np.float32 to halve memory use for large
+                             gridded runs (DEFAULT = np.float64). Event properties computed
+                             in float32 agree with float64 to within about 1e-5 deg. C.
     Notes:
       1. This function assumes that the input time series consist of continuous daily values
          with few missing values. Time ranges which start and end part-way through the calendar
@@ -114,226 +128,330 @@ def detect(t, temp, climatologyPeriod=[None,None], pctile=90, windowHalfWidth=5,
          waves except that events are detected as deviations below the (100 - pctile)th percentile
          (e.g., the 10th instead of 90th) for at least 5 days. Intensities are reported as negative
          values and represent the temperature anomaly below climatology.
+      6. The input temp is copied once (in dtype) and never modified; sign flips for cold spells and
+         the filling of missing values are done in place on that copy.
     Written by Eric Oliver, Institue for Marine and Antarctic Studies, University of Tasmania, Feb 2015
     '''
 
-    #
-    # Initialize MHW output variable
-    #
-
-    mhw = {}
-    mhw['time_start'] = [] # datetime format
-    mhw['time_end'] = [] # datetime format
-    mhw['time_peak'] = [] # datetime format
-    mhw['date_start'] = [] # datetime format
-    mhw['date_end'] = [] # datetime format
-    mhw['date_peak'] = [] # datetime format
-    mhw['index_start'] = []
-    mhw['index_end'] = []
-    mhw['index_peak'] = []
-    mhw['duration'] = [] # [days]
-    mhw['duration_moderate'] = [] # [days]
-    mhw['duration_strong'] = [] # [days]
-    mhw['duration_severe'] = [] # [days]
-    mhw['duration_extreme'] = [] # [days]
-    mhw['intensity_max'] = [] # [deg C]
-    mhw['intensity_mean'] = [] # [deg C]
-    mhw['intensity_var'] = [] # [deg C]
-    mhw['intensity_cumulative'] = [] # [deg C]
-    mhw['intensity_max_relThresh'] = [] # [deg C]
-    mhw['intensity_mean_relThresh'] = [] # [deg C]
-    mhw['intensity_var_relThresh'] = [] # [deg C]
-    mhw['intensity_cumulative_relThresh'] = [] # [deg C]
-    mhw['intensity_max_abs'] = [] # [deg C]
-    mhw['intensity_mean_abs'] = [] # [deg C]
-    mhw['intensity_var_abs'] = [] # [deg C]
-    mhw['intensity_cumulative_abs'] = [] # [deg C]
-    mhw['category'] = []
-    mhw['rate_onset'] = [] # [deg C / day]
-    mhw['rate_decline'] = [] # [deg C / day]
-
     #
     # Time and dates vectors
     #
 
-    # Generate vectors for year, month, day-of-month, and day-of-year
-    T = len(t)
-    year = np.zeros((T))
-    month = np.zeros((T))
-    day = np.zeros((T))
-    doy = np.zeros((T))
-    for i in range(T):
-        year[i] = date.fromordinal(t[i]).year
-        month[i] = date.fromordinal(t[i]).month
-        day[i] = date.fromordinal(t[i]).day
-    # Leap-year baseline for defining day-of-year values
-    year_leapYear = 2012 # This year was a leap-year and therefore doy in range of 1 to 366
-    t_leapYear = np.arange(date(year_leapYear, 1, 1).toordinal(),date(year_leapYear, 12, 31).toordinal()+1)
-    dates_leapYear = [date.fromordinal(tt.astype(int)) for tt in t_leapYear]
-    month_leapYear = np.zeros((len(t_leapYear)))
-    day_leapYear = np.zeros((len(t_leapYear)))
-    doy_leapYear = np.zeros((len(t_leapYear)))
-    for tt in range(len(t_leapYear)):
-        month_leapYear[tt] = date.fromordinal(t_leapYear[tt]).month
-        day_leapYear[tt] = date.fromordinal(t_leapYear[tt]).day
-        doy_leapYear[tt] = t_leapYear[tt] - date(date.fromordinal(t_leapYear[tt]).year,1,1).toordinal() + 1
-    # Calculate day-of-year values
-    for tt in range(T):
-        doy[tt] = doy_leapYear[(month_leapYear == month[tt]) * (day_leapYear == day[tt])]
-
-    # Constants (doy values for Feb-28 and Feb-29) for handling leap-years
-    feb28 = 59
-    feb29 = 60
+    # Generate vectors for year and day-of-year
+    # (day-of-year on a leap-year basis, i.e. in range 1 to 366)
+    year, _, _, doy = _cachedCalendar(t)
 
     # Set climatology period, if unset use full range of available data
     if (climatologyPeriod[0] is None) or (climatologyPeriod[1] is None):
-        climatologyPeriod[0] = year[0]
-        climatologyPeriod[1] = year[-1]
+        climatologyPeriod = [year[0], year[-1]]
+
+    # Working copy of temp, never modified in the caller
+    temp = np.array(temp, dtype=dtype)
 
     #
     # Calculate threshold and seasonal climatology (varying with day-of-year)
     #
 
+    # if a precomputed climatology is supplied there is nothing to calculate
+    if isinstance(alternateClimatology, dict):
+        tempClim = None
     # if alternate temperature time series is supplied for the calculation of the climatology
-    if alternateClimatology:
+    elif alternateClimatology:
         tClim = alternateClimatology[0]
-        tempClim = alternateClimatology[1]
-        TClim = len(tClim)
-        yearClim = np.zeros((TClim))
-        monthClim = np.zeros((TClim))
-        dayClim = np.zeros((TClim))
-        doyClim = np.zeros((TClim))
-        for i in range(TClim):
-            yearClim[i] = date.fromordinal(tClim[i]).year
-            monthClim[i] = date.fromordinal(tClim[i]).month
-            dayClim[i] = date.fromordinal(tClim[i]).day
-            doyClim[i] = doy_leapYear[(month_leapYear == monthClim[i]) * (day_leapYear == dayClim[i])]
+        tempClim = np.array(alternateClimatology[1], dtype=dtype)
+        yearClim, _, _, doyClim = _cachedCalendar(tClim)
     else:
-        tempClim = temp.copy()
-        TClim = np.array([T]).copy()[0]
-        yearClim = year.copy()
-        monthClim = month.copy()
-        dayClim = day.copy()
-        doyClim = doy.copy()
+        # Climatology is calculated from temp itself (not modified until after the climatology)
+        tempClim = temp
+        yearClim = year
+        doyClim = doy
 
     # Flip temp time series if detecting cold spells
     if coldSpells:
-        temp = -1.*temp
-        tempClim = -1.*tempClim
+        np.negative(temp, out=temp)
+        if (tempClim is not temp) and (tempClim is not None):
+            np.negative(tempClim, out=tempClim)
 
     # Pad missing values for all consecutive missing blocks of length <= maxPadLength
     if maxPadLength:
-        temp = pad(temp, maxPadLength=maxPadLength)
-        tempClim = pad(tempClim, maxPadLength=maxPadLength)
+        if tempClim is temp:
+            temp = pad(temp, maxPadLength=maxPadLength)
+            tempClim = temp
+        elif tempClim is None:
+            temp = pad(temp, maxPadLength=maxPadLength)
+        else:
+            temp = pad(temp, maxPadLength=maxPadLength)
+            tempClim = pad(tempClim, maxPadLength=maxPadLength)
+
+    if tempClim is None:
+        thresh_climYear = np.array(alternateClimatology['thresh'], dtype=float)
+        seas_climYear = np.array(alternateClimatology['seas'], dtype=float)
+        if coldSpells:
+            thresh_climYear = -thresh_climYear
+            seas_climYear = -seas_climYear
+    else:
+        # Start and end indices
+        clim_start = np.where(yearClim == climatologyPeriod[0])[0][0]
+        clim_end = np.where(yearClim == climatologyPeriod[1])[0][-1]
+        thresh_climYear, seas_climYear = climatology(doyClim, tempClim, clim_start, clim_end, pctile=pctile, windowHalfWidth=windowHalfWidth, smoothPercentile=smoothPercentile, smoothPercentileWidth=smoothPercentileWidth)
+
+    # Generate threshold for full time series
+    clim = {}
+    clim['thresh'] = thresh_climYear.astype(dtype)[..., doy-1]
+    clim['seas'] = seas_climYear.astype(dtype)[doy-1]
+
+    # Save vector indicating which points in temp are missing values
+    clim['missing'] = np.isnan(temp)
+    # Set all remaining missing temp values equal to the climatology (temp is a working copy)
+    temp[clim['missing']] = clim['seas'][clim['missing']]
+
+    #
+    # Find MHWs as exceedances above the threshold (once per threshold, against the shared seasonal climatology)
+    #
+
+    mhws = []
+    for thresh in np.atleast_2d(clim['thresh']):
+        starts, ends = _exceedRuns(temp, thresh)
+        starts, ends = _joinRuns(t, starts, ends, minDuration, joinAcrossGaps, maxGap)
+        mhws.append(_eventProperties(t, temp, thresh, clim['seas'], starts, ends))
+
+    # Flip climatology and intensties in case of cold spell detection
+    if coldSpells:
+        np.negative(clim['seas'], out=clim['seas'])
+        np.negative(clim['thresh'], out=clim['thresh'])
+        for mhw in mhws:
+            _flipIntensities(mhw)
+
+    if np.ndim(thresh_climYear) == 1:
+        return mhws[0], clim
+    return mhws, clim
+
+
+def climatology(doyClim, tempClim, clim_start, clim_end, pctile=90, windowHalfWidth=5, smoothPercentile=True, smoothPercentileWidth=31):
+    '''
+    Calculates the threshold and seasonal climatology (varying with day-of-year)
+    as used by marineHeatWaves.detect. The windowed samples of each day-of-year
+    are gathered and sorted once, and all requested percentiles are read off them.
+    Inputs:
+      doyClim     Day-of-year on a leap-year basis (see marineHeatWaves.calendar)
+                  [1D numpy array of length TClim]
+      tempClim    Temperature vector [1D numpy array of length TClim]
+      clim_start  Index of the first element of the climatology period
+      clim_end    Index of the last element of the climatology period
+    Options:
+      pctile, windowHalfWidth, smoothPercentile and smoothPercentileWidth are as
+      for marineHeatWaves.detect
+    Outputs:
+      thresh_climYear  Threshold for each day-of-year [1D numpy array of length 366,
+                       or 2D numpy array of size P x 366 if pctile is a list of P
+                       percentiles]
+      seas_climYear    Seasonal climatology for each day-of-year [1D numpy array of
+                       length 366]
+    '''
+
+    windows, seas_climYear = _windowSamples(doyClim, tempClim, clim_start, clim_end, windowHalfWidth)
+    pctiles = np.atleast_1d(pctile)
+    thresh_climYear = np.nan*np.zeros((len(pctiles), len(windows)))
+    for d in range(len(windows)):
+        if windows[d] is not None:
+            thresh_climYear[:, d] = _percentilesSorted(windows[d], pctiles)
+    if np.ndim(pctile) == 0:
+        thresh_climYear = thresh_climYear[0]
+
+    return _finishClimYear(thresh_climYear, seas_climYear, smoothPercentile, smoothPercentileWidth)
+
+
+def _windowSamples(doyClim, tempClim, clim_start, clim_end, windowHalfWidth):
+    '''
+    Gathers, for each day-of-year except Feb 29, all valid values within
+    +/- windowHalfWidth days of that day-of-year over the climatology period.
+    Returns the sorted samples of each day-of-year (None where the day-of-year
+    does not occur, e.g. in 360-day calendars) and their mean [length 366].
+    '''
 
     # Length of climatological year
     lenClimYear = 366
-    # Start and end indices
-    clim_start = np.where(yearClim == climatologyPeriod[0])[0][0]
-    clim_end = np.where(yearClim == climatologyPeriod[1])[0][-1]
-    # Inialize arrays
-    thresh_climYear = np.NaN*np.zeros(lenClimYear)
-    seas_climYear = np.NaN*np.zeros(lenClimYear)
-    clim = {}
-    clim['thresh'] = np.NaN*np.zeros(TClim)
-    clim['seas'] = np.NaN*np.zeros(TClim)
+    TClim = len(tempClim)
+    # Indices within the climatology period, grouped by day-of-year
+    doyPeriod = np.asarray(doyClim[clim_start:clim_end+1]).astype(int)
+    order = np.argsort(doyPeriod, kind='stable')
+    bounds = np.searchsorted(doyPeriod[order], np.arange(1, lenClimYear+2))
+    offsets = np.arange(-windowHalfWidth, windowHalfWidth+1)
+    windows = [None]*lenClimYear
+    seas_climYear = np.nan*np.zeros(lenClimYear)
     # Loop over all day-of-year values, and calculate threshold and seasonal climatology across years
-    for d in range(1,lenClimYear+1):
+    for d in range(1, lenClimYear+1):
         # Special case for Feb 29
         if d == feb29:
             continue
-        # find all indices for each day of the year +/- windowHalfWidth and from them calculate the threshold
-        tt0 = np.where(doyClim[clim_start:clim_end+1] == d)[0] 
+        # find all indices for each day of the year +/- windowHalfWidth
+        tt0 = order[bounds[d-1]:bounds[d]]
         # If this doy value does not exist (i.e. in 360-day calendars) then skip it
         if len(tt0) == 0:
             continue
-        tt = np.array([])
-        for w in range(-windowHalfWidth, windowHalfWidth+1):
-            tt = np.append(tt, clim_start+tt0 + w)
-        tt = tt[tt>=0] # Reject indices "before" the first element
-        tt = tt[tt<TClim] # Reject indices "after" the last element
-        thresh_climYear[d-1] = np.percentile(nonans(tempClim[tt.astype(int)]), pctile)
-        seas_climYear[d-1] = np.mean(nonans(tempClim[tt.astype(int)]))
-    # Special case for Feb 29
-    thresh_climYear[feb29-1] = 0.5*thresh_climYear[feb29-2] + 0.5*thresh_climYear[feb29]
-    seas_climYear[feb29-1] = 0.5*seas_climYear[feb29-2] + 0.5*seas_climYear[feb29]
-
-    # Smooth if desired
-    if smoothPercentile:
-        # If the climatology contains NaNs, then assume it is a <365-day year and deal accordingly
-        if np.sum(np.isnan(seas_climYear)) + np.sum(np.isnan(thresh_climYear)):
-            valid = ~np.isnan(thresh_climYear)
-            thresh_climYear[valid] = runavg(thresh_climYear[valid], smoothPercentileWidth)
-            valid = ~np.isnan(seas_climYear)
-            seas_climYear[valid] = runavg(seas_climYear[valid], smoothPercentileWidth)
-        # >= 365-day year
-        else:
-            thresh_climYear = runavg(thresh_climYear, smoothPercentileWidth)
-            seas_climYear = runavg(seas_climYear, smoothPercentileWidth)
+        tt = (clim_start + tt0[np.newaxis, :] + offsets[:, np.newaxis]).ravel()
+        tt = tt[(tt >= 0) * (tt < TClim)] # Reject indices "before" the first and "after" the last element
+        samples = nonans(tempClim[tt])
+        seas_climYear[d-1] = np.mean(samples)
+        windows[d-1] = np.sort(samples)
 
-    # Generate threshold for full time series
-    clim['thresh'] = thresh_climYear[doy.astype(int)-1]
-    clim['seas'] = seas_climYear[doy.astype(int)-1]
+    return windows, seas_climYear
 
-    # Save vector indicating which points in temp are missing values
-    clim['missing'] = np.isnan(temp)
-    # Set all remaining missing temp values equal to the climatology
-    temp[np.isnan(temp)] = clim['seas'][np.isnan(temp)]
 
-    #
-    # Find MHWs as exceedances above the threshold
-    #
+def _percentilesSorted(samples, pctiles):
+    '''
+    Percentiles of a sorted sample, with the same linear interpolation as
+    np.percentile. Returns NaN for an empty sample.
+    '''
+
+    n = len(samples)
+    if n == 0:
+        return np.nan*np.zeros(len(pctiles))
+    index = (n - 1) * (np.asarray(pctiles, dtype=float) / 100.)
+    lower = np.floor(index).astype(int)
+    upper = np.minimum(lower + 1, n - 1)
+    gamma = index - lower
+    below = samples[lower]
+    above = samples[upper]
+    diff = above - below
+
+    return np.where(gamma >= 0.5, above - diff*(1 - gamma), below + diff*gamma)
+
+
+def _finishClimYear(thresh_climYear, seas_climYear, smoothPercentile, smoothPercentileWidth):
+    '''
+    Fills in Feb 29 of the threshold and seasonal climatology by linear
+    interpolation and smooths them if desired. thresh_climYear may hold one
+    threshold per row. The inputs are not modified.
+    '''
+
+    thresh_climYear = np.array(thresh_climYear, dtype=float)
+    seas_climYear = np.array(seas_climYear, dtype=float)
+    for climYear in list(np.atleast_2d(thresh_climYear)) + [seas_climYear]:
+        # Special case for Feb 29
+        climYear[feb29-1] = 0.5*climYear[feb29-2] + 0.5*climYear[feb29]
+        # Smooth if desired
+        if smoothPercentile:
+            # If the climatology contains NaNs, then assume it is a <365-day year and deal accordingly
+            valid = ~np.isnan(climYear)
+            climYear[valid] = runavg(climYear[valid], smoothPercentileWidth)
+
+    return thresh_climYear, seas_climYear
+
+
+def _exceedRuns(temp, thresh):
+    '''
+    Start and end indices (inclusive) of all contiguous runs of temp above thresh
+    '''
 
     # Time series of "True" when threshold is exceeded, "False" otherwise
-    exceed_bool = temp - clim['thresh']
-    exceed_bool[exceed_bool<=0] = False
-    exceed_bool[exceed_bool>0] = True
-    # Find contiguous regions of exceed_bool = True
-    events, n_events = ndimage.label(exceed_bool)
+    exceed_bool = temp > thresh
+
+    return _runs(exceed_bool)
+
+
+def _runs(mask):
+    '''
+    Start and end indices (inclusive) of all contiguous runs of True in a
+    boolean series
+    '''
+
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+
+    return starts, ends
+
+
+def _joinRuns(t, starts, ends, minDuration=5, joinAcrossGaps=True, maxGap=2):
+    '''
+    Keeps the runs of duration >= minDuration, then joins those which occur
+    before and after a short gap (no longer than maxGap), as in
+    marineHeatWaves.detect. Returns the start and end indices of the MHWs.
+    '''
 
     # Find all MHW events of duration >= minDuration
-    for ev in range(1,n_events+1):
-        event_duration = (events == ev).sum()
-        if event_duration < minDuration:
-            continue
-        mhw['time_start'].append(t[np.where(events == ev)[0][0]])
-        mhw['time_end'].append(t[np.where(events == ev)[0][-1]])
+    keep = ends - starts + 1 >= minDuration
+    starts = starts[keep]
+    ends = ends[keep]
 
     # Link heat waves that occur before and after a short gap (gap must be no longer than maxGap)
-    if joinAcrossGaps:
+    if joinAcrossGaps and len(starts) > 1:
         # Calculate gap length for each consecutive pair of events
-        gaps = np.array(mhw['time_start'][1:]) - np.array(mhw['time_end'][0:-1]) - 1
-        if len(gaps) > 0:
-            while gaps.min() <= maxGap:
-                # Find first short gap
-                ev = np.where(gaps <= maxGap)[0][0]
-                # Extend first MHW to encompass second MHW (including gap)
-                mhw['time_end'][ev] = mhw['time_end'][ev+1]
-                # Remove second event from record
-                del mhw['time_start'][ev+1]
-                del mhw['time_end'][ev+1]
-                # Calculate gap length for each consecutive pair of events
-                gaps = np.array(mhw['time_start'][1:]) - np.array(mhw['time_end'][0:-1]) - 1
-                if len(gaps) == 0:
-                    break
+        gaps = t[starts[1:]] - t[ends[:-1]] - 1
+        # Joining across one gap leaves the others unchanged, so all short gaps are joined at once
+        long = gaps > maxGap
+        starts = starts[np.append(True, long)]
+        ends = ends[np.append(long, True)]
+
+    return starts, ends
+
+
+def _eventProperties(t, temp, thresh, seas, starts, ends):
+    '''
+    Calculates the properties of the MHWs with the given start and end indices,
+    as output by marineHeatWaves.detect, from the (gap-filled) temperature,
+    threshold and seasonal climatology.
+    '''
+
+    #
+    # Initialize MHW output variable
+    #
+
+    mhw = {}
+    mhw['time_start'] = [] # datetime format
+    mhw['time_end'] = [] # datetime format
+    mhw['time_peak'] = [] # datetime format
+    mhw['date_start'] = [] # datetime format
+    mhw['date_end'] = [] # datetime format
+    mhw['date_peak'] = [] # datetime format
+    mhw['index_start'] = []
+    mhw['index_end'] = []
+    mhw['index_peak'] = []
+    mhw['duration'] = [] # [days]
+    mhw['duration_moderate'] = [] # [days]
+    mhw['duration_strong'] = [] # [days]
+    mhw['duration_severe'] = [] # [days]
+    mhw['duration_extreme'] = [] # [days]
+    mhw['intensity_max'] = [] # [deg C]
+    mhw['intensity_mean'] = [] # [deg C]
+    mhw['intensity_var'] = [] # [deg C]
+    mhw['intensity_cumulative'] = [] # [deg C]
+    mhw['intensity_max_relThresh'] = [] # [deg C]
+    mhw['intensity_mean_relThresh'] = [] # [deg C]
+    mhw['intensity_var_relThresh'] = [] # [deg C]
+    mhw['intensity_cumulative_relThresh'] = [] # [deg C]
+    mhw['intensity_max_abs'] = [] # [deg C]
+    mhw['intensity_mean_abs'] = [] # [deg C]
+    mhw['intensity_var_abs'] = [] # [deg C]
+    mhw['intensity_cumulative_abs'] = [] # [deg C]
+    mhw['category'] = []
+    mhw['rate_onset'] = [] # [deg C / day]
+    mhw['rate_decline'] = [] # [deg C / day]
 
     # Calculate marine heat wave properties
-    mhw['n_events'] = len(mhw['time_start'])
-    categories = np.array(['Moderate', 'Strong', 'Severe', 'Extreme'])
+    mhw['n_events'] = len(starts)
+    # Category of every day, and number of days of each category in each MHW
+    eventDay, days = _eventDays(starts, ends)
+    cats = dailyCategory(temp, thresh, seas)[days]
+    catDays = categoryCounts(cats, eventDay, mhw['n_events'])
+    if mhw['n_events'] > 0:
+        catMax = np.maximum.reduceat(cats, np.cumsum(ends - starts + 1) - (ends - starts + 1))
     for ev in range(mhw['n_events']):
+        tt_start = int(starts[ev])
+        tt_end = int(ends[ev])
+        mhw['time_start'].append(t[tt_start])
+        mhw['time_end'].append(t[tt_end])
         mhw['date_start'].append(date.fromordinal(mhw['time_start'][ev]))
         mhw['date_end'].append(date.fromordinal(mhw['time_end'][ev]))
         # Get SST series during MHW event, relative to both threshold and to seasonal climatology
-        tt_start = np.where(t==mhw['time_start'][ev])[0][0]
-        tt_end = np.where(t==mhw['time_end'][ev])[0][0]
         mhw['index_start'].append(tt_start)
         mhw['index_end'].append(tt_end)
         temp_mhw = temp[tt_start:tt_end+1]
-        thresh_mhw = clim['thresh'][tt_start:tt_end+1]
-        seas_mhw = clim['seas'][tt_start:tt_end+1]
+        thresh_mhw = thresh[tt_start:tt_end+1]
+        seas_mhw = seas[tt_start:tt_end+1]
         mhw_relSeas = temp_mhw - seas_mhw
         mhw_relThresh = temp_mhw - thresh_mhw
-        mhw_relThreshNorm = (temp_mhw - thresh_mhw) / (thresh_mhw - seas_mhw)
         mhw_abs = temp_mhw
         # Find peak
         tt_peak = np.argmax(mhw_relSeas)
@@ -355,50 +473,150 @@ def detect(t, temp, climatologyPeriod=[None,None], pctile=90, windowHalfWidth=5,
         mhw['intensity_mean_abs'].append(mhw_abs.mean())
         mhw['intensity_var_abs'].append(np.sqrt(mhw_abs.var()))
         mhw['intensity_cumulative_abs'].append(mhw_abs.sum())
-        # Fix categories
-        tt_peakCat = np.argmax(mhw_relThreshNorm)
-        cats = np.floor(1. + mhw_relThreshNorm)
-        mhw['category'].append(categories[np.min([cats[tt_peakCat], 4]).astype(int) - 1])
-        mhw['duration_moderate'].append(np.sum(cats == 1.))
-        mhw['duration_strong'].append(np.sum(cats == 2.))
-        mhw['duration_severe'].append(np.sum(cats == 3.))
-        mhw['duration_extreme'].append(np.sum(cats >= 4.))
-        
-        # Rates of onset and decline
-        # Requires getting MHW strength at "start" and "end" of event (continuous: assume start/end half-day before/after first/last point)
-        if tt_start > 0:
-            mhw_relSeas_start = 0.5*(mhw_relSeas[0] + temp[tt_start-1] - clim['seas'][tt_start-1])
-            mhw['rate_onset'].append((mhw_relSeas[tt_peak] - mhw_relSeas_start) / (tt_peak+0.5))
-        else: # MHW starts at beginning of time series
-            if tt_peak == 0: # Peak is also at begining of time series, assume onset time = 1 day
-                mhw['rate_onset'].append((mhw_relSeas[tt_peak] - mhw_relSeas[0]) / 1.)
-            else:
-                mhw['rate_onset'].append((mhw_relSeas[tt_peak] - mhw_relSeas[0]) / tt_peak)
-        if tt_end < T-1:
-            mhw_relSeas_end = 0.5*(mhw_relSeas[-1] + temp[tt_end+1] - clim['seas'][tt_end+1])
-            mhw['rate_decline'].append((mhw_relSeas[tt_peak] - mhw_relSeas_end) / (tt_end-tt_start-tt_peak+0.5))
-        else: # MHW finishes at end of time series
-            if tt_peak == T-1: # Peak is also at end of time series, assume decline time = 1 day
-                mhw['rate_decline'].append((mhw_relSeas[tt_peak] - mhw_relSeas[-1]) / 1.)
-            else:
-                mhw['rate_decline'].append((mhw_relSeas[tt_peak] - mhw_relSeas[-1]) / (tt_end-tt_start-tt_peak))
+        # Fix categories (category of the peak of the threshold-normalised intensity)
+        mhw['category'].append(categories[catMax[ev] - 1])
+        mhw['duration_moderate'].append(catDays[ev, 1])
+        mhw['duration_strong'].append(catDays[ev, 2])
+        mhw['duration_severe'].append(catDays[ev, 3])
+        mhw['duration_extreme'].append(catDays[ev, 4])
 
-    # Flip climatology and intensties in case of cold spell detection
-    if coldSpells:
-        clim['seas'] = -1.*clim['seas']
-        clim['thresh'] = -1.*clim['thresh']
-        for ev in range(len(mhw['intensity_max'])):
-            mhw['intensity_max'][ev] = -1.*mhw['intensity_max'][ev]
-            mhw['intensity_mean'][ev] = -1.*mhw['intensity_mean'][ev]
-            mhw['intensity_cumulative'][ev] = -1.*mhw['intensity_cumulative'][ev]
-            mhw['intensity_max_relThresh'][ev] = -1.*mhw['intensity_max_relThresh'][ev]
-            mhw['intensity_mean_relThresh'][ev] = -1.*mhw['intensity_mean_relThresh'][ev]
-            mhw['intensity_cumulative_relThresh'][ev] = -1.*mhw['intensity_cumulative_relThresh'][ev]
-            mhw['intensity_max_abs'][ev] = -1.*mhw['intensity_max_abs'][ev]
-            mhw['intensity_mean_abs'][ev] = -1.*mhw['intensity_mean_abs'][ev]
-            mhw['intensity_cumulative_abs'][ev] = -1.*mhw['intensity_cumulative_abs'][ev]
-
-    return mhw, clim
+    # Rates of onset and decline, for all MHWs at once
+    onset, decline = onsetDeclineRates(temp, seas, starts, np.array(mhw['index_peak'], dtype=int), ends)
+    mhw['rate_onset'] = list(onset)
+    mhw['rate_decline'] = list(decline)
+
+    return mhw
+
+
+def onsetDeclineRates(temp, seas, starts, peaks, ends):
+    '''
+    Rates of onset and decline of MHWs, as in marineHeatWaves.detect, for all
+    MHWs at once. The intensity at the start (end) of a MHW is taken half a day
+    before (after) its first (last) day; a MHW at the start (end) of the series
+    uses its first (last) day instead.
+    Inputs:
+      temp, seas   Temperature (with missing values filled) and seasonal
+                   climatology [1D numpy arrays of length T]
+      starts, peaks, ends
+                   Start, peak and end indices of the MHWs [integer numpy arrays of
+                   length N]
+    Outputs:
+      onset        Onset rate of each MHW [deg. C / days]
+      decline      Decline rate of each MHW [deg. C / days]
+    '''
+
+    T = len(temp)
+    relPeak = temp[peaks] - seas[peaks]
+    relStart = temp[starts] - seas[starts]
+    relEnd = temp[ends] - seas[ends]
+    before = np.maximum(starts - 1, 0)
+    after = np.minimum(ends + 1, T - 1)
+    tt_peak = peaks - starts
+
+    # Intensities are combined in the dtype of temp, the rates computed in float64
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Continuous: assume start/end half-day before/after first/last point
+        relBefore = (relStart + temp[before] - seas[before]).astype(np.float64)
+        relAfter = (relEnd + temp[after] - seas[after]).astype(np.float64)
+        onset = (relPeak - 0.5*relBefore) / (tt_peak + 0.5)
+        decline = (relPeak - 0.5*relAfter) / (ends - peaks + 0.5)
+        # MHW starts at beginning of time series, if the peak is also there assume onset time = 1 day
+        first = starts == 0
+        onset[first] = (relPeak[first] - relStart[first]).astype(np.float64) / np.where(tt_peak[first] == 0, 1, tt_peak[first])
+        # MHW finishes at end of time series, if the peak is also there assume decline time = 1 day
+        last = ends == T - 1
+        decline[last] = (relPeak[last] - relEnd[last]).astype(np.float64) / np.where(tt_peak[last] == T - 1, 1, ends[last] - peaks[last])
+
+    return onset, decline
+
+
+def dailyCategory(temp, thresh, seas):
+    '''
+    Category of each day, following Hobday et al. (in prep., Oceanography): the
+    intensity relative to the threshold in multiples of the threshold exceedance
+    (threshold - climatology), as in marineHeatWaves.detect.
+    Inputs:
+      temp, thresh, seas   Temperature, threshold and seasonal climatology [numpy
+                           arrays of equal shape, e.g. T for a time series or
+                           T x nLat x nLon for a grid]
+    Outputs:
+      category             Category of each day [int8 numpy array of the same shape]:
+                           0 below the threshold (or missing), 1 moderate, 2 strong,
+                           3 severe and 4 extreme
+    '''
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cats = np.floor(1. + (temp - thresh) / (thresh - seas))
+    cats[~(cats >= 1.)] = 0.
+
+    return np.minimum(cats, 4.).astype(np.int8)
+
+
+def categoryCodes(category):
+    '''
+    Codes of MHW category names, e.g. of the 'category' output of detect.
+    Inputs:
+      category   Category names [list or numpy array of strings, as in categories]
+    Outputs:
+      codes      Category code of each name [int8 numpy array]: 1 moderate, 2 strong,
+                 3 severe and 4 extreme, as dailyCategory
+    '''
+
+    names, inverse = np.unique(np.asarray(category), return_inverse=True)
+    codes = np.array([list(categories).index(name) + 1 for name in names], dtype=np.int8)
+
+    return codes[inverse]
+
+
+def categoryCounts(category, group, nGroups):
+    '''
+    Number of days of each category (as output by marineHeatWaves.dailyCategory)
+    in each group of days (e.g. each MHW, or each block of years), in a single
+    pass over all (group, category) pairs.
+    Inputs:
+      category   Category of each day [int8 numpy array of length N]
+      group      Group of each day, in range 0 to nGroups-1 [integer numpy array
+                 of length N]
+      nGroups    Number of groups
+    Outputs:
+      counts     Number of days [numpy array of size nGroups x 5], column c
+                 counting the days of category c
+    '''
+
+    pairs = np.asarray(group, dtype=np.int64)*5 + category
+
+    return np.bincount(pairs, minlength=nGroups*5).reshape(nGroups, 5)
+
+
+def _eventDays(starts, ends):
+    '''
+    Index of the MHW of each MHW day and the index of the day, for MHWs with
+    the given start and end indices (inclusive)
+    '''
+
+    durations = ends - starts + 1
+    eventDay = np.repeat(np.arange(len(starts)), durations)
+    days = np.arange(durations.sum()) - np.repeat(np.cumsum(durations) - durations, durations) + np.repeat(starts, durations)
+
+    return eventDay, days
+
+
+def _flipIntensities(mhw):
+    '''
+    Flips the sign of the intensities of MHWs detected on a negated
+    temperature series (cold spell detection), in place
+    '''
+
+    for ev in range(len(mhw['intensity_max'])):
+        mhw['intensity_max'][ev] = -1.*mhw['intensity_max'][ev]
+        mhw['intensity_mean'][ev] = -1.*mhw['intensity_mean'][ev]
+        mhw['intensity_cumulative'][ev] = -1.*mhw['intensity_cumulative'][ev]
+        mhw['intensity_max_relThresh'][ev] = -1.*mhw['intensity_max_relThresh'][ev]
+        mhw['intensity_mean_relThresh'][ev] = -1.*mhw['intensity_mean_relThresh'][ev]
+        mhw['intensity_cumulative_relThresh'][ev] = -1.*mhw['intensity_cumulative_relThresh'][ev]
+        mhw['intensity_max_abs'][ev] = -1.*mhw['intensity_max_abs'][ev]
+        mhw['intensity_mean_abs'][ev] = -1.*mhw['intensity_mean_abs'][ev]
+        mhw['intensity_cumulative_abs'][ev] = -1.*mhw['intensity_cumulative_abs'][ev]
 
 
 def blockAverage(t, mhw, clim=None, blockLength=1, removeMissing=False, temp=None):
@@ -459,18 +677,12 @@ def blockAverage(t, mhw, clim=None, blockLength=1, removeMissing=False, temp=Non
     # Time and dates vectors, and calculate block timing
     #
 
-    # Generate vectors for year, month, day-of-month, and day-of-year
-    T = len(t)
-    year = np.zeros((T))
-    month = np.zeros((T))
-    day = np.zeros((T))
-    for i in range(T):
-        year[i] = date.fromordinal(t[i]).year
-        month[i] = date.fromordinal(t[i]).month
-        day[i] = date.fromordinal(t[i]).day
-
-    # Number of blocks, round up to include partial blocks at end
-    years = np.unique(year)
+    # Generate vector for year
+    year = calendar(t)[0]
+
+    # Number of blocks, round up to include partial blocks at end (years as floats,
+    # as output in years_start and years_end)
+    years = np.unique(year).astype(float)
     nBlocks = np.ceil((years.max() - years.min() + 1) / blockLength).astype(int)
 
     #
@@ -524,10 +736,8 @@ def blockAverage(t, mhw, clim=None, blockLength=1, removeMissing=False, temp=Non
         mhwBlock['strong_days'] = np.zeros(nBlocks)
         mhwBlock['severe_days'] = np.zeros(nBlocks)
         mhwBlock['extreme_days'] = np.zeros(nBlocks)
-        cats = np.floor(1 + (temp - clim['thresh']) / (clim['thresh'] - clim['seas']))
-        mhwIndex = np.zeros(t.shape)
-        for ev in range(mhw['n_events']):
-            mhwIndex[mhw['index_start'][ev]:mhw['index_end'][ev]+1] = 1.
+        cats = dailyCategory(temp, clim['thresh'], clim['seas'])
+        mhwDays = _eventDays(np.array(mhw['index_start'], dtype=int), np.array(mhw['index_end'], dtype=int))[1]
 
 
     # Start, end, and centre years for all blocks
@@ -572,11 +782,13 @@ def blockAverage(t, mhw, clim=None, blockLength=1, removeMissing=False, temp=Non
 
     # Calculation of category days
     if sw_cats:
-        for i in range(int(nBlocks)):
-            mhwBlock['moderate_days'][i] = ((year >= mhwBlock['years_start'][i]) * (year <= mhwBlock['years_end'][i]) * mhwIndex * (cats == 1)).astype(int).sum()
-            mhwBlock['strong_days'][i] = ((year >= mhwBlock['years_start'][i]) * (year <= mhwBlock['years_end'][i]) * mhwIndex * (cats == 2)).astype(int).sum()
-            mhwBlock['severe_days'][i] = ((year >= mhwBlock['years_start'][i]) * (year <= mhwBlock['years_end'][i]) * mhwIndex * (cats == 3)).astype(int).sum()
-            mhwBlock['extreme_days'][i] = ((year >= mhwBlock['years_start'][i]) * (year <= mhwBlock['years_end'][i]) * mhwIndex * (cats >= 4)).astype(int).sum()
+        # Block of each MHW day, then one count over all (block, category) pairs
+        block = np.searchsorted(mhwBlock['years_start'], year[mhwDays], side='right') - 1
+        catDays = categoryCounts(cats[mhwDays], block, int(nBlocks))
+        mhwBlock['moderate_days'] = catDays[:, 1].astype(float)
+        mhwBlock['strong_days'] = catDays[:, 2].astype(float)
+        mhwBlock['severe_days'] = catDays[:, 3].astype(float)
+        mhwBlock['extreme_days'] = catDays[:, 4].astype(float)
 
     # Calculate averages
     count = 1.*mhwBlock['count']
@@ -684,6 +896,10 @@ def meanTrend(mhwBlock, alpha=0.05):
     Written by Eric Oliver, Institue for Marine and Antarctic Studies, University of Tasmania, Feb-Mar 2015
     '''
 
+    # Loaded here rather than with the module, detection does not need them
+    from scipy import linalg
+    from scipy import stats
+
     # Initialize mean and trend dictionaries
     mean = {}
     trend = {}
@@ -789,6 +1005,84 @@ def rank(t, mhw):
     return rank, returnPeriod
 
 
+def calendar(t):
+    '''
+    Decomposes a time vector into calendar components, by array arithmetic
+    rather than per-element date conversions.
+    Inputs:
+      t       Time vector, in datetime format (e.g., date(1982,1,1).toordinal())
+              [1D numpy array of length T]
+    Outputs:
+      year    Year [int16 numpy array of length T]
+      month   Month [int16 numpy array of length T]
+      day     Day-of-month [int16 numpy array of length T]
+      doy     Day-of-year on a leap-year basis, i.e. in range 1 to 366 with
+              Mar 1 = 61 in all years [int16 numpy array of length T]
+    '''
+
+    days = (np.asarray(t, dtype=np.int64) - date(1970, 1, 1).toordinal()).astype('datetime64[D]')
+    months = days.astype('datetime64[M]')
+    year = (months.astype('datetime64[Y]').astype(np.int64) + 1970).astype(np.int16)
+    month = (months.astype(np.int64) % 12 + 1).astype(np.int16)
+    day = ((days - months).astype(np.int64) + 1).astype(np.int16)
+    doy = (monthStart_leapYear[month-1] + day).astype(np.int16)
+
+    return year, month, day, doy
+
+
+def _cachedCalendar(t):
+    '''
+    marineHeatWaves.calendar of a time vector, cached on the time vector so that
+    repeated calls with the same series (e.g. the cells of a grid, or the same
+    alternate climatology) skip the decomposition. The arrays are read-only.
+    '''
+
+    t = np.asarray(t)
+    key = (t.dtype.str, t.tobytes())
+    if key not in _calendarCache:
+        if len(_calendarCache) >= 8:
+            _calendarCache.clear()
+        components = calendar(t)
+        for component in components:
+            component.flags.writeable = False
+        _calendarCache[key] = components
+
+    return _calendarCache[key]
+
+
+def _isDoyClimatology(T, nRows, doyClimatology=None):
+    '''
+    Whether a threshold or seasonal climatology of nRows rows, applied to a
+    record of T days, holds one row per day-of-year (366 rows) or one row per
+    day of the record (T rows). doyClimatology states it; if None, it is
+    inferred from nRows, which cannot tell them apart when T is 366.
+    '''
+
+    if doyClimatology is None:
+        if (nRows == 366) and (T == 366):
+            raise ValueError('a 366-day record with a 366-row climatology is ambiguous, set doyClimatology')
+        doyClimatology = (nRows == 366)
+    expected = 366 if doyClimatology else T
+    if nRows != expected:
+        raise ValueError('the climatology has ' + str(nRows) + ' rows, expected ' + str(expected) + (' (one per day-of-year)' if doyClimatology else ' (one per day of the record)'))
+
+    return doyClimatology
+
+
+# Calendars of recently used time vectors, keyed on the time vector
+_calendarCache = {}
+
+# Day-of-year of the day before the first of each month, in a leap year
+monthStart_leapYear = np.array([0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335], dtype=np.int16)
+
+# Constants (doy values for Feb-28 and Feb-29) for handling leap-years
+feb28 = 59
+feb29 = 60
+
+# MHW category names, in the order of their codes 1 to 4 (see dailyCategory)
+categories = np.array(['Moderate', 'Strong', 'Severe', 'Extreme'])
+
+
 def runavg(ts, w):
     '''
     Performs a running average of an input time series using uniform window
@@ -830,10 +1124,10 @@ def pad(data, maxPadLength=False):
     interpolated = np.interp(bad_indexes.nonzero()[0], good_indexes.nonzero()[0], good_data)
     data_padded[bad_indexes] = interpolated
     if maxPadLength:
-        blocks, n_blocks = ndimage.label(np.isnan(data))
-        for bl in range(1, n_blocks+1):
-            if (blocks==bl).sum() > maxPadLength:
-                data_padded[blocks==bl] = np.nan
+        starts, ends = _runs(bad_indexes)
+        for start, end in zip(starts, ends):
+            if end - start + 1 > maxPadLength:
+                data_padded[start:end+1] = np.nan
 
     return data_padded
 
@@ -0,0 +1,459 @@
+'''
+    Streaming calculation of the marine heat wave (MHW) climatology of
+    Hobday et al. (2016), for records or grids too large to hold in
+    memory: data are fed in chunks of time and only a summary of the
+    windowed samples of each day-of-year is kept. Fixed-baseline
+    climatologies can be saved to file and memory-mapped back for detection
+'''
+
+
+import functools
+import json
+import multiprocessing
+import struct
+import numpy as np
+
+import marineHeatWaves as mhw
+
+
+def windowOffsets(t, climatologyPeriod, windowHalfWidth=5, record=None):
+    '''
+    Finds, for each offset within the window, the day-of-year windows to which
+    each element of a time vector contributes. An element at time t contributes
+    to the window centred on t - offset whenever that centre lies within the
+    climatology period and is not a Feb 29, as in marineHeatWaves.detect. As
+    each element is assigned independently of the others, a record can be split
+    into chunks and the chunks processed separately. marineHeatWaves.detect only
+    centres windows on the days of the record, which record restricts the
+    centres to when the record does not span whole years.
+    Inputs:
+      t                  Time vector, in datetime format (e.g., date(1982,1,1).toordinal())
+                         [1D numpy array of length T]
+      climatologyPeriod  Period over which climatology is calculated, as a list of
+                         start and end years e.g. [1983,2012]
+    Options:
+      windowHalfWidth    As for marineHeatWaves.detect (DEFAULT = 5 [days])
+      record             First and last times of the whole record, in datetime
+                         format e.g. [t[0], t[-1]], outside which no window is
+                         centred (DEFAULT = None, no restriction)
+    Outputs:
+      offsets            List with, for each offset from -windowHalfWidth to
+                         windowHalfWidth, a tuple of (i) the indices of the
+                         contributing elements of t and (ii) the day-of-year minus one
+                         (leap-year basis) of the window they contribute to
+    Notes:
+      The record is assumed to cover the whole climatology period, so that every
+      window centre within the period exists, or to be bounded by record. This is
+      always the case when the period is covered by continuous daily data.
+    '''
+
+    t = np.asarray(t, dtype=np.int64)
+    if len(t) == 0:
+        return [(np.zeros(0, dtype=int), np.zeros(0, dtype=int))]*(2*windowHalfWidth+1)
+    # Calendar of all the window centres reached from t
+    centres = np.arange(t.min() - windowHalfWidth, t.max() + windowHalfWidth + 1)
+    year, month, day, doy = mhw.calendar(centres)
+    valid = (year >= climatologyPeriod[0]) & (year <= climatologyPeriod[1]) & (doy != mhw.feb29)
+    if record is not None:
+        valid &= (centres >= record[0]) & (centres <= record[1])
+    offsets = []
+    for w in range(-windowHalfWidth, windowHalfWidth+1):
+        # Element t[i] is offset w from the window centre t[i] - w
+        c = t - w - centres[0]
+        points = np.flatnonzero(valid[c])
+        offsets.append((points, doy[c[points]].astype(int) - 1))
+
+    return offsets
+
+
+class Climatology(object):
+    '''
+    Threshold and seasonal climatology, accumulated from chunks of a record
+    with add(t, temp) and combined across parts of a record (e.g. decades or
+    tiles processed by different workers) with merge(other). The seasonal
+    climatology is accumulated as sums and counts; the subclasses differ in how
+    the windowed samples are kept for the percentiles:
+      ClimatologyAccumulator   all samples, exact thresholds
+      ClimatologySketch        histogram, approximate thresholds in fixed memory
+    Inputs:
+      climatologyPeriod  Period over which climatology is calculated, as a list of
+                         start and end years e.g. [1983,2012]
+    Options:
+      shape              Spatial shape of the data, e.g. (nLat, nLon) for chunks of
+                         size T x nLat x nLon (DEFAULT = (), a single time series)
+      windowHalfWidth    As for marineHeatWaves.detect (DEFAULT = 5 [days])
+      record             As for windowOffsets (DEFAULT = None)
+    Usage:
+      acc = ClimatologyAccumulator([1983,2012], shape=(nLat, nLon))
+      for t, temp in chunks:
+          acc.add(t, temp)
+      clim = acc.climatology(pctile=90)
+    Notes:
+      As for windowOffsets, the record is assumed to cover the whole climatology
+      period. Parts of the record may be added in any order and may overlap the
+      period boundaries.
+    '''
+
+    def __init__(self, climatologyPeriod, shape=(), windowHalfWidth=5, record=None):
+        self.climatologyPeriod = [int(climatologyPeriod[0]), int(climatologyPeriod[1])]
+        self.record = None if record is None else [int(record[0]), int(record[1])]
+        self.shape = tuple(shape)
+        self.nCells = int(np.prod(self.shape))
+        self.windowHalfWidth = windowHalfWidth
+        # Sum and number of the windowed samples, by day-of-year and cell
+        self.sum = np.zeros((366, self.nCells))
+        self.n = np.zeros((366, self.nCells), dtype=np.int64)
+
+    @property
+    def nbytes(self):
+        '''
+        Memory used by the accumulated samples [bytes]
+        '''
+        return self.sum.nbytes + self.n.nbytes
+
+    def add(self, t, temp):
+        '''
+        Adds a chunk of the record.
+        Inputs:
+          t       Time vector of the chunk, in datetime format [1D numpy array of length T]
+          temp    Temperature of the chunk [numpy array of size T x shape], missing
+                  values as NaN
+        '''
+
+        temp = np.asarray(temp).reshape(len(t), self.nCells)
+        cell = np.arange(self.nCells)
+        for points, doyIndex in windowOffsets(t, self.climatologyPeriod, self.windowHalfWidth, self.record):
+            values = temp[points]
+            valid = ~np.isnan(values)
+            doyCell = (doyIndex[:, np.newaxis]*self.nCells + cell)[valid]
+            self.n += np.bincount(doyCell, minlength=366*self.nCells).reshape(366, self.nCells)
+            self.sum += np.bincount(doyCell, weights=values[valid], minlength=366*self.nCells).reshape(366, self.nCells)
+            self._addSamples(doyIndex, values, doyCell, values[valid])
+
+        return self
+
+    def merge(self, other):
+        '''
+        Adds the samples accumulated by another object of the same class and
+        settings (e.g. from another part of the record) to this one.
+        '''
+
+        if (type(self) != type(other)) + (self._settings() != other._settings()):
+            raise ValueError('climatologies with different settings cannot be merged')
+        self.n += other.n
+        self.sum += other.sum
+        self._mergeSamples(other)
+
+        return self
+
+    def climatology(self, pctile=90, smoothPercentile=True, smoothPercentileWidth=31, coldSpells=False):
+        '''
+        Calculates the threshold and seasonal climatology from the accumulated samples.
+        Options:
+          pctile                 Threshold percentile (%), or list of percentiles
+                                 (DEFAULT = 90)
+          smoothPercentile, smoothPercentileWidth
+                                 As for marineHeatWaves.detect
+          coldSpells             If True, the thresholds are for the detection of cold
+                                 spells, i.e. the (100 - pctile)th percentiles, as
+                                 computed by marineHeatWaves.detect (DEFAULT = False)
+        Outputs:
+          clim    Dictionary with keys 'thresh' [numpy array of size 366 x shape, or
+                  P x 366 x shape if pctile is a list of P percentiles] and 'seas'
+                  [numpy array of size 366 x shape], indexed by day-of-year minus one
+                  on a leap-year basis. For a single time series this can be passed
+                  directly as the alternateClimatology of marineHeatWaves.detect.
+        '''
+
+        pctiles = np.atleast_1d(np.asarray(pctile, dtype=float))
+        if coldSpells:
+            pctiles = 100. - pctiles
+        thresh = np.nan*np.zeros((len(pctiles), 366, self.nCells))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            seas = self.sum / self.n
+        seas[self.n == 0] = np.nan
+        for d in range(366):
+            if not self.n[d].any():
+                continue
+            thresh[:, d] = self._percentiles(d, pctiles)
+            thresh[:, d, self.n[d] == 0] = np.nan
+
+        for c in range(self.nCells):
+            thresh[:, :, c], seas[:, c] = mhw._finishClimYear(thresh[:, :, c], seas[:, c], smoothPercentile, smoothPercentileWidth)
+
+        clim = {}
+        clim['thresh'] = thresh.reshape((len(pctiles), 366) + self.shape)
+        if np.ndim(pctile) == 0:
+            clim['thresh'] = clim['thresh'][0]
+        clim['seas'] = seas.reshape((366,) + self.shape)
+
+        return clim
+
+    def _settings(self):
+        return [self.climatologyPeriod, self.shape, self.windowHalfWidth, self.record]
+
+
+class ClimatologyAccumulator(Climatology):
+    '''
+    Exact threshold and seasonal climatology, accumulated from chunks of a
+    record (see Climatology). All windowed samples are kept, by day-of-year,
+    and merged by concatenation, so the thresholds are those of
+    marineHeatWaves.detect over the climatology period, and the seasonal
+    climatology agrees to within rounding. Memory is that of the windowed
+    samples, (2*windowHalfWidth+1) times the record.
+    '''
+
+    def __init__(self, climatologyPeriod, shape=(), windowHalfWidth=5, record=None):
+        Climatology.__init__(self, climatologyPeriod, shape=shape, windowHalfWidth=windowHalfWidth, record=record)
+        # Windowed samples of each day-of-year, as a list of arrays of size K x nCells
+        self.samples = [[] for d in range(366)]
+
+    @property
+    def nbytes(self):
+        return Climatology.nbytes.fget(self) + sum([part.nbytes for parts in self.samples for part in parts])
+
+    def _addSamples(self, doyIndex, values, doyCell, validValues):
+        # Group the rows of this offset by day-of-year
+        order = np.argsort(doyIndex, kind='stable')
+        bounds = np.searchsorted(doyIndex[order], np.arange(367))
+        for d in np.unique(doyIndex):
+            self.samples[d].append(values[order[bounds[d]:bounds[d+1]]])
+
+    def _mergeSamples(self, other):
+        for d in range(366):
+            self.samples[d] += other.samples[d]
+
+    def _percentiles(self, d, pctiles):
+        # Percentiles of the samples of day-of-year index d, for all cells, with the
+        # same linear interpolation as np.percentile (missing values sort last)
+        samples = np.sort(np.concatenate(self.samples[d]), axis=0)
+        self.samples[d] = [samples]
+        n = self.n[d]
+        result = np.nan*np.zeros((len(pctiles), self.nCells))
+        cell = np.arange(self.nCells)
+        for p in range(len(pctiles)):
+            index = (n - 1) * (pctiles[p] / 100.)
+            lower = np.maximum(np.floor(index).astype(np.int64), 0)
+            upper = np.minimum(lower + 1, np.maximum(n - 1, 0))
+            gamma = index - lower
+            below = samples[lower, cell]
+            above = samples[upper, cell]
+            diff = above - below
+            result[p] = np.where(gamma >= 0.5, above - diff*(1 - gamma), below + diff*gamma)
+
+        return result
+
+
+class ClimatologySketch(Climatology):
+    '''
+    Approximate threshold and exact seasonal climatology, accumulated from chunks
+    of a record (see Climatology). For each day-of-year and cell, the windowed
+    samples are kept as a histogram of fixed-width bins, so memory does not grow
+    with the length of the record or the number of ensemble members.
+    Options (in addition to those of Climatology):
+      lo, hi             Range of the histogram [deg. C], scalars or arrays of the
+                         spatial shape for a range per cell. Values outside the range
+                         are counted in the first or last bin
+                         (DEFAULT = -2 and 36 [deg. C])
+      resolution         Bin width [deg. C] (DEFAULT = 0.05)
+      countType          Integer type of the bin counts (DEFAULT = np.uint16, at
+                         most 65535 windowed samples per day-of-year and cell,
+                         e.g. 5957 years with windowHalfWidth = 5)
+    Notes:
+      1. Thresholds are taken from the histogram with the same linear interpolation
+         between order statistics as np.percentile, each order statistic being placed
+         at the centre of its bin. Where all samples lie within [lo, hi], the
+         threshold therefore differs from the exact marineHeatWaves.detect threshold
+         by at most resolution/2, before and after smoothing (see errorBound).
+         Samples outside the range are counted in outOfRange; thresholds within the
+         first or last bin are then unbounded.
+      2. The seasonal climatology is computed exactly, from sums and counts.
+    '''
+
+    def __init__(self, climatologyPeriod, shape=(), windowHalfWidth=5, lo=-2., hi=36., resolution=0.05, countType=np.uint16, record=None):
+        Climatology.__init__(self, climatologyPeriod, shape=shape, windowHalfWidth=windowHalfWidth, record=record)
+        self.resolution = float(resolution)
+        self.lo = np.broadcast_to(np.asarray(lo, dtype=float), self.shape).ravel().copy()
+        hi = np.broadcast_to(np.asarray(hi, dtype=float), self.shape).ravel()
+        self.nBins = int(np.ceil(np.max(hi - self.lo) / self.resolution))
+        # Histogram of the windowed samples, by day-of-year, bin and cell
+        self.counts = np.zeros((366, self.nBins, self.nCells), dtype=countType)
+        # Number of samples outside [lo, hi], by cell
+        self.outOfRange = np.zeros(self.nCells, dtype=np.int64)
+
+    @property
+    def errorBound(self):
+        '''
+        Maximum difference [deg. C] between the approximate and exact thresholds
+        (where outOfRange is zero)
+        '''
+        return 0.5*self.resolution
+
+    @property
+    def nbytes(self):
+        return Climatology.nbytes.fget(self) + self.counts.nbytes + self.outOfRange.nbytes + self.lo.nbytes
+
+    def _settings(self):
+        return Climatology._settings(self) + [self.resolution, self.nBins, self.lo.tolist()]
+
+    def _addSamples(self, doyIndex, values, doyCell, validValues):
+        self._checkCounts()
+        cell = doyCell % self.nCells
+        bins = np.floor((validValues - self.lo[cell]) / self.resolution).astype(np.int64)
+        outside = (bins < 0) | (bins >= self.nBins)
+        self.outOfRange += np.bincount(cell[outside], minlength=self.nCells)
+        bins = np.clip(bins, 0, self.nBins-1)
+        np.add.at(self.counts.reshape(-1), ((doyCell // self.nCells)*self.nBins + bins)*self.nCells + cell, 1)
+
+    def _mergeSamples(self, other):
+        self._checkCounts()
+        self.counts += other.counts
+        self.outOfRange += other.outOfRange
+
+    def _checkCounts(self):
+        # A bin never holds more samples than its day-of-year and cell
+        if self.n.max(initial=0) > np.iinfo(self.counts.dtype).max:
+            raise OverflowError('more than ' + str(np.iinfo(self.counts.dtype).max) + ' samples per day-of-year and cell, use a larger countType')
+
+    def _percentiles(self, d, pctiles):
+        # Percentiles of the histogram of day-of-year index d, for all cells
+        cum = np.cumsum(self.counts[d], axis=0, dtype=np.int64)
+        n = cum[-1]
+        result = np.nan*np.zeros((len(pctiles), self.nCells))
+        for p in range(len(pctiles)):
+            index = (n - 1) * (pctiles[p] / 100.)
+            lower = np.floor(index).astype(np.int64)
+            gamma = index - lower
+            # Bin holding each order statistic, and its centre
+            below = self.lo + ((cum <= lower).sum(axis=0) + 0.5) * self.resolution
+            above = self.lo + ((cum <= np.minimum(lower + 1, n - 1)).sum(axis=0) + 0.5) * self.resolution
+            result[p] = below + (above - below) * gamma
+
+        return result
+
+
+def accumulate(load, parts, climatologyPeriod, processes=None, sketch=False, **kwargs):
+    '''
+    Accumulates the climatology of a record split into parts (e.g. decades or
+    tiles of years) in parallel worker processes, and merges the results.
+    Inputs:
+      load               Function returning (t, temp) for a part, as accepted by
+                         Climatology.add. Must be picklable, i.e. defined at the top
+                         level of a module.
+      parts              List of arguments of load, one per part (e.g. file names)
+      climatologyPeriod  Period over which climatology is calculated, as a list of
+                         start and end years e.g. [1983,2012]
+    Options:
+      processes          Number of worker processes (DEFAULT = None, one per CPU;
+                         0 to run in the calling process)
+      sketch             If True, use ClimatologySketch rather than
+                         ClimatologyAccumulator (DEFAULT = False)
+      All other keyword arguments are passed to the constructor (e.g. shape).
+    Outputs:
+      acc                Merged ClimatologyAccumulator or ClimatologySketch, on
+                         which climatology() gives the thresh and seas
+    '''
+
+    worker = functools.partial(_accumulatePart, load, climatologyPeriod, sketch, kwargs)
+    if processes == 0:
+        results = [worker(part) for part in parts]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(worker, parts)
+        finally:
+            pool.close()
+            pool.join()
+
+    acc = results[0]
+    for result in results[1:]:
+        acc.merge(result)
+
+    return acc
+
+
+def _accumulatePart(load, climatologyPeriod, sketch, kwargs, part):
+    # Worker of accumulate: climatology of a single part of the record
+    acc = (ClimatologySketch if sketch else ClimatologyAccumulator)(climatologyPeriod, **kwargs)
+    t, temp = load(part)
+
+    return acc.add(t, temp)
+
+
+# File format of saved baselines: magic, format version and header length,
+# a JSON header, then the thresh and seas arrays aligned to 64 bytes
+baselineMagic = b'MHWCLIM\x00'
+baselineVersion = 1
+
+
+def saveBaseline(fname, clim, metadata=None, dtype=np.float32):
+    '''
+    Saves a fixed-baseline climatology (e.g. 1983-2012) to a single compact
+    file, from which it can be memory-mapped with loadBaseline.
+    Inputs:
+      fname     File name
+      clim      Climatology as output by Climatology.climatology, i.e. a dictionary
+                with keys 'thresh' [numpy array of size 366 x shape, or P x 366 x shape]
+                and 'seas' [numpy array of size 366 x shape]
+    Options:
+      metadata  Dictionary of JSON-serializable values describing the baseline,
+                e.g. {'climatologyPeriod': [1983, 2012], 'pctile': 90, 'source': ...}
+                (DEFAULT = None)
+      dtype     Floating point type of the saved arrays (DEFAULT = np.float32)
+    '''
+
+    thresh = np.ascontiguousarray(clim['thresh'], dtype=dtype)
+    seas = np.ascontiguousarray(clim['seas'], dtype=dtype)
+    header = {'dtype': np.dtype(dtype).str, 'thresh': list(thresh.shape), 'seas': list(seas.shape), 'metadata': metadata or {}}
+    header = json.dumps(header).encode('utf-8')
+    # Pad the header so that the arrays start on a 64-byte boundary
+    start = len(baselineMagic) + 8 + len(header)
+    header += b' '*(-start % 64)
+
+    with open(fname, 'wb') as f:
+        f.write(baselineMagic)
+        f.write(struct.pack('<II', baselineVersion, len(header)))
+        f.write(header)
+        f.write(thresh.tobytes())
+        f.write(seas.tobytes())
+
+
+def loadBaseline(fname, mmap=True):
+    '''
+    Loads a climatology saved with saveBaseline.
+    Inputs:
+      fname     File name
+    Options:
+      mmap      If True, the arrays are memory-mapped (read-only), so only the
+                parts used are read from disk (DEFAULT = True)
+    Outputs:
+      clim      Dictionary with keys 'thresh' and 'seas' as saved, and 'metadata'.
+                For a single time series this can be passed directly as the
+                alternateClimatology of marineHeatWaves.detect, and for a grid as
+                that of mhwGrid.detectGrid.
+    '''
+
+    with open(fname, 'rb') as f:
+        if f.read(len(baselineMagic)) != baselineMagic:
+            raise ValueError(fname + ' is not a saved climatology baseline')
+        version, length = struct.unpack('<II', f.read(8))
+        if version > baselineVersion:
+            raise ValueError(fname + ' has format version ' + str(version) + ', only versions up to ' + str(baselineVersion) + ' can be read')
+        header = json.loads(f.read(length).decode('utf-8'))
+    offset = len(baselineMagic) + 8 + length
+    dtype = np.dtype(header['dtype'])
+
+    clim = {}
+    for key in ['thresh', 'seas']:
+        shape = tuple(header[key])
+        if mmap:
+            clim[key] = np.memmap(fname, dtype=dtype, mode='r', offset=offset, shape=shape)
+        else:
+            with open(fname, 'rb') as f:
+                f.seek(offset)
+                clim[key] = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+        offset += int(np.prod(shape)) * dtype.itemsize
+    clim['metadata'] = header['metadata']
+    clim['metadata']['version'] = version
+
+    return clim
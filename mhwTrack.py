@@ -0,0 +1,234 @@
+'''
+    Tracking of marine heat waves (MHWs) as spatio-temporal objects:
+    connected regions of threshold exceedance in the (time, lat, lon)
+    cube, labelled in chunks of time so that memory is bounded by the
+    chunk length
+'''
+
+
+import numpy as np
+import scipy.ndimage as ndimage
+
+import marineHeatWaves as mhw
+
+
+# Mean radius of the Earth [km]
+earthRadius = 6371.
+
+
+def cellArea(lat, lon):
+    '''
+    Area [km^2] of the cells of a regular lat/lon grid.
+    Inputs:
+      lat     Latitudes of the cell centres [1D numpy array of length nLat]
+      lon     Longitudes of the cell centres [1D numpy array of length nLon]
+    Outputs:
+      area    Cell areas [2D numpy array of size nLat x nLon]
+    '''
+
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    dlat = np.abs(np.gradient(lat)) if len(lat) > 1 else np.ones(1)
+    dlon = np.abs(np.gradient(lon)) if len(lon) > 1 else np.ones(1)
+    band = np.sin(np.deg2rad(np.minimum(lat + dlat/2, 90.))) - np.sin(np.deg2rad(np.maximum(lat - dlat/2, -90.)))
+
+    return earthRadius**2 * np.outer(band, np.deg2rad(dlon))
+
+
+def track(t, lat, lon, temp, thresh, seas, connectivity=1, chunkLength=365, minDuration=1, coldSpells=False, doyClimatology=None):
+    '''
+    Labels MHWs as connected regions of threshold exceedance in space and time,
+    so that a large-scale event is one object rather than one event per cell.
+    The cube is labelled (scipy.ndimage.label) in chunks of time; each chunk
+    overlaps the previous one by one day, and labels which meet across the
+    seam are joined.
+    Inputs:
+      t       Time vector, in datetime format (e.g., date(1982,1,1).toordinal())
+              [1D numpy array of length T]
+      lat     Latitudes of the grid [1D numpy array of length nLat]
+      lon     Longitudes of the grid [1D numpy array of length nLon]
+      temp    Temperature [array of size T x nLat x nLon, e.g. a numpy memmap; only
+              chunkLength days are read at a time]
+      thresh  Threshold, either of size T x nLat x nLon (e.g. the clim output of
+              mhwGrid.detectGrid reshaped to the grid) or a day-of-year climatology
+              of size 366 x nLat x nLon (e.g. as loaded by mhwClim.loadBaseline),
+              see doyClimatology
+      seas    Seasonal climatology, of the same size as thresh
+    Options:
+      connectivity   Connectivity of the labelling, as for
+                     scipy.ndimage.generate_binary_structure in 3 dimensions: 1 for
+                     face neighbours only (in time or space), 2 to include edge
+                     neighbours, 3 for all 26 neighbours (DEFAULT = 1)
+      chunkLength    Number of days labelled at once (DEFAULT = 365)
+      minDuration    Minimum duration [days] of the retained events (DEFAULT = 1)
+      coldSpells     If True, track cold spells, i.e. regions below the threshold
+                     (DEFAULT = False)
+      doyClimatology True if thresh and seas hold one row per day-of-year, False
+                     if they hold one row per day of t (DEFAULT = None, from their
+                     number of rows; required if T is 366)
+    Outputs:
+      events  Detected events as a table, each key (following list) being a numpy
+              array of length N where N is the number of events, ordered by start:
+        'time_start'           Start time of the event [datetime format]
+        'time_end'             End time of the event [datetime format]
+        'duration'             Duration [days]
+        'area_max'             Maximum daily area [km^2]
+        'area_mean'            Mean daily area [km^2]
+        'volume'               Area integrated over the duration [km^2 x days]
+        'intensity_max'        Maximum intensity, relative to the seasonal
+                               climatology, over all cells and days [deg. C]
+        'intensity_mean'       Area-weighted mean intensity [deg. C]
+        'intensity_cumulative' Volume-integrated intensity [deg. C x km^2 x days]
+        'n_events'             Number of events (a scalar)
+      tracks  Daily centroid track of each event, as a table with one row per day
+              of each event:
+        'event'                Index of the event in events
+        'time'                 Day [datetime format]
+        'area'                 Area on that day [km^2]
+        'lat', 'lon'           Area-weighted centroid [degrees]
+        'intensity_mean'       Area-weighted mean intensity on that day [deg. C]
+    Notes:
+      1. Exceedance is taken day by day, without the minimum duration and gap
+         joining of marineHeatWaves.detect; missing values do not exceed.
+      2. Centroids are computed on the lat/lon grid as given, longitude wrap-around
+         is not handled.
+      3. Memory is that of one chunk of the cube plus one row per event and day.
+    '''
+
+    t = np.asarray(t)
+    T = len(t)
+    area = cellArea(lat, lon)
+    latGrid, lonGrid = np.meshgrid(np.asarray(lat, dtype=float), np.asarray(lon, dtype=float), indexing='ij')
+    structure = ndimage.generate_binary_structure(3, connectivity)
+    sign = -1. if coldSpells else 1.
+    doyClimatology = mhw._isDoyClimatology(T, thresh.shape[0], doyClimatology)
+
+    parent = np.zeros(0, dtype=np.int64) # Union-find forest over provisional labels
+    rows = [] # Daily statistics of each provisional label, per chunk
+    seams = [] # Pairs of provisional labels joined across seams
+    prevExceed = None
+    prevLabels = None
+    for i0 in range(0, T, chunkLength):
+        i1 = min(i0 + chunkLength, T)
+        if doyClimatology:
+            doy = mhw.calendar(t[i0:i1])[3]
+            threshChunk = np.asarray(thresh[doy-1])
+            seasChunk = np.asarray(seas[doy-1])
+        else:
+            threshChunk = np.asarray(thresh[i0:i1])
+            seasChunk = np.asarray(seas[i0:i1])
+        tempChunk = np.asarray(temp[i0:i1])
+        with np.errstate(invalid='ignore'):
+            exceed = sign*tempChunk > sign*threshChunk
+        intensity = sign*(tempChunk - seasChunk)
+        del tempChunk, threshChunk, seasChunk
+
+        # Label, with the last day of the previous chunk prepended
+        if prevExceed is None:
+            labels, n = ndimage.label(exceed, structure=structure)
+        else:
+            labels, n = ndimage.label(np.concatenate([prevExceed[np.newaxis], exceed]), structure=structure)
+            seam = labels[0] > 0
+            seams.append(np.stack([prevLabels[seam], labels[0][seam] - 1 + len(parent)], axis=1))
+            labels = labels[1:]
+        first = len(parent)
+        parent = np.append(parent, np.arange(first, first + n))
+
+        # Daily statistics of each label
+        tt, ii, jj = np.nonzero(labels)
+        label = labels[tt, ii, jj].astype(np.int64) - 1 + first
+        a = area[ii, jj]
+        x = intensity[tt, ii, jj]
+        key, inverse = np.unique(label*chunkLength + tt, return_inverse=True)
+        intensityMax = np.full(len(key), -np.inf)
+        np.maximum.at(intensityMax, inverse, x)
+        rows.append([key // chunkLength, t[i0 + key % chunkLength],
+                     np.bincount(inverse, weights=a), np.bincount(inverse, weights=a*latGrid[ii, jj]),
+                     np.bincount(inverse, weights=a*lonGrid[ii, jj]), np.bincount(inverse, weights=a*x), intensityMax])
+
+        prevExceed = exceed[-1]
+        prevLabels = np.where(labels[-1] > 0, labels[-1].astype(np.int64) - 1 + first, -1)
+        del labels, exceed, intensity
+
+    # Join labels across seams and find the root of each label
+    for pair in seams:
+        for p, q in np.unique(pair, axis=0):
+            p, q = _root(parent, p), _root(parent, q)
+            if p != q:
+                parent[max(p, q)] = min(p, q)
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            break
+        parent = grandparent
+
+    # Combine the daily statistics of the labels of each event
+    label, time, a, latA, lonA, xA, xMax = [np.concatenate(column) for column in zip(*rows)] if rows else [np.zeros(0)]*7
+    root = parent[label.astype(np.int64)]
+    key, inverse = np.unique(np.stack([root, time.astype(np.int64)], axis=1), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    dayArea = np.bincount(inverse, weights=a, minlength=len(key))
+    dayIntensity = np.bincount(inverse, weights=xA, minlength=len(key))
+    dayMax = np.full(len(key), -np.inf)
+    np.maximum.at(dayMax, inverse, xMax)
+
+    events, tracks = _eventTable(key[:, 0], key[:, 1], dayArea, dayIntensity, dayMax, minDuration)
+    keep = np.isin(key[:, 0], events.pop('root'))
+    tracks['event'] = tracks['event'][keep]
+    tracks['time'] = key[keep, 1]
+    tracks['area'] = dayArea[keep]
+    tracks['lat'] = np.bincount(inverse, weights=latA, minlength=len(key))[keep] / dayArea[keep]
+    tracks['lon'] = np.bincount(inverse, weights=lonA, minlength=len(key))[keep] / dayArea[keep]
+    tracks['intensity_mean'] = sign * dayIntensity[keep] / dayArea[keep]
+    order = np.lexsort((tracks['time'], tracks['event']))
+    for column in tracks.keys():
+        tracks[column] = tracks[column][order]
+    for column in ['intensity_max', 'intensity_mean', 'intensity_cumulative']:
+        events[column] = sign * events[column]
+
+    return events, tracks
+
+
+def _root(parent, p):
+    # Root of label p in the union-find forest
+    while parent[p] != p:
+        p = parent[p]
+    return p
+
+
+def _eventTable(root, time, dayArea, dayIntensity, dayMax, minDuration):
+    '''
+    Event properties from the daily statistics of each event (rows sorted by
+    root, then time). Returns the event table, with the 'root' label of each
+    event, and the event index of each row.
+    '''
+
+    roots, first, nDays = np.unique(root, return_index=True, return_counts=True)
+    events = {}
+    if len(roots) > 0:
+        events['time_start'] = time[first]
+        events['time_end'] = time[first + nDays - 1]
+        events['area_max'] = np.maximum.reduceat(dayArea, first)
+        events['volume'] = np.add.reduceat(dayArea, first)
+        events['intensity_max'] = np.maximum.reduceat(dayMax, first)
+        events['intensity_cumulative'] = np.add.reduceat(dayIntensity, first)
+    else:
+        for key in ['time_start', 'time_end', 'area_max', 'volume', 'intensity_max', 'intensity_cumulative']:
+            events[key] = np.zeros(0)
+    events['duration'] = events['time_end'] - events['time_start'] + 1
+    events['area_mean'] = events['volume'] / events['duration']
+    events['intensity_mean'] = events['intensity_cumulative'] / events['volume']
+    events['root'] = roots
+
+    # Retain events of duration >= minDuration, ordered by start
+    keep = np.flatnonzero(events['duration'] >= minDuration)
+    keep = keep[np.argsort(events['time_start'][keep], kind='stable')]
+    for key in events.keys():
+        events[key] = events[key][keep]
+    events['n_events'] = len(keep)
+
+    eventOfRoot = np.full(len(roots), -1)
+    eventOfRoot[keep] = np.arange(len(keep))
+    tracks = {'event': np.repeat(eventOfRoot, nDays)}
+
+    return events, tracks
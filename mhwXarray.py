@@ -0,0 +1,170 @@
+'''
+    Adapter between labelled xarray objects and the NumPy core of
+    marineHeatWaves, so that detection runs on plain contiguous arrays
+    and only the outputs are re-wrapped with coordinates
+'''
+
+
+import numpy as np
+import xarray as xr
+
+import marineHeatWaves as mhw
+import timeAxis
+
+
+def toNumpy(data, varname='sst', dim='time', dtype=None):
+    '''
+    Extracts the values and time vector of a time series held in an xarray
+    object, without copying the values where possible.
+    Inputs:
+      data     xarray DataArray, or Dataset containing varname, with a datetime64
+               time coordinate
+    Options:
+      varname  Variable to extract if data is a Dataset (DEFAULT = 'sst')
+      dim      Name of the time dimension (DEFAULT = 'time')
+      dtype    Floating point type of the output values, e.g. np.float32
+               (DEFAULT = None, keep the type of the data)
+    Outputs:
+      t        Time vector, in datetime format (e.g., date(1982,1,1).toordinal())
+               [1D numpy array of length T]
+      temp     Values as a C-contiguous numpy array, with time as the first axis.
+               This is a view of the data whenever no transpose or type
+               conversion is needed.
+    '''
+
+    if isinstance(data, xr.Dataset):
+        data = data[varname]
+    if data.dims[0] != dim:
+        data = data.transpose(dim, ...)
+    temp = np.ascontiguousarray(data.values, dtype=dtype)
+    t = timeAxis.toOrdinal(data[dim].values)
+
+    return t, temp
+
+
+def detect(data, varname='sst', dim='time', dtype=None, **kwargs):
+    '''
+    Applies marineHeatWaves.detect to a time series held in an xarray object.
+    Inputs:
+      data     xarray DataArray, or Dataset containing varname, with a datetime64
+               time coordinate
+    Options:
+      varname  Variable to use if data is a Dataset (DEFAULT = 'sst')
+      dim      Name of the time dimension (DEFAULT = 'time')
+      dtype    Floating point type used for the values (DEFAULT = None, keep the
+               type of the data)
+      All other keyword arguments are passed to marineHeatWaves.detect
+    Outputs:
+      mhw      Detected MHWs as an xarray Dataset along an 'event' dimension (see
+               mhwXarray.wrapEvents). If pctile is a list, the events of all the
+               percentiles, in the order given, with a 'pctile' coordinate along
+               'event'.
+      clim     Climatology as an xarray Dataset along the time dimension of data
+               (see mhwXarray.wrapClim). If the time coordinate has gaps, the series
+               is first placed on a complete daily axis (missing days as NaN) and
+               clim is returned on that axis. If pctile is a list, 'thresh' has a
+               leading 'pctile' dimension.
+    '''
+
+    if isinstance(data, xr.Dataset):
+        data = data[varname]
+    t, temp = toNumpy(data, dim=dim, dtype=dtype)
+    # Fill any gaps in the time coordinate, detect assumes continuous daily values
+    t, temp = timeAxis.reindexDaily(t, temp)
+    if dtype is not None:
+        kwargs['dtype'] = dtype
+    mhws, clim = mhw.detect(t, temp, **kwargs)
+    time = timeAxis.toDatetime64(t)
+
+    pctile = kwargs.get('pctile', 90)
+    if np.ndim(pctile) == 0:
+        return wrapEvents(mhws), wrapClim(clim, time)
+    events = [wrapEvents(mhwsP).assign_coords(pctile=('event', np.full(mhwsP['n_events'], p)))
+              for p, mhwsP in zip(pctile, mhws)]
+    ds = wrapClim(dict((key, clim[key]) for key in clim.keys() if key != 'thresh'), time)
+    ds['thresh'] = (('pctile',) + ds['seas'].dims, clim['thresh'])
+
+    return xr.concat(events, dim='event'), ds[list(clim.keys())].assign_coords(pctile=np.asarray(pctile))
+
+
+def wrapEvents(mhws):
+    '''
+    Converts the MHW dictionary output by marineHeatWaves.detect into an xarray
+    Dataset along an 'event' dimension. Event times become datetime64
+    coordinates ('time_start', 'time_peak' and 'time_end'), the redundant
+    'date_*' keys are dropped, and all other properties become data variables.
+    '''
+
+    coords = {}
+    for key in ['time_start', 'time_peak', 'time_end']:
+        coords[key] = ('event', timeAxis.toDatetime64(mhws[key]))
+    variables = {}
+    for key in mhws.keys():
+        if (key == 'n_events') + (key in coords) + key.startswith('date_'):
+            continue
+        variables[key] = ('event', np.asarray(mhws[key]))
+
+    return xr.Dataset(variables, coords=coords)
+
+
+def wrapClim(clim, time):
+    '''
+    Converts the climatology dictionary output by marineHeatWaves.detect into an
+    xarray Dataset on the given time coordinate.
+    '''
+
+    time = xr.DataArray(time)
+    dim = time.dims[0] if time.dims[0] != 'dim_0' else 'time'
+    variables = {}
+    for key in clim.keys():
+        variables[key] = (dim, clim[key])
+
+    return xr.Dataset(variables, coords={dim: time.values})
+
+
+def wrapTrends(mhwBlock, mean, trend, dtrend, cells, lat, lon):
+    '''
+    Converts the outputs of mhwGrid.blockAverageGrid and mhwGrid.meanTrendGrid
+    into one xarray Dataset on the lat/lon grid. Each block metric becomes a
+    (block, lat, lon) variable with the 'years_*' keys as coordinates along
+    'block', and its mean, trend and dtrend become the (lat, lon) variables
+    '<key>_mean', '<key>_trend' and '<key>_dtrend'. Cells that were not
+    processed (cells is the 'cells' key of the mhwGrid.detectGrid clim output)
+    are NaN. writeTrends writes the result to a NetCDF file.
+    '''
+
+    nLat, nLon = len(lat), len(lon)
+    nBlocks = len(mhwBlock['years_centre'])
+
+    def toGrid(values):
+        grid = np.full((values.shape[0], nLat*nLon), np.nan)
+        grid[:, cells] = values
+        return grid.reshape((values.shape[0], nLat, nLon))
+
+    variables = {}
+    for key in mhwBlock.keys():
+        if key.startswith('years_'):
+            continue
+        variables[key] = (('block', 'lat', 'lon'), toGrid(mhwBlock[key].reshape(nBlocks, -1)))
+        variables[key + '_mean'] = (('lat', 'lon'), toGrid(mean[key].reshape(1, -1))[0])
+        variables[key + '_trend'] = (('lat', 'lon'), toGrid(trend[key].reshape(1, -1))[0])
+        variables[key + '_dtrend'] = (('lat', 'lon'), toGrid(dtrend[key].reshape(1, -1))[0])
+    coords = {'lat': np.asarray(lat), 'lon': np.asarray(lon)}
+    for key in ['years_start', 'years_end', 'years_centre']:
+        coords[key] = ('block', mhwBlock[key])
+
+    return xr.Dataset(variables, coords=coords)
+
+
+def writeTrends(fname, mhwBlock, mean, trend, dtrend, cells, lat, lon, attrs=None):
+    '''
+    Writes the block metrics and mean/trend maps of wrapTrends to a single NetCDF
+    file, with optional global attributes (e.g. the detection settings), and
+    returns the Dataset written.
+    '''
+
+    ds = wrapTrends(mhwBlock, mean, trend, dtrend, cells, lat, lon)
+    ds.attrs.update(attrs or {})
+    ds.to_netcdf(fname)
+
+    return ds
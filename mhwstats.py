@@ -8,16 +8,17 @@
 # Load required modules
 
 import numpy as np
-from scipy import io
 from datetime import date
 
-from matplotlib import pyplot as plt
-
 import marineHeatWaves as mhw
+import mhwQuery
 
 
 def mhw_stats(t, sst, coldSpells = False):
 
+    # Plotting is only loaded when the statistics are plotted
+    from matplotlib import pyplot as plt
+
     # Some basic parameters
     # If coldSpells = True, detect coldspells instead of heatwaves
 
@@ -46,6 +47,7 @@ def mhw_stats(t, sst, coldSpells = False):
     mhws, clim = mhw.detect(t, sst, coldSpells=coldSpells)
     mhwBlock = mhw.blockAverage(t, mhws, temp=sst)
     mean, trend, dtrend = mhw.meanTrend(mhwBlock)
+    index = mhwQuery.eventIndex(mhws)
 
     # Plot various summary things
 
@@ -119,10 +121,10 @@ def mhw_stats(t, sst, coldSpells = False):
 
     # Maximum intensity
     outfile = open('mhw_stats/' + mhwname + '_topTen_iMax.txt', 'w')
-    evs = np.argsort(np.abs(mhws['intensity_max']))[-10:]
+    evs = mhwQuery.topN(index, 'intensity_max', 10, absolute=True)
     plt.figure(figsize=(23,16))
     for i in range(10):
-        ev = evs[-(i+1)]
+        ev = evs[i]
         plt.subplot(5,2,i+1)
         # Find indices for all ten MHWs before and after event of interest and shade accordingly
         for ev0 in np.arange(max(ev-10,0), min(ev+11,mhws['n_events']-1), 1):
@@ -160,10 +162,10 @@ def mhw_stats(t, sst, coldSpells = False):
 
     # Mean intensity
     outfile = open('mhw_stats/' + mhwname + '_topTen_iMean.txt', 'w')
-    evs = np.argsort(np.abs(mhws['intensity_mean']))[-10:]
+    evs = mhwQuery.topN(index, 'intensity_mean', 10, absolute=True)
     plt.clf()
     for i in range(10):
-        ev = evs[-(i+1)]
+        ev = evs[i]
         plt.subplot(5,2,i+1)
         # Find indices for all ten MHWs before and after event of interest and shade accordingly
         for ev0 in np.arange(max(ev-10,0), min(ev+11,mhws['n_events']-1), 1):
@@ -201,10 +203,10 @@ def mhw_stats(t, sst, coldSpells = False):
 
     # Cumulative intensity
     outfile = open('mhw_stats/' + mhwname + '_topTen_iCum.txt', 'w')
-    evs = np.argsort(np.abs(mhws['intensity_cumulative']))[-10:]
+    evs = mhwQuery.topN(index, 'intensity_cumulative', 10, absolute=True)
     plt.clf()
     for i in range(10):
-        ev = evs[-(i+1)]
+        ev = evs[i]
         plt.subplot(5,2,i+1)
         # Find indices for all ten MHWs before and after event of interest and shade accordingly
         for ev0 in np.arange(max(ev-10,0), min(ev+11,mhws['n_events']-1), 1):
@@ -242,10 +244,10 @@ def mhw_stats(t, sst, coldSpells = False):
 
     # Duration
     outfile = open('mhw_stats/' + mhwname + '_topTen_Dur.txt', 'w')
-    evs = np.argsort(mhws['duration'])[-10:]
+    evs = mhwQuery.topN(index, 'duration', 10)
     plt.clf()
     for i in range(10):
-        ev = evs[-(i+1)]
+        ev = evs[i]
         plt.subplot(5,2,i+1)
         # Find indices for all ten MHWs before and after event of interest and shade accordingly
         for ev0 in np.arange(max(ev-10,0), min(ev+11,mhws['n_events']-1), 1):
@@ -23,15 +23,25 @@ __email__ = "m.e.b.sabot@gmail.com"
 #==============================================================================
 
 # general modules
-import os, sys # check for files and so on
+import os # check for files and so on
 import xarray as xr # to read netcdf
-import numpy as np # data manipulation
-from datetime import date
 import matplotlib.pyplot as plt # plotting
 import cartopy.crs as ccrs # projection
 import cartopy.feature as cfeature # equivalent to basemap
+from shapely.geometry import box # clipping of the background geometries
 
-from mhwstats import mhw_stats
+from mhwXarray import toNumpy
+from timeAxis import reindexDaily
+from reef_region import reef_points, REEF_OUTLINE_LATS, REEF_OUTLINE_LONS
+
+
+#==============================================================================
+
+# time indices of the seasons files
+SEASONS = ['DJF', 'MAM', 'JJA', 'SON']
+
+# projected background layers, keyed on the extent, projection and resolution
+_BASEMAP_CACHE = {}
 
 
 #==============================================================================
@@ -41,10 +51,13 @@ def main(fname, idate):
 	data = read_data(fname)
 
 	if 'ALL' in fname:
-		time, __, __ = return_time(data['time'])
+		from mhwstats import mhw_stats # only needed for the mhw run
+
 		reef_cell = reef_points(data)
-		#mhw_stats(time, reef_cell['sst'])
-		mhw_stats(time, reef_cell['sst'], coldSpells = True)
+		# fill any missing days, detection assumes a continuous daily series
+		time, sst = reindexDaily(*toNumpy(reef_cell['sst']))
+		#mhw_stats(time, sst)
+		mhw_stats(time, sst, coldSpells = True)
 
 	else:
 		if '_10_' in fname:
@@ -89,104 +102,147 @@ def read_data(fname):
 	return ds
 
 
-def return_time(xtime):
-
-	start_date = str(xtime[0])
-	end_date = str(xtime[len(xtime)-1])
-	start_date = (start_date.split('datetime64[ns] ')[1]
-				  .split('Attributes:')[0])
-	end_date = end_date.split('datetime64[ns] ')[1].split('Attributes:')[0]
-	start_date = date(int(start_date[:4]), int(start_date[5:7]),
-					  int(start_date[8:10]))
-	end_date = date(int(end_date[:4]), int(end_date[5:7]), int(end_date[8:10]))
-	time = np.arange(start_date.toordinal(), end_date.toordinal()+1)
+def draw_reef(proj):
 
-	return time, start_date, end_date
+	"""
+	Adds the reef's boundaries to the map
 
+	"""
 
-def reef_points(data):
+	lats = REEF_OUTLINE_LATS
+	lons = REEF_OUTLINE_LONS
 
-	lats = [-10.875, -11.375, -12.125, -13.125, -13.625, -14.375, -15.625, \
-			-16.375, -17.375, -18.125, -19.125, -20.125, -21.125, -22.125, \
-			-23.625, -24.625]
-	lons = [143.125, 143.373, 143.875, 144.375, 144.625, 145.375, 145.625, \
-			146.125, 146.375, 146.875, 148.125, 149.625, 150.375, 152.125, \
-			152.375, 153.375]
+	for i in range(len(lats) - 1):
 
-	all_points = data.sel(lon=lons, lat=lats, method='nearest')
-	all_points = all_points.mean('lon').mean('lat')
+		plt.plot([lons[i], lons[i+1]], [lats[i], lats[i+1]], linewidth = 1.5,
+				  color = 'k', transform = proj)
 
-	return all_points
+	return
 
 
-def dms2dd(degrees, minutes, seconds, direction):
+def basemap_layers(extent, proj, res = '10m', margin = 1.):
 
 	"""
-	Converts input geo coordinate into convention format
- 
+	Loads the static background of the maps (coastlines, land and borders),
+	clips it to the map extent and projects it, once per extent, projection
+	and resolution. The layers are cached, so every later panel with the
+	same extent reuses the same geometries, and cartopy's own path cache
+	for them, instead of reading and projecting the Natural Earth
+	shapefiles again
+
 	Arguments:
 	----------
-	degrees: int or float
+	extent: list
+		[lon min, lon max, lat min, lat max] of the map, in degrees
 
-	minutes: int or float
+	proj: cartopy crs
+		projection of the map axes
 
-	seconds: int or float
+	res: string
+		resolution of the Natural Earth coastlines, '10m', '50m' or '110m'
 
-	direction: string
-		'N', 'W', 'S', 'E'
+	margin: float
+		margin [degrees] added around the extent before clipping, so that
+		the clipped edges fall outside the map
 
 	Returns:
 	--------
-	dd: float
-		conventional expression of the coordinate
+	layers: list
+		(geometries, style) of each layer, in drawing order, with the
+		geometries in the map projection
 
 	"""
 
-	dd = float(degrees) + float(minutes) / 60. + float(seconds) / (60. * 60.)
+	extent = [float(e) for e in extent]
+	key = (tuple(extent), proj.proj4_init, res, margin)
 
-	if direction == 'E' or direction == 'N':
-		dd *= -1
+	if key not in _BASEMAP_CACHE:
+		lon0, lon1 = min(extent[:2]), max(extent[:2])
+		lat0, lat1 = min(extent[2:]), max(extent[2:])
+		clip_extent = (lon0 - margin, lon1 + margin, lat0 - margin,
+					   lat1 + margin)
+		clip = box(clip_extent[0], clip_extent[2], clip_extent[1],
+				   clip_extent[3])
+		geodetic = ccrs.PlateCarree()
+		features = [(cfeature.COASTLINE.with_scale(res), {}),
+					(cfeature.LAND, {'facecolor': 'white'}),
+					(cfeature.BORDERS, {'alpha': 0.05})]
+		layers = []
 
-	return dd
+		for feature, style in features:
+			geoms = []
 
+			for geom in feature.intersecting_geometries(clip_extent):
+				geom = geom.intersection(clip)
 
-def draw_reef(proj):
+				if not geom.is_empty:
+					geoms.append(proj.project_geometry(geom, geodetic))
 
-	"""
-	Adds the reef's boundaries to the map
+			style = dict(feature.kwargs, **style)
+			layers.append((geoms, style))
 
-	"""
+		_BASEMAP_CACHE[key] = layers
 
-	lats = [dms2dd(10, 40, 55, 'N'), dms2dd(10, 40, 55, 'N'), \
-			dms2dd(12, 59, 55, 'N'), dms2dd(17, 29, 55, 'N'), \
-			dms2dd(20, 59, 54, 'N'), dms2dd(24, 29, 54, 'N'), \
-			dms2dd(24, 29, 54, 'N')]
+	return _BASEMAP_CACHE[key]
 
-	lons = [dms2dd(142.5, 0, 4, 'W'), dms2dd(145, 0, 4, 'W'), \
-			dms2dd(145, 0, 4, 'W'), dms2dd(147, 0, 4, 'W'), \
-			dms2dd(152, 55, 4, 'W'), dms2dd(154, 0, 4, 'W'), \
-			dms2dd(152, 3, 4, 'W')]
-	
-	for i in range(len(lats) - 1):
 
-		plt.plot([lons[i], lons[i+1]], [lats[i], lats[i+1]], linewidth = 1.5,
-				  color = 'k', transform = proj)
+def draw_background_map(ax, lon, lat, proj, res = '10m'):
 
-	return
+	"""
+	Sets the map extent and draws the cached background layers (see
+	basemap_layers)
 
+	"""
 
-def draw_background_map(ax, lon, lat, proj, res = '10m'):
+	extent = [lon[0], lon[len(lon)-1], lat[0], lat[len(lat)-1]]
+	ax.set_extent(extent, proj)
 
-	ax.set_extent([lon[0], lon[len(lon)-1], lat[0], lat[len(lat)-1]], proj)
-	ax.coastlines(resolution = res)
-	ax.add_feature(cfeature.LAND, facecolor = 'white')
-	ax.add_feature(cfeature.BORDERS, alpha=0.05)
+	for geoms, style in basemap_layers(extent, proj, res):
+		ax.add_geometries(geoms, proj, **style)
 
 	return
 
 
 def plot_SST_anom(data, p_thresh, idate, seasons = 'no', layout = 'line',
-													 proj = ccrs.PlateCarree()):
+				  proj = ccrs.PlateCarree(), namefig = None, dpi = 1200):
+
+	"""
+	Maps the SST and SST anomaly of one time index of a SST_extremes file
+	side by side, and saves the figure
+
+	Arguments:
+	----------
+	data: xarray dataset
+		contains the sst and anom data, as returned by read_data
+
+	p_thresh: int
+		percentile of the file (0 for the mean)
+
+	idate: int
+		time index to map
+
+	seasons: string
+		'yes' if the time indices are the four seasons
+
+	layout: string
+		'line' or 'column' arrangement of the two maps
+
+	proj: cartopy crs
+		projection of the maps
+
+	namefig: string
+		output filename (with path), defaults to the figure name in
+		SST_extremes/ of the current directory
+
+	dpi: int
+		resolution of the saved figure
+
+	Returns:
+	--------
+	namefig: string
+		output filename (with path)
+
+	"""
 
 	fig = plt.figure()
 	fig.patch.set_facecolor('white')
@@ -224,18 +280,7 @@ def plot_SST_anom(data, p_thresh, idate, seasons = 'no', layout = 'line',
 	end_date = '2018-06-20'
 
 	if seasons == 'yes':
-		if idate == 0:
-			specify = 'multi-year DJF '
-
-		if idate == 1:
-			specify = 'multi-year MAM '
-
-		if idate == 2:
-			specify = 'multi-year JJA '
-
-		if idate == 3:
-			specify = 'multi-year SON '
-		
+		specify = 'multi-year %s ' % (SEASONS[idate])
 
 	if seasons == 'no':
 		specify = ''
@@ -247,6 +292,27 @@ def plot_SST_anom(data, p_thresh, idate, seasons = 'no', layout = 'line',
 		fig.suptitle('%dth %spercentile for %s to %s' % (p_thresh, specify,
 					 start_date, end_date))
 
+	if namefig is None:
+		namefig = os.path.join(os.getcwd(), 'SST_extremes/%s' %
+							   (figure_name(p_thresh, specify)))
+
+	fig.subplots_adjust(left = 0.075, bottom = 0., top = 1., hspace = 0.1,
+						wspace = 0.24)
+	plt.tight_layout()
+	plt.savefig(namefig, dpi = dpi, transparent = True)
+	plt.close(fig)
+
+	return namefig
+
+
+def figure_name(p_thresh, specify = ''):
+
+	"""
+	Name of the figure of a percentile (0 for the mean), e.g.
+	'multi-year_DJF_90th_percentile.png' for specify 'multi-year DJF '
+
+	"""
+
 	namefig = specify.replace(' ', '_')
 
 	if p_thresh == 0:
@@ -255,11 +321,7 @@ def plot_SST_anom(data, p_thresh, idate, seasons = 'no', layout = 'line',
 	else:
 		namefig += '%dth_percentile.png' % (p_thresh)
 
-	namefig = os.path.join(os.getcwd(), 'SST_extremes/%s' % (namefig))
-	fig.subplots_adjust(left = 0.075, bottom = 0., top = 1., hspace = 0.1,
-						wspace = 0.24)
-	plt.tight_layout()
-	plt.savefig(namefig, dpi = 1200, transparent = True)
+	return namefig
 
 
 if __name__ == "__main__":
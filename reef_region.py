@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Sampling of gridded SST data over the great barrier reef: nearest grid cell
+look-up for the reef sample points and rasterised masks of the reef region
+(or any polygon), both computed once per grid
+
+"""
+
+__title__ = "Great barrier reef sampling"
+
+
+#==============================================================================
+
+# general modules
+import numpy as np # data manipulation
+import xarray as xr # to index netcdf data
+
+
+#==============================================================================
+
+# reef sample points
+REEF_LATS = [-10.875, -11.375, -12.125, -13.125, -13.625, -14.375, -15.625, \
+			 -16.375, -17.375, -18.125, -19.125, -20.125, -21.125, -22.125, \
+			 -23.625, -24.625]
+REEF_LONS = [143.125, 143.373, 143.875, 144.375, 144.625, 145.375, 145.625, \
+			 146.125, 146.375, 146.875, 148.125, 149.625, 150.375, 152.125, \
+			 152.375, 153.375]
+
+# nearest cell indices, keyed on the grid and the points
+_INDEX_CACHE = {}
+
+# polygon masks, keyed on the grid and the polygon
+_MASK_CACHE = {}
+
+
+#==============================================================================
+
+def dms2dd(degrees, minutes, seconds, direction):
+
+	"""
+	Converts input geo coordinate into convention format
+ 
+	Arguments:
+	----------
+	degrees: int or float
+
+	minutes: int or float
+
+	seconds: int or float
+
+	direction: string
+		'N', 'W', 'S', 'E'
+
+	Returns:
+	--------
+	dd: float
+		conventional expression of the coordinate
+
+	"""
+
+	dd = float(degrees) + float(minutes) / 60. + float(seconds) / (60. * 60.)
+
+	if direction == 'E' or direction == 'N':
+		dd *= -1
+
+	return dd
+
+
+# reef boundary, from the northern to the southern coastline
+REEF_OUTLINE_LATS = [dms2dd(10, 40, 55, 'N'), dms2dd(10, 40, 55, 'N'), \
+					 dms2dd(12, 59, 55, 'N'), dms2dd(17, 29, 55, 'N'), \
+					 dms2dd(20, 59, 54, 'N'), dms2dd(24, 29, 54, 'N'), \
+					 dms2dd(24, 29, 54, 'N')]
+REEF_OUTLINE_LONS = [dms2dd(142.5, 0, 4, 'W'), dms2dd(145, 0, 4, 'W'), \
+					 dms2dd(145, 0, 4, 'W'), dms2dd(147, 0, 4, 'W'), \
+					 dms2dd(152, 55, 4, 'W'), dms2dd(154, 0, 4, 'W'), \
+					 dms2dd(152, 3, 4, 'W')]
+
+# Queensland coastline, from Burnett Heads north to Cape York (approximate)
+REEF_COAST_LATS = [-24.75, -24.17, -23.85, -23.50, -23.13, -22.40, -22.10, \
+				   -21.45, -21.14, -20.90, -20.27, -20.00, -19.70, -19.55, \
+				   -19.26, -18.90, -18.53, -18.26, -17.52, -16.92, -16.48, \
+				   -16.08, -15.47, -15.23, -14.97, -14.17, -14.40, -14.20, \
+				   -13.40, -12.80, -11.97, -11.30, -10.69]
+REEF_COAST_LONS = [152.40, 151.90, 151.27, 150.90, 150.75, 150.40, 149.55, \
+				   149.30, 149.19, 149.05, 148.72, 148.25, 147.75, 147.45, \
+				   146.82, 146.30, 146.33, 146.03, 146.08, 145.77, 145.46, \
+				   145.47, 145.25, 145.33, 145.35, 144.50, 143.90, 143.55, \
+				   143.60, 143.35, 143.25, 142.83, 142.53]
+
+# reef region: the outline offshore, with its southern edge moved to
+# 24°45'S to take in the southernmost sample point, closed along the coast
+REEF_REGION_LATS = REEF_OUTLINE_LATS[:5] + [dms2dd(24, 45, 0, 'N')] + \
+				   REEF_COAST_LATS
+REEF_REGION_LONS = REEF_OUTLINE_LONS[:6] + REEF_COAST_LONS
+
+
+#==============================================================================
+
+def nearest_indices(lat, lon, lats = REEF_LATS, lons = REEF_LONS):
+
+	"""
+	Finds the grid cell nearest to each point, for a regular lat/lon grid.
+	The indices are cached, so they are only looked up once per grid
+
+	Arguments:
+	----------
+	lat: array
+		grid latitudes (monotonic)
+
+	lon: array
+		grid longitudes (monotonic)
+
+	lats: list
+		latitudes of the points
+
+	lons: list
+		longitudes of the points, paired with lats
+
+	Returns:
+	--------
+	ilat: array
+		integer latitude index of each point
+
+	ilon: array
+		integer longitude index of each point
+
+	"""
+
+	lat = np.asarray(lat, dtype = float)
+	lon = np.asarray(lon, dtype = float)
+	key = (lat.tobytes(), lon.tobytes(), tuple(lats), tuple(lons))
+
+	if key not in _INDEX_CACHE:
+		_INDEX_CACHE[key] = (_nearest(lat, lats), _nearest(lon, lons))
+
+	return _INDEX_CACHE[key]
+
+
+def _nearest(axis, points):
+
+	"""
+	Index of the nearest element of a monotonic axis to each point
+
+	"""
+
+	points = np.asarray(points, dtype = float)
+	increasing = axis[-1] >= axis[0]
+	ax = axis if increasing else axis[::-1]
+	i = np.clip(np.searchsorted(ax, points), 1, len(ax) - 1)
+	i -= (points - ax[i - 1]) <= (ax[i] - points) # left neighbour is closer
+
+	return i if increasing else len(ax) - 1 - i
+
+
+def point_weights(lats, weights = None):
+
+	"""
+	Normalised weights of the sample points
+
+	Arguments:
+	----------
+	lats: list
+		latitudes of the points
+
+	weights: None, string or array
+		None for equal weights, 'area' to weight by the grid cell area
+		(cosine of latitude), or one weight per point
+
+	Returns:
+	--------
+	w: array
+		weights summing to one
+
+	"""
+
+	if weights is None:
+		w = np.ones(len(lats))
+
+	elif isinstance(weights, str) and weights == 'area':
+		w = np.cos(np.deg2rad(lats))
+
+	else:
+		w = np.asarray(weights, dtype = float)
+
+	return w / w.sum()
+
+
+def reef_points(data, lats = REEF_LATS, lons = REEF_LONS, weights = None):
+
+	"""
+	Averages the data over the reef sample points, reading only the grid
+	cells nearest to each point (pointwise, not the lat x lon outer product).
+	Missing values (e.g. land cells) are left out of the average
+
+	Arguments:
+	----------
+	data: xarray dataset or dataarray
+		gridded data with lat and lon dimensions
+
+	lats: list
+		latitudes of the points
+
+	lons: list
+		longitudes of the points
+
+	weights: None, string or array
+		see point_weights
+
+	Returns:
+	--------
+	all_points: xarray dataset or dataarray
+		weighted average of the data over the points
+
+	"""
+
+	ilat, ilon = nearest_indices(data['lat'].values, data['lon'].values, lats,
+								 lons)
+	all_points = data.isel(lat = xr.DataArray(ilat, dims = 'point'),
+						   lon = xr.DataArray(ilon, dims = 'point'))
+	w = xr.DataArray(point_weights(data['lat'].values[ilat], weights),
+					 dims = 'point')
+
+	return weighted_mean(all_points, w, 'point')
+
+
+def weighted_mean(data, w, dim):
+
+	"""
+	Weighted mean along a dimension, of the variables of a dataset that have
+	that dimension; the others (e.g. datetime time_bnds, which cannot be
+	weighted) are passed through unchanged
+
+	Arguments:
+	----------
+	data: xarray dataset or dataarray
+		data with the dimension dim
+
+	w: xarray dataarray
+		weights along dim
+
+	dim: string
+		dimension to average over
+
+	Returns:
+	--------
+	mean: xarray dataset or dataarray
+		weighted mean along dim
+
+	"""
+
+	if isinstance(data, xr.DataArray):
+		return data.weighted(w).mean(dim)
+
+	averaged = [name for name in data.data_vars if dim in data[name].dims]
+	mean = data[averaged].weighted(w).mean(dim)
+
+	for name in data.data_vars:
+		if name not in averaged:
+			mean[name] = data[name]
+
+	return mean[list(data.data_vars)]
+
+
+def polygon_mask(lat, lon, poly_lats = REEF_REGION_LATS,
+				 poly_lons = REEF_REGION_LONS):
+
+	"""
+	Rasterises a polygon onto a lat/lon grid, testing all the grid cell
+	centres at once against each polygon edge (even-odd rule). The mask is
+	cached, so it is only built once per grid and polygon
+
+	Arguments:
+	----------
+	lat: array
+		grid latitudes
+
+	lon: array
+		grid longitudes
+
+	poly_lats: list
+		latitudes of the polygon vertices, the polygon is closed by joining
+		the last vertex to the first (defaults to the reef region, the outline
+		closed along the coast)
+
+	poly_lons: list
+		longitudes of the polygon vertices
+
+	Returns:
+	--------
+	mask: array
+		boolean (lat, lon) mask, True inside the polygon
+
+	"""
+
+	lat = np.asarray(lat, dtype = float)
+	lon = np.asarray(lon, dtype = float)
+	key = (lat.tobytes(), lon.tobytes(), tuple(poly_lats), tuple(poly_lons))
+
+	if key not in _MASK_CACHE:
+		y, x = np.meshgrid(lat, lon, indexing = 'ij')
+		y1 = np.asarray(poly_lats, dtype = float)
+		x1 = np.asarray(poly_lons, dtype = float)
+		y2 = np.roll(y1, -1)
+		x2 = np.roll(x1, -1)
+		mask = np.zeros(y.shape, dtype = bool)
+
+		for i in range(len(y1)):
+
+			if y1[i] == y2[i]: # horizontal edges are never crossed
+				continue
+
+			crosses = (y1[i] > y) != (y2[i] > y)
+			x_edge = x1[i] + (y - y1[i]) * (x2[i] - x1[i]) / (y2[i] - y1[i])
+			mask ^= crosses & (x < x_edge)
+
+		mask.flags.writeable = False
+		_MASK_CACHE[key] = mask
+
+	return _MASK_CACHE[key]
+
+
+def region_cells(data, mask = None):
+
+	"""
+	Extracts the grid cells inside a region as a single 'cell' dimension,
+	so that downstream processing (e.g. gridded detection) only sees the
+	cells of interest
+
+	Arguments:
+	----------
+	data: xarray dataset or dataarray
+		gridded data with lat and lon dimensions
+
+	mask: array
+		boolean (lat, lon) mask, defaults to the reef region
+
+	Returns:
+	--------
+	cells: xarray dataset or dataarray
+		data of the cells inside the region, with lat and lon as 'cell'
+		coordinates
+
+	"""
+
+	if mask is None:
+		mask = polygon_mask(data['lat'].values, data['lon'].values)
+
+	ilat, ilon = np.nonzero(mask)
+
+	return data.isel(lat = xr.DataArray(ilat, dims = 'cell'),
+					 lon = xr.DataArray(ilon, dims = 'cell'))
+
+
+def region_mean(data, mask = None, weights = 'area'):
+
+	"""
+	Averages the data over the grid cells inside a region
+
+	Arguments:
+	----------
+	data: xarray dataset or dataarray
+		gridded data with lat and lon dimensions
+
+	mask: array
+		boolean (lat, lon) mask, defaults to the reef region
+
+	weights: None or string
+		None for equal weights or 'area' to weight by the grid cell area
+
+	Returns:
+	--------
+	mean: xarray dataset or dataarray
+		area-averaged series
+
+	"""
+
+	cells = region_cells(data, mask)
+	w = xr.DataArray(point_weights(cells['lat'].values, weights),
+					 dims = 'cell')
+
+	return weighted_mean(cells, w, 'cell')
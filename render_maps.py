@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Batch rendering of the SST extremes maps: every time index (season, year)
+of every percentile file in SST_extremes/ is mapped with
+plot_SST_xtremes.plot_SST_anom, in parallel across processes which share
+the projected background of the maps, skipping the maps that are already
+up to date
+
+Usage: python render_maps.py [data_dir] [--processes N] [--force]
+
+"""
+
+__title__ = "Batch rendering of the SST extremes maps"
+
+
+#==============================================================================
+
+# general modules
+import os # check for files and so on
+import glob # find the netcdf files
+import argparse # command line options
+import multiprocessing as mp # parallel rendering
+import numpy as np # data manipulation
+import matplotlib # plotting
+matplotlib.use('Agg') # no display needed, set before pyplot is imported
+
+import plot_SST_xtremes as psx
+
+
+#==============================================================================
+
+# datasets opened by this process, keyed on the filename
+_DATA_CACHE = {}
+
+
+#==============================================================================
+
+def main(data_dir, processes = None, force = False):
+
+	panels = discover(data_dir)
+	todo = [panel for panel in panels if force or stale(panel)]
+	print('%d maps, %d to render' % (len(panels), len(todo)))
+
+	for namefig in render_panels(todo, processes):
+		print(namefig)
+
+	return
+
+
+def render_panels(panels, processes = None):
+
+	"""
+	Renders maps in parallel, with the background projected once by this
+	process and handed over to every worker
+
+	Arguments:
+	----------
+	panels: list
+		maps to render, as listed by discover
+
+	processes: int
+		number of processes, defaults to all cpus, 1 renders in this process
+
+	Returns:
+	--------
+	rendered: list
+		output filenames
+
+	"""
+
+	if len(panels) == 0:
+		return []
+
+	for extent in set(panel['extent'] for panel in panels):
+		psx.basemap_layers(list(extent), psx.ccrs.PlateCarree())
+
+	# panels of the same file are kept together, so that each worker opens
+	# as few files as possible
+	panels = sorted(panels, key = lambda panel: (panel['fname'],
+												 panel['idate']))
+
+	if processes == 1:
+		return [render(panel) for panel in panels]
+
+	processes = processes or os.cpu_count()
+	chunk = max(1, len(panels) // (4 * processes))
+
+	with mp.Pool(processes, initializer = init_worker,
+				 initargs = (psx._BASEMAP_CACHE, )) as pool:
+		rendered = list(pool.imap_unordered(render, panels, chunk))
+
+	return rendered
+
+
+#==============================================================================
+
+def file_percentile(fname):
+
+	"""
+	Percentile of a SST_extremes file, from its name
+
+	Arguments:
+	----------
+	fname: string
+		input filename
+
+	Returns:
+	--------
+	p_thresh: int or None
+		10 or 90, 0 for the mean, None for files that are not maps (e.g.
+		SST_ANOM_ALL.nc)
+
+	"""
+
+	name = os.path.basename(fname)
+
+	if 'ALL' in name:
+		return None
+
+	for tag, p_thresh in [('_10_', 10), ('_90_', 90), ('_mean_', 0)]:
+		if tag in name:
+			return p_thresh
+
+	return None
+
+
+def discover(data_dir):
+
+	"""
+	Lists every map to render: one per time index of each percentile file
+
+	Arguments:
+	----------
+	data_dir: string
+		directory of the netcdf files, e.g. SST_extremes/
+
+	Returns:
+	--------
+	panels: list
+		one dictionary per map, as listed by file_panels
+
+	"""
+
+	panels = []
+
+	for fname in sorted(glob.glob(os.path.join(data_dir, '*.nc'))):
+		panels += file_panels(fname)
+
+	return panels
+
+
+def file_panels(fname, out_dir = None):
+
+	"""
+	Lists the maps of one file: one per time index
+
+	Arguments:
+	----------
+	fname: string
+		input filename (with path)
+
+	out_dir: string
+		directory of the maps, defaults to the directory of the file
+
+	Returns:
+	--------
+	panels: list
+		one dictionary per map, with the input file ('fname'), its
+		percentile ('p_thresh'), 'seasons', the time index ('idate'), the
+		map extent ('extent') and the output file ('namefig'); empty if
+		the file is not a percentile file
+
+	"""
+
+	p_thresh = file_percentile(fname)
+
+	if p_thresh is None:
+		return []
+
+	if out_dir is None:
+		out_dir = os.path.dirname(fname)
+
+	data = psx.read_data(fname) # metadata only, the values are lazy
+	lon = data['lon'].values
+	lat = data['lat'].values
+	extent = (float(lon[0]), float(lon[-1]), float(lat[0]), float(lat[-1]))
+	dates = np.datetime_as_string(data['time'].values, unit = 'D')
+	data.close()
+	seasons = 'yes' if fname.endswith('_seasons.nc') else 'no'
+	panels = []
+
+	for idate in range(len(dates)):
+
+		if seasons == 'yes':
+			namefig = psx.figure_name(p_thresh, 'multi-year %s ' %
+									  (psx.SEASONS[idate]))
+
+		else:
+			stem = os.path.splitext(os.path.basename(fname))[0]
+			namefig = psx.figure_name(p_thresh, '%s %s ' % (stem,
+															 dates[idate]))
+
+		panels.append({'fname': fname, 'p_thresh': p_thresh,
+					   'seasons': seasons, 'idate': idate, 'extent': extent,
+					   'namefig': os.path.join(out_dir, namefig)})
+
+	return panels
+
+
+def stale(panel):
+
+	"""
+	Whether a map needs rendering: its output is missing, or older than its
+	input file or the plotting code
+
+	"""
+
+	if not os.path.isfile(panel['namefig']):
+		return True
+
+	inputs = [panel['fname'], psx.__file__, __file__]
+
+	return os.path.getmtime(panel['namefig']) < max(os.path.getmtime(f)
+													for f in inputs)
+
+
+def init_worker(basemap_cache):
+
+	"""
+	Starts a worker with the background layers projected by the parent
+
+	"""
+
+	psx._BASEMAP_CACHE.update(basemap_cache)
+
+	return
+
+
+def render(panel):
+
+	"""
+	Renders one map, opening and loading its file only once per process
+
+	"""
+
+	if panel['fname'] not in _DATA_CACHE:
+		_DATA_CACHE[panel['fname']] = psx.read_data(panel['fname'])[['sst',
+																	'anom']].load()
+
+	return psx.plot_SST_anom(_DATA_CACHE[panel['fname']], panel['p_thresh'],
+							 panel['idate'], seasons = panel['seasons'],
+							 namefig = panel['namefig'])
+
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description = __title__)
+	parser.add_argument('data_dir', nargs = '?',
+						default = os.path.join(os.getcwd(), 'SST_extremes'))
+	parser.add_argument('--processes', type = int, default = None,
+						help = 'number of processes (default: all cpus)')
+	parser.add_argument('--force', action = 'store_true',
+						help = 'render all maps, even those up to date')
+	args = parser.parse_args()
+
+	main(args.data_dir, processes = args.processes, force = args.force)
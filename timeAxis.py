@@ -0,0 +1,159 @@
+'''
+    Conversion of time coordinates (datetime64, CF-encoded numbers or
+    cftime objects) to the datetime format used by marineHeatWaves
+    (e.g., date(1982,1,1).toordinal()), and reindexing of series onto a
+    complete daily time axis
+'''
+
+
+import numpy as np
+from datetime import date
+
+
+# Ordinal of the numpy datetime64 epoch
+epoch = date(1970, 1, 1).toordinal()
+
+# Cumulative number of days before the first of each month, non-leap years
+monthStart = np.array([0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334])
+
+# Length of CF time units, in days
+unitLengths = {'days': 1., 'day': 1., 'd': 1.,
+               'hours': 1./24, 'hour': 1./24, 'h': 1./24,
+               'minutes': 1./1440, 'minute': 1./1440, 'min': 1./1440,
+               'seconds': 1./86400, 'second': 1./86400, 's': 1./86400}
+
+
+def toOrdinal(times, units=None, calendar='standard'):
+    '''
+    Converts a time coordinate to datetime format, using array arithmetic only.
+    Inputs:
+      times     Time coordinate values, as datetime64 values, numbers encoded
+                following the CF conventions (see units), or cftime/datetime objects
+    Options:
+      units     CF time units of numeric times, e.g. 'days since 1981-01-01'
+                (DEFAULT = None, times are not numeric)
+      calendar  CF calendar of numeric times. Only the standard, gregorian and
+                proleptic_gregorian calendars are supported (DEFAULT = 'standard')
+    Outputs:
+      t         Time vector, in datetime format (e.g., date(1982,1,1).toordinal())
+                [integer numpy array]. Times are truncated to the day.
+    Notes:
+      The standard CF calendar switches to the Julian calendar before 1582-10-15,
+      dates before this are treated as proleptic Gregorian.
+    '''
+
+    times = np.asarray(times)
+
+    if np.issubdtype(times.dtype, np.datetime64):
+        days = times.astype('datetime64[D]')
+        return (days - np.datetime64('1970-01-01', 'D')).astype(np.int64) + epoch
+
+    if times.dtype.kind in 'iuf':
+        if units is None:
+            raise ValueError('units are required to decode numeric times')
+        if calendar not in ['standard', 'gregorian', 'proleptic_gregorian']:
+            raise ValueError('unsupported calendar: ' + calendar)
+        step, since = units.split(' since ')
+        since = since.strip().replace('T', ' ').split()
+        year, month, day = [int(x) for x in since[0].split('-')]
+        # Time of day of the reference date, as a fraction of a day
+        frac = 0.
+        if len(since) > 1:
+            hms = [float(x) for x in since[1].rstrip('Z').split(':')]
+            frac = sum([x/y for x, y in zip(hms, [24., 1440., 86400.])])
+        ref = ymdToOrdinal(year, month, day)
+        return ref + np.floor(frac + times * unitLengths[step.strip().lower()]).astype(np.int64)
+
+    # cftime or datetime objects
+    year = np.array([d.year for d in times.ravel()])
+    month = np.array([d.month for d in times.ravel()])
+    day = np.array([d.day for d in times.ravel()])
+
+    return ymdToOrdinal(year, month, day).reshape(times.shape)
+
+
+def toDatetime64(t):
+    '''
+    Converts a time vector in datetime format to datetime64[ns] values, e.g. for
+    use as an xarray coordinate.
+    '''
+
+    days = np.asarray(t, dtype=np.int64) - epoch
+
+    return days.astype('datetime64[D]').astype('datetime64[ns]')
+
+
+def ordinalYearStart(year):
+    '''
+    Returns the date of 1 January of each year in datetime format, i.e. the
+    vectorized equivalent of date(year,1,1).toordinal() for the proleptic
+    Gregorian calendar.
+    Inputs:
+      year     Years [integer numpy array]
+    '''
+
+    y = np.asarray(year, dtype=np.int64) - 1
+
+    return 365*y + y//4 - y//100 + y//400 + 1
+
+
+def isLeap(year):
+    '''
+    Returns True for leap years (proleptic Gregorian calendar)
+    '''
+
+    year = np.asarray(year)
+
+    return (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+
+
+def ymdToOrdinal(year, month, day):
+    '''
+    Vectorized equivalent of date(year,month,day).toordinal().
+    Inputs:
+      year, month, day   Integer numpy arrays of equal shape
+    '''
+
+    year = np.asarray(year, dtype=np.int64)
+    month = np.asarray(month, dtype=np.int64)
+
+    return ordinalYearStart(year) + monthStart[month-1] + ((month > 2) & isLeap(year)) + np.asarray(day, dtype=np.int64) - 1
+
+
+def isDaily(t):
+    '''
+    Returns True if the time vector is continuous, strictly daily and increasing.
+    '''
+
+    t = np.asarray(t)
+
+    return (len(t) > 0) and (t[-1] - t[0] == len(t) - 1) and bool(np.all(np.diff(t) == 1))
+
+
+def reindexDaily(t, data, axis=0):
+    '''
+    Places a series on a complete daily time axis, in one pass. Days absent from
+    the input (gaps) are filled with NaN; for duplicated days the last value is
+    kept; unsorted input is sorted.
+    Inputs:
+      t        Time vector, in datetime format [1D numpy array of length T]
+      data     Data [numpy array whose size along axis is T]
+    Options:
+      axis     Time axis of data (DEFAULT = 0)
+    Outputs:
+      tDaily   Continuous daily time vector from min(t) to max(t)
+      dataDaily Data on tDaily, as floating point. The input arrays are
+               returned unchanged if t is already continuous and daily.
+    '''
+
+    t = np.asarray(t).astype(np.int64)
+    if isDaily(t):
+        return t, data
+
+    data = np.moveaxis(np.asarray(data), axis, 0)
+    tDaily = np.arange(t.min(), t.max()+1)
+    dtype = np.result_type(data.dtype, np.float32)
+    dataDaily = np.full((len(tDaily),) + data.shape[1:], np.nan, dtype=dtype)
+    dataDaily[t - tDaily[0]] = data
+
+    return tDaily, np.moveaxis(dataDaily, 0, axis)